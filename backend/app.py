@@ -1,17 +1,30 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
 import threading
 import time
 import os
-from pymongo import MongoClient
 from bson import ObjectId
 import logging
+import json
 
 from simulator import PowerGridSimulator
 from model_loader import ModelLoader
-from mongo_utils import MongoDBManager
+from model_registry import ModelRegistry
+from mongo_utils import MongoDBManager, decode_cursor
+from location_registry import LocationRegistry
+from stream_aggregator import StreamingAggregator
+from index_manager import RAW_DATA_WINDOW_INDEX
+from db_connection import get_client, get_pool_stats
+from response_cache import ResponseCache
+from live_feed import LiveFeed, FeedFilter
+from export import ColumnarExporter, ExportManager
+from rescore import BatchRescorer, RescoreManager
+from sharded_simulation import ShardedSimulation
+from tick_pipeline import TickPipeline
+from tick_scheduler import TickScheduler, OVERRUN_POLICIES
+from write_buffer import WriteBehindBuffer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,29 +37,96 @@ class PowerGridBackend:
     def __init__(self):
         self.simulator = None
         self.model_loader = ModelLoader()
+        
+        # Background reloads, validation and rollback of the model in model_loader
+        self.model_registry = ModelRegistry(self.model_loader)
+        self.model_registry.start_watcher()
         self.scheduler = BackgroundScheduler()
-        self.simulation_thread = None
         self.is_running = False
         self.window_duration_minutes = 1440  # Default: 1 day (1440 minutes)
         
+        # Cached API responses, invalidated by the simulator after every tick
+        self.response_cache = ResponseCache()
+        
+        # Server-Sent Events feed of every committed tick
+        self.live_feed = LiveFeed()
+        
+        # Process pool for sharded ticks (SIMULATION_WORKERS=0 keeps them in the simulation thread)
+        self.shard_engine = ShardedSimulation(self.model_loader)
+        
+        # Writer thread storing tick N while tick N+1 is generated and scored
+        self.tick_pipeline = TickPipeline()
+        
+        # Fixed-rate simulation ticks (DATA_GENERATION_INTERVAL is read once here)
+        self.tick_scheduler = TickScheduler(self.run_simulation_tick)
+        
+        # Largest page /model-outputs returns; bigger exports use format=ndjson
+        self.model_outputs_max_page_size = int(os.getenv('MODEL_OUTPUTS_MAX_PAGE_SIZE', 1000))
+        
+        # Aggregation pipeline options for large windows
+        self.aggregation_allow_disk_use = os.getenv('AGGREGATION_ALLOW_DISK_USE', 'true').lower() == 'true'
+        self.aggregation_use_index_hint = os.getenv('AGGREGATION_USE_INDEX_HINT', 'true').lower() == 'true'
+        
         # MongoDB connection
         self.setup_database()
         
-        # Initialize MongoDB manager for model outputs
-        self.mongo_manager = MongoDBManager(mongodb_uri=os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
+        # Initialize MongoDB manager for model outputs on the shared client
+        self.mongo_manager = MongoDBManager(client=self.client)
+        
+        # raw_data layout (plain or time-series) is managed by the MongoDB manager
+        self.raw_data_storage = self.mongo_manager.raw_data_storage
+        
+        # Batched background inserts of tick documents, spilled to disk while MongoDB is down
+        self.write_buffer = None
+        if os.getenv('WRITE_BUFFER_ENABLED', 'true').lower() == 'true':
+            self.write_buffer = WriteBehindBuffer(
+                {'raw_data': self.raw_data_storage.collection,
+                 'model_outputs': self.mongo_manager.model_outputs_collection},
+                on_flush=self.response_cache.bump_version,
+                # Replayed readings can land behind the rollup watermark
+                on_replay=self.mongo_manager.retention.rewind
+            )
+        
+        # Indexes for every collection are created by the MongoDB manager
+        self.index_manager = self.mongo_manager.index_manager
+        if not self.index_manager.is_created('raw_data', RAW_DATA_WINDOW_INDEX):
+            self.aggregation_use_index_hint = False
+        
+        # Background Arrow/Parquet exports of historical readings
+        self.export_manager = ExportManager(ColumnarExporter(
+            self.db, self.raw_data_storage, stores_model_outputs=self.mongo_manager.stores_model_outputs()
+        ))
+        
+        # Offline re-scoring of historical raw_data on a process pool
+        self.rescore_manager = RescoreManager(
+            BatchRescorer(self.db, self.raw_data_storage, self.model_loader.model_path,
+                          stores_model_outputs=self.mongo_manager.stores_model_outputs()),
+            retention=self.mongo_manager.retention,
+            response_cache=self.response_cache,
+            stream_aggregator=self.stream_aggregator
+        )
         
         # Start scheduler
         self.scheduler.start()
         
         # Schedule initial aggregation job
         self.schedule_aggregation_job()
+        
+        # Downsample raw data into the hourly and daily rollup tiers
+        self.scheduler.add_job(
+            func=self.mongo_manager.retention.rollup,
+            trigger="interval",
+            minutes=int(os.getenv('ROLLUP_INTERVAL_MINUTES', 15)),
+            id='rollup_job',
+            replace_existing=True
+        )
     
     def setup_database(self):
         """Setup MongoDB Atlas connection"""
         try:
             # Use environment variable for MongoDB URI in production
             mongodb_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
-            self.client = MongoClient(mongodb_uri)
+            self.client = get_client(mongodb_uri)
             self.db = self.client.power_grid_db
             self.raw_data_collection = self.db.raw_data
             self.aggregated_data_collection = self.db.aggregated_data
@@ -56,17 +136,23 @@ class PowerGridBackend:
             self.client.admin.command('ping')
             logger.info("Successfully connected to MongoDB")
             
+            # Shared cache of static location attributes
+            self.location_registry = LocationRegistry(self.locations_collection)
+            
+            # Incremental per-area counters fed by the simulator
+            self.stream_aggregator = StreamingAggregator(
+                self.location_registry,
+                self.aggregated_data_collection,
+                window_minutes=self.window_duration_minutes
+            )
+            
         except Exception as e:
             logger.error(f"Failed to connect to MongoDB: {e}")
             raise
     
     def schedule_aggregation_job(self):
         """Schedule the aggregation job based on current window duration"""
-        # Remove existing jobs
-        if self.scheduler.get_jobs():
-            self.scheduler.remove_all_jobs()
-        
-        # Add new job
+        # Add (or replace) the aggregation job
         self.scheduler.add_job(
             func=self.aggregate_data,
             trigger="interval",
@@ -82,13 +168,18 @@ class PowerGridBackend:
             return {"status": "error", "message": "Simulation is already running"}
         
         try:
-            self.simulator = PowerGridSimulator(self.model_loader, self.db)
+            self.simulator = PowerGridSimulator(
+                self.model_loader, self.db, self.location_registry, self.stream_aggregator,
+                mongo_manager=self.mongo_manager, response_cache=self.response_cache,
+                live_feed=self.live_feed,
+                shard_engine=self.shard_engine if self.shard_engine.enabled else None,
+                pipeline=self.tick_pipeline,
+                write_buffer=self.write_buffer
+            )
             self.is_running = True
             
-            # Start simulation in a separate thread
-            self.simulation_thread = threading.Thread(target=self.run_simulation)
-            self.simulation_thread.daemon = True
-            self.simulation_thread.start()
+            # Ticks run on the scheduler's thread at a fixed rate
+            self.tick_scheduler.start()
             
             logger.info("Power grid simulation started")
             return {"status": "success", "message": "Simulation started successfully"}
@@ -104,23 +195,27 @@ class PowerGridBackend:
         
         self.is_running = False
         
-        if self.simulation_thread:
-            self.simulation_thread.join(timeout=5)
+        self.tick_scheduler.stop(timeout=5)
+        
+        # Let the writer store the ticks already computed
+        if not self.tick_pipeline.drain(timeout=30):
+            logger.warning("Tick pipeline still writing after stop")
+        if self.write_buffer is not None and not self.write_buffer.flush(timeout=30):
+            logger.warning("Write buffer still flushing after stop")
+        
+        # The scheduled aggregation skips the window the streaming aggregator was filling
+        self.stream_aggregator.flush_open_window()
+        
+        # Worker processes are started again with the next simulation
+        self.shard_engine.shutdown()
         
         logger.info("Power grid simulation stopped")
         return {"status": "success", "message": "Simulation stopped successfully"}
     
-    def run_simulation(self):
-        """Run the continuous simulation loop"""
-        while self.is_running:
-            try:
-                self.simulator.generate_and_classify_data()
-                # Configurable data generation interval (default 5 seconds)
-                interval = int(os.getenv('DATA_GENERATION_INTERVAL', 5))
-                time.sleep(interval)
-            except Exception as e:
-                logger.error(f"Error in simulation loop: {e}")
-                time.sleep(5)  # Wait before retrying
+    def run_simulation_tick(self):
+        """Generate, classify and store one tick (called by the tick scheduler)"""
+        if self.is_running:
+            self.simulator.generate_and_classify_data()
     
     def set_window_duration(self, minutes):
         """Set the time window duration for aggregation"""
@@ -129,6 +224,7 @@ class PowerGridBackend:
                 return {"status": "error", "message": "Window duration must be positive"}
             
             self.window_duration_minutes = minutes
+            self.stream_aggregator.set_window_minutes(minutes)
             self.schedule_aggregation_job()  # Reschedule with new duration
             
             logger.info(f"Window duration set to {minutes} minutes")
@@ -141,43 +237,60 @@ class PowerGridBackend:
     def aggregate_data(self):
         """Aggregate data for the completed time window"""
         try:
+            # While the simulator runs, closed windows are flushed by the streaming aggregator
+            if self.stream_aggregator.is_active():
+                logger.info("Skipping scheduled aggregation, streaming aggregator is active")
+                return
+            
             current_time = datetime.now()
             window_start = current_time - timedelta(minutes=self.window_duration_minutes)
             
             logger.info(f"Starting aggregation for window: {window_start} to {current_time}")
             
-            # Get all locations
-            locations = list(self.locations_collection.find())
+            # Count total and illegal records per area in one server-side pass
+            pipeline = [
+                {
+                    '$match': {
+                        'timestamp': {
+                            '$gte': window_start,
+                            '$lt': current_time
+                        }
+                    }
+                },
+                {
+                    '$group': {
+                        '_id': '$' + self.raw_data_storage.field('area_id'),
+                        'total_count': {'$sum': 1},
+                        'illegal_count': {
+                            '$sum': {
+                                '$cond': [{'$eq': ['$classification', 'illegal']}, 1, 0]
+                            }
+                        }
+                    }
+                }
+            ]
+            
+            aggregate_options = {'allowDiskUse': self.aggregation_allow_disk_use}
+            if self.aggregation_use_index_hint:
+                aggregate_options['hint'] = self.index_manager.get_keys('raw_data', RAW_DATA_WINDOW_INDEX)
+            
+            window_counts = self.raw_data_collection.aggregate(pipeline, **aggregate_options)
             
+            # Join counts to the cached location metadata
+            snapshot = self.location_registry.get_snapshot()
             aggregation_results = []
             
-            for location in locations:
-                area_id = location['area_id']
-                
-                # Count records in the time window
-                total_count = self.raw_data_collection.count_documents({
-                    'area_id': area_id,
-                    'timestamp': {
-                        '$gte': window_start,
-                        '$lt': current_time
-                    }
-                })
+            for counts in window_counts:
+                location = snapshot.get_location(counts['_id'])
+                total_count = counts['total_count']
+                illegal_count = counts['illegal_count']
                 
-                illegal_count = self.raw_data_collection.count_documents({
-                    'area_id': area_id,
-                    'timestamp': {
-                        '$gte': window_start,
-                        '$lt': current_time
-                    },
-                    'classification': 'illegal'
-                })
-                
-                if total_count > 0:
+                if location is not None and total_count > 0:
                     illegal_percentage = (illegal_count / total_count) * 100
                     location_status = 'illegal' if illegal_percentage > 50 else 'legal'
                     
                     aggregation_result = {
-                        'area_id': area_id,
+                        'area_id': location['area_id'],
                         'district': location['district'],
                         'city': location['city'],
                         'area_name': location['area_name'],
@@ -195,7 +308,7 @@ class PowerGridBackend:
             
             # Save aggregation results
             if aggregation_results:
-                self.aggregated_data_collection.insert_many(aggregation_results)
+                self.aggregated_data_collection.insert_many(aggregation_results, ordered=False)
                 logger.info(f"Aggregated data for {len(aggregation_results)} locations")
             
         except Exception as e:
@@ -223,11 +336,23 @@ class PowerGridBackend:
             
             # Get current simulation stats
             current_time = datetime.now()
-            total_records_today = self.raw_data_collection.count_documents({
-                'timestamp': {
-                    '$gte': current_time.replace(hour=0, minute=0, second=0, microsecond=0)
-                }
-            })
+            midnight = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
+            hours_today = (current_time - midnight).total_seconds() / 3600
+            if self.stream_aggregator.covers(midnight):
+                total_records_today = self.stream_aggregator.count_since(midnight)
+            elif self.mongo_manager.retention.choose_tier(hours_today) != 'raw':
+                total_records_today = self.mongo_manager.retention.count_records(hours_today)
+            else:
+                total_records_today = self.raw_data_collection.count_documents({
+                    'timestamp': {'$gte': midnight}
+                })
+            
+            # Live partial results for the open window
+            live_window = self.stream_aggregator.get_live_window()
+            for item in live_window:
+                item['window_start'] = item['window_start'].isoformat()
+                item['window_end'] = item['window_end'].isoformat()
+                item['created_at'] = item['created_at'].isoformat()
             
             return {
                 "status": "success",
@@ -235,6 +360,7 @@ class PowerGridBackend:
                 "window_duration_minutes": self.window_duration_minutes,
                 "total_records_today": total_records_today,
                 "latest_aggregation": latest_aggregation,
+                "live_window": live_window,
                 "timestamp": current_time.isoformat()
             }
             
@@ -242,8 +368,11 @@ class PowerGridBackend:
             logger.error(f"Error getting status: {e}")
             return {"status": "error", "message": str(e)}
 
-# Initialize the backend
-backend = PowerGridBackend()
+# Initialize the backend. Spawned worker processes re-import this module as
+# __mp_main__ when the app is started with `python app.py`; they only run the
+# worker functions they were sent and must not open a second backend.
+if __name__ != '__mp_main__':
+    backend = PowerGridBackend()
 
 # Routes
 @app.route('/start', methods=['POST'])
@@ -278,21 +407,64 @@ def set_generation_interval():
         data = request.get_json()
         interval = data.get('seconds', 5)
         
-        if interval <= 0:
+        if not isinstance(interval, (int, float)) or interval <= 0:
             return jsonify({"status": "error", "message": "Interval must be positive"})
         
-        # Set environment variable for the interval
-        os.environ['DATA_GENERATION_INTERVAL'] = str(interval)
+        if data.get('overrun_policy'):
+            backend.tick_scheduler.set_overrun_policy(data['overrun_policy'])
+        
+        # Applied to the running scheduler; the next deadline moves to the new grid
+        backend.tick_scheduler.set_interval(interval)
         
         logger.info(f"Data generation interval set to {interval} seconds")
         return jsonify({
             "status": "success", 
-            "message": f"Data generation interval set to {interval} seconds"
+            "message": f"Data generation interval set to {interval} seconds",
+            "overrun_policy": backend.tick_scheduler.overrun_policy
         })
         
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
+@app.route('/simulation/shards', methods=['GET'])
+def get_shard_stats():
+    """Get sharded simulation settings, pool restarts and per-shard timings of the last tick"""
+    return jsonify({
+        "status": "success",
+        "sharding": backend.shard_engine.stats()
+    })
+
+@app.route('/simulation/scheduler', methods=['GET'])
+def get_scheduler_stats():
+    """Get tick rate, lag, missed ticks and utilization of the simulation scheduler"""
+    return jsonify({
+        "status": "success",
+        "scheduler": backend.tick_scheduler.stats(),
+        "overrun_policies": list(OVERRUN_POLICIES)
+    })
+
+@app.route('/admin/write-buffer', methods=['GET', 'POST'])
+def write_buffer_stats():
+    """Get write-behind buffer and spill statistics; POST flushes the buffer now"""
+    if backend.write_buffer is None:
+        return jsonify({"status": "error", "message": "Write buffer is disabled (WRITE_BUFFER_ENABLED=false)"})
+    
+    if request.method == 'POST':
+        backend.write_buffer.flush(timeout=30)
+    
+    return jsonify({
+        "status": "success",
+        "write_buffer": backend.write_buffer.stats()
+    })
+
+@app.route('/simulation/pipeline', methods=['GET'])
+def get_pipeline_stats():
+    """Get tick pipeline queue state, backpressure and per-stage latency histograms"""
+    return jsonify({
+        "status": "success",
+        "pipeline": backend.tick_pipeline.stats()
+    })
+
 @app.route('/set-threshold', methods=['POST'])
 def set_classification_threshold():
     """Set the classification threshold for illegal detection"""
@@ -327,7 +499,8 @@ def get_configuration():
         "configuration": {
             "simulation_running": backend.is_running,
             "window_duration_minutes": backend.window_duration_minutes,
-            "data_generation_interval_seconds": int(os.getenv('DATA_GENERATION_INTERVAL', 5)),
+            "data_generation_interval_seconds": backend.tick_scheduler.interval_seconds,
+            "tick_overrun_policy": backend.tick_scheduler.overrun_policy,
             "classification_threshold": float(os.getenv('CLASSIFICATION_THRESHOLD', 0.08)),
             "model_loaded": backend.simulator.model_loader.model is not None if backend.simulator else False,
             "model_features": backend.model_loader.get_required_features() if backend.model_loader else [],
@@ -357,39 +530,127 @@ def get_model_info():
         logger.error(f"Error in model-info endpoint: {e}")
         return jsonify({"status": "error", "message": f"Internal error: {str(e)}"})
 
+@app.route('/model/reload', methods=['POST'])
+def reload_model():
+    """Load, validate and swap in a model file from the model directory without a restart"""
+    try:
+        data = request.get_json(silent=True) or {}
+        registry = backend.model_registry
+        
+        # Only files inside the model directory can be loaded
+        path = os.path.join(registry.model_dir, os.path.basename(data['file'])) if data.get('file') else None
+        
+        reload_status = registry.reload(path, force=bool(data.get('force')), wait=bool(data.get('wait')))
+        return jsonify({
+            "status": "success",
+            "reload": reload_status
+        })
+        
+    except Exception as e:
+        logger.error(f"Error reloading model: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/model/rollback', methods=['POST'])
+def rollback_model():
+    """Swap back to a previous model version kept in memory"""
+    try:
+        data = request.get_json(silent=True) or {}
+        return jsonify({
+            "status": "success",
+            "rollback": backend.model_registry.rollback(data.get('version'))
+        })
+        
+    except Exception as e:
+        logger.error(f"Error rolling back model: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/model/versions', methods=['GET'])
+def get_model_versions():
+    """Get the active model, versions available for rollback and the last reload"""
+    return jsonify({
+        "status": "success",
+        "registry": backend.model_registry.status()
+    })
+
+@app.route('/admin/prediction-cache', methods=['GET', 'DELETE'])
+def prediction_cache_stats():
+    """Get prediction cache hit rate and size; DELETE clears it"""
+    prediction_cache = backend.model_loader.prediction_cache if backend.model_loader else None
+    if prediction_cache is None:
+        return jsonify({"status": "error", "message": "Prediction cache is disabled (PREDICTION_CACHE_SIZE=0)"})
+    
+    if request.method == 'DELETE':
+        prediction_cache.clear()
+    
+    return jsonify({
+        "status": "success",
+        "cache": prediction_cache.stats()
+    })
+
 @app.route('/model-outputs', methods=['GET'])
 def get_model_outputs():
-    """Get model outputs with optional filtering"""
+    """
+    Get model outputs with optional filtering
+    
+    Pages are returned newest first with a next_cursor token; pass it back as
+    cursor for the next page. format=ndjson streams every matching document
+    as newline-delimited JSON instead. fields limits the returned fields.
+    """
     try:
         # Get query parameters
-        limit = int(request.args.get('limit', 100))
         classification = request.args.get('classification')  # legal/illegal
         area_id = request.args.get('area_id')
         hours = int(request.args.get('hours', 24))
+        cursor = request.args.get('cursor')
+        output_format = request.args.get('format', 'json')
+        fields = request.args.get('fields')
+        fields = [field.strip() for field in fields.split(',') if field.strip()] if fields else None
         
         # Calculate date range if hours specified
         start_date = None
         if hours:
             start_date = datetime.now() - timedelta(hours=hours)
         
-        outputs = backend.mongo_manager.get_model_outputs(
-            limit=limit,
-            classification=classification,
-            area_id=area_id,
-            start_date=start_date
-        )
+        filters = {
+            "classification": classification,
+            "area_id": area_id,
+            "start_date": start_date,
+            "fields": fields
+        }
         
-        return jsonify({
-            "status": "success",
-            "count": len(outputs),
-            "filters": {
-                "limit": limit,
-                "classification": classification,
-                "area_id": area_id,
-                "hours": hours
-            },
-            "outputs": outputs
-        })
+        if output_format == 'ndjson':
+            # Stream documents as the MongoDB cursor yields them
+            limit = int(request.args.get('limit', 0))
+            after = decode_cursor(cursor) if cursor else None
+            
+            def generate():
+                for output in backend.mongo_manager.iter_model_outputs(limit=limit, after=after, **filters):
+                    yield json.dumps(output) + '\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        limit = min(int(request.args.get('limit', 100)), backend.model_outputs_max_page_size)
+        
+        def build_response():
+            page = backend.mongo_manager.get_model_outputs_page(limit=limit, cursor=cursor, **filters)
+            outputs = page["outputs"]
+            
+            return {
+                "status": "success",
+                "count": len(outputs),
+                "filters": {
+                    "limit": limit,
+                    "classification": classification,
+                    "area_id": area_id,
+                    "hours": hours
+                },
+                "next_cursor": page["next_cursor"],
+                "outputs": outputs
+            }
+        
+        params = {"limit": limit, "classification": classification, "area_id": area_id, "hours": hours,
+                  "cursor": cursor, "fields": ",".join(fields) if fields else None}
+        return jsonify(backend.response_cache.get_or_compute('model-outputs', params, build_response))
         
     except Exception as e:
         logger.error(f"Error getting model outputs: {e}")
@@ -401,14 +662,22 @@ def get_location_summary():
     try:
         hours = int(request.args.get('hours', 24))
         
-        summary = backend.mongo_manager.get_location_summary(hours=hours)
+        def build_response():
+            # Serve from in-memory counters when they hold the whole window; these start at
+            # the bucket holding the window start (at most STREAM_BUCKET_MINUTES earlier)
+            if backend.stream_aggregator.covers(datetime.now() - timedelta(hours=hours)):
+                summary = backend.stream_aggregator.get_location_summary(hours=hours)
+            else:
+                summary = backend.mongo_manager.get_location_summary(hours=hours)
+            
+            return {
+                "status": "success",
+                "time_window_hours": hours,
+                "locations_count": len(summary),
+                "summary": summary
+            }
         
-        return jsonify({
-            "status": "success",
-            "time_window_hours": hours,
-            "locations_count": len(summary),
-            "summary": summary
-        })
+        return jsonify(backend.response_cache.get_or_compute('location-summary', {"hours": hours}, build_response))
         
     except Exception as e:
         logger.error(f"Error getting location summary: {e}")
@@ -420,12 +689,15 @@ def get_classification_stats():
     try:
         hours = int(request.args.get('hours', 24))
         
-        stats = backend.mongo_manager.get_classification_stats(hours=hours)
+        def build_response():
+            stats = backend.mongo_manager.get_classification_stats(hours=hours)
+            
+            return {
+                "status": "success",
+                "statistics": stats
+            }
         
-        return jsonify({
-            "status": "success",
-            "statistics": stats
-        })
+        return jsonify(backend.response_cache.get_or_compute('classification-stats', {"hours": hours}, build_response))
         
     except Exception as e:
         logger.error(f"Error getting classification stats: {e}")
@@ -438,24 +710,257 @@ def get_illegal_locations():
         limit = int(request.args.get('limit', 50))
         hours = int(request.args.get('hours', 24))
         
-        # Get only illegal classifications
-        illegal_outputs = backend.mongo_manager.get_model_outputs(
-            limit=limit,
-            classification='illegal',
-            start_date=datetime.now() - timedelta(hours=hours)
+        def build_response():
+            # Get only illegal classifications
+            illegal_outputs = backend.mongo_manager.get_model_outputs(
+                limit=limit,
+                classification='illegal',
+                start_date=datetime.now() - timedelta(hours=hours)
+            )
+            
+            return {
+                "status": "success",
+                "count": len(illegal_outputs),
+                "time_window_hours": hours,
+                "illegal_locations": illegal_outputs
+            }
+        
+        params = {"limit": limit, "hours": hours}
+        return jsonify(backend.response_cache.get_or_compute('illegal-locations', params, build_response))
+        
+    except Exception as e:
+        logger.error(f"Error getting illegal locations: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/locations', methods=['GET'])
+def get_locations():
+    """Get all monitored locations from the location registry"""
+    try:
+        snapshot = backend.location_registry.get_snapshot()
+        
+        return jsonify({
+            "status": "success",
+            "registry_version": snapshot.version,
+            "count": len(snapshot),
+            "locations": snapshot.locations
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting locations: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/live-feed', methods=['GET'])
+def live_feed():
+    """Stream classified records of every tick as Server-Sent Events"""
+    def split_param(name):
+        value = request.args.get(name)
+        return [item.strip() for item in value.split(',') if item.strip()] if value else None
+    
+    feed_filter = FeedFilter(
+        area_ids=split_param('area_id'),
+        districts=split_param('district'),
+        classification=request.args.get('classification')
+    )
+    
+    # Resume after the last sequence number the client received
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    last_sequence = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    
+    # The stream occupies a server thread until the client leaves; gunicorn needs
+    # threaded (gthread) or gevent workers, see render.yaml
+    return Response(
+        stream_with_context(backend.live_feed.subscribe(feed_filter, last_sequence)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/live-feed/stats', methods=['GET'])
+def live_feed_stats():
+    """Get live feed sequence number and subscriber counts"""
+    return jsonify({
+        "status": "success",
+        "live_feed": backend.live_feed.stats()
+    })
+
+@app.route('/exports', methods=['GET', 'POST'])
+def exports():
+    """List export jobs; POST starts an Arrow IPC or Parquet export in the background"""
+    try:
+        if request.method == 'GET':
+            return jsonify({
+                "status": "success",
+                "exports": backend.export_manager.list_jobs()
+            })
+        
+        data = request.get_json() or {}
+        
+        # Time range from explicit start/end or the last N hours
+        start = datetime.fromisoformat(data['start']) if data.get('start') else None
+        end = datetime.fromisoformat(data['end']) if data.get('end') else None
+        if start is None and data.get('hours'):
+            start = datetime.now() - timedelta(hours=float(data['hours']))
+        
+        area_ids = data.get('area_ids') or data.get('area_id')
+        if isinstance(area_ids, str):
+            area_ids = [area_id.strip() for area_id in area_ids.split(',') if area_id.strip()]
+        
+        job = backend.export_manager.submit(
+            dataset=data.get('dataset', 'raw_data'),
+            export_format=data.get('format', 'parquet'),
+            start=start,
+            end=end,
+            area_ids=area_ids
         )
         
         return jsonify({
             "status": "success",
-            "count": len(illegal_outputs),
-            "time_window_hours": hours,
-            "illegal_locations": illegal_outputs
+            "message": "Export started",
+            "export": job
         })
         
     except Exception as e:
-        logger.error(f"Error getting illegal locations: {e}")
+        logger.error(f"Error in exports endpoint: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/exports/<job_id>', methods=['GET'])
+def export_status(job_id):
+    """Get progress of an export job"""
+    job = backend.export_manager.get_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Export {job_id} not found"})
+    
+    return jsonify({
+        "status": "success",
+        "export": job
+    })
+
+@app.route('/exports/<job_id>/download', methods=['GET'])
+def download_export(job_id):
+    """Download the file of a completed export job"""
+    job = backend.export_manager.get_job(job_id)
+    if job is None or job['state'] != 'completed':
+        return jsonify({"status": "error", "message": f"Export {job_id} is not available for download"})
+    
+    return send_file(job['path'], as_attachment=True, download_name=os.path.basename(job['path']))
+
+@app.route('/admin/rescore', methods=['GET', 'POST'])
+def rescore():
+    """List rescore jobs; POST starts a job (or resumes job_id) re-scoring historical raw_data"""
+    try:
+        rescore_manager = backend.rescore_manager
+        if request.method == 'GET':
+            return jsonify({
+                "status": "success",
+                "jobs": rescore_manager.rescorer.list_jobs()
+            })
+        
+        data = request.get_json() or {}
+        
+        if data.get('job_id'):
+            job = rescore_manager.start(job_id=data['job_id'])
+        else:
+            start = datetime.fromisoformat(data['start']) if data.get('start') else None
+            end = datetime.fromisoformat(data['end']) if data.get('end') else None
+            if start is None and data.get('hours'):
+                start = datetime.now() - timedelta(hours=float(data['hours']))
+            
+            area_ids = data.get('area_ids') or data.get('area_id')
+            if isinstance(area_ids, str):
+                area_ids = [area_id.strip() for area_id in area_ids.split(',') if area_id.strip()]
+            
+            job = rescore_manager.start(
+                threshold=float(data.get('threshold', os.getenv('CLASSIFICATION_THRESHOLD', 0.08))),
+                start=start,
+                end=end,
+                area_ids=area_ids,
+                model_path=backend.model_loader.model_path
+            )
+        
+        return jsonify({
+            "status": "success",
+            "message": "Rescore started",
+            "job": job
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in rescore endpoint: {e}")
         return jsonify({"status": "error", "message": str(e)})
 
+@app.route('/admin/rescore/<job_id>', methods=['GET'])
+def rescore_status(job_id):
+    """Get progress of a rescore job"""
+    job = backend.rescore_manager.rescorer.get_status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Rescore job {job_id} not found"})
+    
+    return jsonify({
+        "status": "success",
+        "job": job
+    })
+
+@app.route('/admin/indexes', methods=['GET'])
+def get_index_report():
+    """Get declared indexes, $indexStats usage and query plans for every collection"""
+    try:
+        return jsonify({
+            "status": "success",
+            "indexes": backend.index_manager.report()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting index report: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/admin/db-pool', methods=['GET'])
+def get_db_pool_stats():
+    """Get shared MongoDB connection pool settings and checkout metrics"""
+    try:
+        return jsonify({
+            "status": "success",
+            "pool": get_pool_stats()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting connection pool stats: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/admin/storage', methods=['GET'])
+def get_storage_status():
+    """Get raw_data and model_outputs storage modes and migration progress"""
+    return jsonify({
+        "status": "success",
+        "raw_data": backend.raw_data_storage.status(),
+        "model_outputs": {"mode": backend.mongo_manager.model_outputs_storage}
+    })
+
+@app.route('/admin/retention', methods=['GET', 'POST'])
+def retention_status():
+    """Get retention tiers and rollup progress; POST runs a rollup now"""
+    try:
+        retention = backend.mongo_manager.retention
+        result = {"status": "success"}
+        
+        if request.method == 'POST':
+            result["rollup"] = retention.rollup()
+        
+        result["retention"] = retention.status()
+        return jsonify(result)
+        
+    except Exception as e:
+        logger.error(f"Error in retention endpoint: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/admin/cache', methods=['GET', 'DELETE'])
+def response_cache_stats():
+    """Get response cache statistics; DELETE invalidates every entry"""
+    if request.method == 'DELETE':
+        backend.response_cache.bump_version()
+    
+    return jsonify({
+        "status": "success",
+        "cache": backend.response_cache.stats()
+    })
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
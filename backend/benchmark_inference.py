@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Inference benchmark for the power grid fraud detection model
+Compares the native Booster.inplace_predict engine and the compiled
+NumPy engine with predict_proba for single records and batches of
+increasing size
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from feature_config import SAMPLE_DATA_ROW, build_feature_matrix
+from model_loader import ModelLoader
+
+def time_engine(model_loader, feature_matrix, repeats):
+    """Median seconds per predict_probabilities call"""
+    model_loader.predict_probabilities(feature_matrix)  # Warm-up
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        model_loader.predict_probabilities(feature_matrix)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings))
+
+def run_benchmark(model_path, batch_sizes, repeats, nthread):
+    loaders = {
+        'sklearn': ModelLoader(model_path, inference_engine='sklearn', nthread=nthread),
+        'booster': ModelLoader(model_path, inference_engine='booster', nthread=nthread),
+        'compiled': ModelLoader(model_path, inference_engine='compiled', nthread=nthread)
+    }
+    engines = {name: loader._scorer[2] for name, loader in loaders.items()}
+    if engines['booster'] != 'booster':
+        print("⚠️  Model has no usable XGBoost booster; booster run uses predict_proba")
+    if engines['compiled'] != 'compiled':
+        print("⚠️  Model could not be compiled; compiled run uses predict_proba")
+
+    # Sample rows with some noise so trees take different paths
+    rng = np.random.default_rng(42)
+    base = build_feature_matrix([SAMPLE_DATA_ROW] * max(batch_sizes))
+    base[:, :12] *= rng.uniform(0.8, 1.2, size=(len(base), 12)).astype(np.float32)
+
+    print(f"{'rows':>8} {'predict_proba':>16} {'inplace_predict':>16} {'compiled':>16}")
+    for batch_size in batch_sizes:
+        feature_matrix = np.ascontiguousarray(base[:batch_size])
+        sklearn_seconds = time_engine(loaders['sklearn'], feature_matrix, repeats)
+        booster_seconds = time_engine(loaders['booster'], feature_matrix, repeats)
+        compiled_seconds = time_engine(loaders['compiled'], feature_matrix, repeats)
+        print(f"{batch_size:>8} {sklearn_seconds * 1e6:>13.1f} µs {booster_seconds * 1e6:>13.1f} µs "
+              f"{compiled_seconds * 1e6:>13.1f} µs")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark model inference engines")
+    parser.add_argument('--model', default='model/model.joblib')
+    parser.add_argument('--batch-sizes', default='1,8,64,512,4096,32768')
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--nthread', type=int, help="Booster threads (default: model setting)")
+    args = parser.parse_args()
+
+    run_benchmark(args.model, [int(size) for size in args.batch_sizes.split(',')], args.repeats, args.nthread)
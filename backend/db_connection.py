@@ -0,0 +1,151 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from pymongo import MongoClient
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool checkouts and how long threads wait for a connection"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.checkout_failures = 0
+            self.connections_created = 0
+            self.connections_closed = 0
+            self.pool_clears = 0
+            self.total_wait_ms = 0.0
+            self.max_wait_ms = 0.0
+
+    # Checkout events fire on the thread that waits, so the start time is thread-local
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, 'started', None)
+        wait_ms = (time.perf_counter() - started) * 1000 if started is not None else 0.0
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checkins += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'in_use': self.checkouts - self.checkins,
+                'checkout_failures': self.checkout_failures,
+                'connections_created': self.connections_created,
+                'connections_closed': self.connections_closed,
+                'open_connections': self.connections_created - self.connections_closed,
+                'pool_clears': self.pool_clears,
+                'avg_wait_ms': round(self.total_wait_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait_ms, 3)
+            }
+
+# One client (and one connection pool) per URI for the whole process
+_clients = {}
+_clients_lock = threading.Lock()
+pool_metrics = PoolMetricsListener()
+
+def get_client_options() -> Dict:
+    """Connection pool, timeout and write concern options from the environment"""
+    options = {
+        'maxPoolSize': int(os.getenv('MONGODB_MAX_POOL_SIZE', 50)),
+        'minPoolSize': int(os.getenv('MONGODB_MIN_POOL_SIZE', 0)),
+        'serverSelectionTimeoutMS': int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 10000)),
+        'connectTimeoutMS': int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', 10000)),
+    }
+
+    if os.getenv('MONGODB_SOCKET_TIMEOUT_MS'):
+        options['socketTimeoutMS'] = int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS'))
+    if os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS'):
+        options['waitQueueTimeoutMS'] = int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS'))
+
+    # Write concern: a node count or a tag such as 'majority'
+    write_concern = os.getenv('MONGODB_WRITE_CONCERN')
+    if write_concern:
+        options['w'] = int(write_concern) if write_concern.isdigit() else write_concern
+    if os.getenv('MONGODB_JOURNAL'):
+        options['journal'] = os.getenv('MONGODB_JOURNAL').lower() == 'true'
+
+    return options
+
+def get_client(mongodb_uri: Optional[str] = None) -> MongoClient:
+    """Get the shared MongoClient for a URI, creating it on first use"""
+    mongodb_uri = mongodb_uri or os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+
+    with _clients_lock:
+        client = _clients.get(mongodb_uri)
+        if client is None:
+            options = get_client_options()
+            client = MongoClient(mongodb_uri, event_listeners=[pool_metrics], **options)
+            _clients[mongodb_uri] = client
+            logger.info(f"Created shared MongoDB client (maxPoolSize={options['maxPoolSize']})")
+        return client
+
+def get_database(mongodb_uri: Optional[str] = None):
+    """Get the power grid database on the shared client"""
+    return get_client(mongodb_uri).power_grid_db
+
+def get_pool_stats() -> Dict:
+    """Pool metrics plus the options the shared clients were created with"""
+    return {
+        'clients': len(_clients),
+        'options': get_client_options(),
+        'metrics': pool_metrics.get_stats()
+    }
+
+def close_clients():
+    """Close every shared client (process shutdown)"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+atexit.register(close_clients)
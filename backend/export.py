@@ -0,0 +1,288 @@
+"""
+Columnar bulk export of historical readings to Apache Arrow IPC or Parquet
+
+Exports read raw_data (or model_outputs) in chunks straight from the
+MongoDB cursor and write one record batch per chunk. Memory stays bounded
+by the chunk size, whatever the time range.
+
+Usage as a CLI:
+    python export.py --dataset raw_data --format parquet \
+        --start 2024-06-01T00:00 --end 2024-07-01T00:00 --area-id KL_0001,KL_0002
+"""
+
+import argparse
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Export is unavailable without pyarrow; the rest of the backend still runs
+    pa = None
+    pq = None
+
+from feature_config import BASIC_FEATURES, MODEL_FEATURES, build_feature_matrix
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DATASETS = ('raw_data', 'model_outputs')
+EXPORT_FORMATS = {'arrow': '.arrow', 'parquet': '.parquet'}
+
+# Identifying and label columns written alongside the model features
+ID_COLUMNS = ['area_id', 'district', 'city', 'area_name', 'area_type']
+LABEL_COLUMNS = ['classification', 'illegal_probability']
+MODEL_OUTPUT_COLUMNS = ['area_id', 'district', 'city', 'area_name', 'latitude', 'longitude',
+                        'year', 'month', 'classification', 'illegal_probability']
+
+def build_schema(dataset: str):
+    """Arrow schema of an export; raw_data carries the 38 MODEL_FEATURES columns"""
+    if dataset == 'raw_data':
+        return pa.schema(
+            [pa.field('timestamp', pa.timestamp('ms'))] +
+            [pa.field(name, pa.string()) for name in ID_COLUMNS] +
+            [pa.field(name, pa.float32()) for name in MODEL_FEATURES] +
+            [pa.field('classification', pa.string()), pa.field('illegal_probability', pa.float64())]
+        )
+
+    types = {'latitude': pa.float64(), 'longitude': pa.float64(), 'year': pa.int32(), 'month': pa.int32(),
+             'illegal_probability': pa.float64()}
+    return pa.schema(
+        [pa.field('timestamp', pa.timestamp('ms'))] +
+        [pa.field(name, types.get(name, pa.string())) for name in MODEL_OUTPUT_COLUMNS]
+    )
+
+class ColumnarExporter:
+    """Writes one dataset, time range and area filter to an Arrow IPC or Parquet file"""
+
+    def __init__(self, database, raw_data_storage, stores_model_outputs: bool = False, chunk_size: int = None):
+        self.db = database
+        self.raw_data_storage = raw_data_storage
+        self.stores_model_outputs = stores_model_outputs
+        self.chunk_size = chunk_size or int(os.getenv('EXPORT_CHUNK_SIZE', 50000))
+
+    def _source(self, dataset: str, start: Optional[datetime], end: Optional[datetime],
+                area_ids: Optional[List[str]]):
+        """Collection, filter and projection for a dataset"""
+        query = {}
+        if start or end:
+            query['timestamp'] = {}
+            if start:
+                query['timestamp']['$gte'] = start
+            if end:
+                query['timestamp']['$lt'] = end
+        if area_ids:
+            query['area_id'] = {'$in': area_ids}
+
+        if dataset == 'model_outputs' and self.stores_model_outputs:
+            projection = {field: 1 for field in ['timestamp'] + MODEL_OUTPUT_COLUMNS}
+            projection['_id'] = 0
+            return self.db.model_outputs, query, projection, False
+
+        # model_outputs views and projections are derived from raw_data, so read it directly
+        if dataset == 'raw_data':
+            fields = ['timestamp'] + ID_COLUMNS + LABEL_COLUMNS + BASIC_FEATURES
+        else:
+            fields = ['timestamp'] + MODEL_OUTPUT_COLUMNS
+        projection = {self.raw_data_storage.field(field): 1 for field in fields}
+        projection['_id'] = 0
+        return self.raw_data_storage.collection, self.raw_data_storage.translate_query(query), projection, True
+
+    def count(self, dataset: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+              area_ids: Optional[List[str]] = None) -> int:
+        collection, query, _, _ = self._source(dataset, start, end, area_ids)
+        return collection.count_documents(query)
+
+    def build_batch(self, dataset: str, records: List[Dict], schema):
+        """Record batch for one chunk of flat records"""
+        columns = [pa.array([record.get('timestamp') for record in records], pa.timestamp('ms'))]
+
+        if dataset == 'raw_data':
+            columns.extend(pa.array([record.get(name) for record in records], pa.string()) for name in ID_COLUMNS)
+            # Same column layout as the model input, one contiguous array per feature
+            features = np.ascontiguousarray(build_feature_matrix(records).T)
+            columns.extend(pa.array(features[index]) for index in range(len(MODEL_FEATURES)))
+            columns.append(pa.array([record.get('classification') for record in records], pa.string()))
+            columns.append(pa.array([record.get('illegal_probability') for record in records], pa.float64()))
+        else:
+            columns.extend(
+                pa.array([record.get(name) for record in records], schema.field(name).type)
+                for name in MODEL_OUTPUT_COLUMNS
+            )
+
+        return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    def export(self, dataset: str, export_format: str, path: str, start: Optional[datetime] = None,
+               end: Optional[datetime] = None, area_ids: Optional[List[str]] = None,
+               progress=None) -> int:
+        """
+        Stream a dataset into an export file
+
+        Args:
+            dataset: raw_data or model_outputs
+            export_format: arrow (IPC file) or parquet
+            path: Output file path
+            start: Include records at or after this time
+            end: Include records before this time
+            area_ids: Only include these areas
+            progress: Called with the running row count after every chunk
+
+        Returns:
+            int: Number of rows written
+        """
+        if pa is None:
+            raise RuntimeError("pyarrow is not installed")
+        if dataset not in EXPORT_DATASETS:
+            raise ValueError(f"Unknown dataset '{dataset}'")
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown format '{export_format}'")
+
+        schema = build_schema(dataset)
+        collection, query, projection, flatten = self._source(dataset, start, end, area_ids)
+        cursor = collection.find(query, projection).sort('timestamp', 1).batch_size(self.chunk_size)
+
+        if export_format == 'parquet':
+            writer = pq.ParquetWriter(path, schema, compression=os.getenv('EXPORT_PARQUET_COMPRESSION', 'zstd'))
+        else:
+            writer = pa.ipc.new_file(path, schema)
+
+        rows = 0
+        try:
+            chunk = []
+            for document in cursor:
+                chunk.append(self.raw_data_storage.flatten(document) if flatten else document)
+                if len(chunk) >= self.chunk_size:
+                    writer.write_batch(self.build_batch(dataset, chunk, schema))
+                    rows += len(chunk)
+                    chunk = []
+                    if progress:
+                        progress(rows)
+            if chunk:
+                writer.write_batch(self.build_batch(dataset, chunk, schema))
+                rows += len(chunk)
+                if progress:
+                    progress(rows)
+        finally:
+            writer.close()
+            cursor.close()
+
+        return rows
+
+class ExportManager:
+    """Runs exports on a background worker and tracks their progress"""
+
+    def __init__(self, exporter: ColumnarExporter, export_dir: str = None, max_workers: int = None):
+        self.exporter = exporter
+        self.export_dir = export_dir or os.getenv('EXPORT_DIR', os.path.join(os.path.dirname(__file__), 'exports'))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or int(os.getenv('EXPORT_WORKERS', 1)),
+                                           thread_name_prefix='export')
+        self._lock = threading.Lock()
+        self.jobs = {}
+
+    def submit(self, dataset: str, export_format: str, start: Optional[datetime] = None,
+               end: Optional[datetime] = None, area_ids: Optional[List[str]] = None) -> Dict:
+        """Queue an export and return its job record"""
+        if pa is None:
+            raise RuntimeError("pyarrow is not installed")
+        if dataset not in EXPORT_DATASETS:
+            raise ValueError(f"Unknown dataset '{dataset}'")
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown format '{export_format}'")
+
+        os.makedirs(self.export_dir, exist_ok=True)
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            'id': job_id,
+            'state': 'queued',
+            'dataset': dataset,
+            'format': export_format,
+            'start': start.isoformat() if start else None,
+            'end': end.isoformat() if end else None,
+            'area_ids': area_ids,
+            'path': os.path.join(self.export_dir, f"{dataset}_{job_id}{EXPORT_FORMATS[export_format]}"),
+            'rows_written': 0,
+            'total_rows': None,
+            'progress': 0.0,
+            'created_at': datetime.now().isoformat()
+        }
+        with self._lock:
+            self.jobs[job_id] = job
+
+        self.executor.submit(self._run, job, start, end)
+        return dict(job)
+
+    def _run(self, job: Dict, start: Optional[datetime], end: Optional[datetime]):
+        job['state'] = 'running'
+        job['started_at'] = datetime.now().isoformat()
+        try:
+            job['total_rows'] = self.exporter.count(job['dataset'], start, end, job['area_ids'])
+
+            def progress(rows):
+                job['rows_written'] = rows
+                if job['total_rows']:
+                    job['progress'] = round(min(rows / job['total_rows'], 1.0), 4)
+
+            rows = self.exporter.export(job['dataset'], job['format'], job['path'],
+                                        start, end, job['area_ids'], progress=progress)
+
+            job['rows_written'] = rows
+            job['progress'] = 1.0
+            job['size_bytes'] = os.path.getsize(job['path'])
+            job['state'] = 'completed'
+            logger.info(f"Export {job['id']} wrote {rows} rows to {job['path']}")
+
+        except Exception as e:
+            job['state'] = 'failed'
+            job['error'] = str(e)
+            logger.error(f"Export {job['id']} failed: {e}")
+
+        finally:
+            job['finished_at'] = datetime.now().isoformat()
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list_jobs(self) -> List[Dict]:
+        with self._lock:
+            return [dict(job) for job in self.jobs.values()]
+
+def main():
+    from db_connection import get_database
+    from raw_data_storage import RawDataStorage
+
+    parser = argparse.ArgumentParser(description="Export historical readings to Arrow IPC or Parquet")
+    parser.add_argument('--dataset', choices=EXPORT_DATASETS, default='raw_data')
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='parquet')
+    parser.add_argument('--start', type=datetime.fromisoformat, help="ISO start time (inclusive)")
+    parser.add_argument('--end', type=datetime.fromisoformat, help="ISO end time (exclusive)")
+    parser.add_argument('--area-id', help="Comma separated area IDs")
+    parser.add_argument('--output', help="Output file (default: <dataset><extension> in the current directory)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    database = get_database()
+    exporter = ColumnarExporter(
+        database, RawDataStorage(database),
+        stores_model_outputs=os.getenv('MODEL_OUTPUTS_STORAGE', 'view').lower() == 'collection'
+    )
+
+    area_ids = [area_id.strip() for area_id in args.area_id.split(',')] if args.area_id else None
+    output = args.output or f"{args.dataset}{EXPORT_FORMATS[args.format]}"
+    total = exporter.count(args.dataset, args.start, args.end, area_ids)
+
+    def progress(rows):
+        logger.info(f"Exported {rows}/{total} rows")
+
+    rows = exporter.export(args.dataset, args.format, output, args.start, args.end, area_ids, progress=progress)
+    logger.info(f"Wrote {rows} rows to {output}")
+
+if __name__ == '__main__':
+    main()
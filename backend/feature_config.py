@@ -3,6 +3,10 @@ Feature configuration for the power grid fraud detection model.
 This file documents the feature mapping and data preprocessing rules.
 """
 
+from datetime import datetime
+
+import numpy as np
+
 # Original dataset features
 ORIGINAL_FEATURES = [
     'area_id', 'district', 'city', 'area_name', 'latitude', 'longitude',
@@ -82,6 +86,43 @@ TIMESTAMP_DUMMIES = [
     'timestamp_2024-12-01'
 ]
 
+# Basic (non-dummy) features and where the timestamp dummies start in MODEL_FEATURES
+BASIC_FEATURES = MODEL_FEATURES[:15]
+TIMESTAMP_DUMMY_OFFSET = len(BASIC_FEATURES)
+
+# Column index of every model feature
+FEATURE_INDEX = {feature: index for index, feature in enumerate(MODEL_FEATURES)}
+
+# Feature blocks by how often they change: per location, per tick and per record
+STATIC_FEATURES = ['latitude', 'longitude', 'households', 'distance_to_substation_km']
+TEMPORAL_FEATURES = ['year', 'month', 'is_summer', 'is_monsoon', 'is_winter'] + TIMESTAMP_DUMMIES
+DYNAMIC_FEATURES = [
+    'local_incident_reports', 'expected_consumption_kwh', 'voltage_reading_v',
+    'current_reading_a', 'power_factor', 'load_factor'
+]
+STATIC_COLUMNS = np.array([FEATURE_INDEX[feature] for feature in STATIC_FEATURES])
+TEMPORAL_COLUMNS = np.array([FEATURE_INDEX[feature] for feature in TEMPORAL_FEATURES])
+DYNAMIC_COLUMNS = np.array([FEATURE_INDEX[feature] for feature in DYNAMIC_FEATURES])
+
+# Values used when a record does not provide a basic feature
+FEATURE_DEFAULTS = {
+    'latitude': 0.0,
+    'longitude': 0.0,
+    'households': 0,
+    'distance_to_substation_km': 0.0,
+    'local_incident_reports': 0,
+    'year': 2024,
+    'month': 1,
+    'expected_consumption_kwh': 0.0,
+    'voltage_reading_v': 220.0,
+    'current_reading_a': 0.0,
+    'power_factor': 0.8,
+    'load_factor': 0.6,
+    'is_summer': 0,
+    'is_monsoon': 0,
+    'is_winter': 1
+}
+
 # Feature data types and ranges (for validation) - Updated with realistic power grid values
 FEATURE_SPECS = {
     'latitude': {'type': 'float', 'min': 8.0, 'max': 13.0},     # Kerala bounds specifically
@@ -187,6 +228,106 @@ def create_timestamp_dummies(timestamp_str):
     
     return timestamp_features
 
+def timestamp_dummy_index(timestamp):
+    """Return the MODEL_FEATURES column of the dummy for a timestamp, or -1 if none applies"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    
+    # First dummy is 2023-02, one column per month after that
+    month_offset = (timestamp.year - 2023) * 12 + timestamp.month - 2
+    if 0 <= month_offset < len(TIMESTAMP_DUMMIES):
+        return TIMESTAMP_DUMMY_OFFSET + month_offset
+    return -1
+
+def build_temporal_block(timestamp, season_flags):
+    """
+    Encode the features shared by every record of a tick in TEMPORAL_FEATURES order
+    
+    Args:
+        timestamp: Tick datetime
+        season_flags: Dict with is_summer, is_monsoon and is_winter
+    
+    Returns:
+        np.ndarray: float32 vector of len(TEMPORAL_FEATURES)
+    """
+    block = np.zeros(len(TEMPORAL_FEATURES), dtype=np.float32)
+    block[:5] = [timestamp.year, timestamp.month, season_flags['is_summer'],
+                 season_flags['is_monsoon'], season_flags['is_winter']]
+    column = timestamp_dummy_index(timestamp)
+    if column >= 0:
+        block[5 + column - TIMESTAMP_DUMMY_OFFSET] = 1.0
+    return block
+
+def assemble_feature_matrix(static_block, temporal_block, dynamic_block, out=None):
+    """
+    Build a float32 (n, 38) model input from precomputed feature blocks
+    
+    Args:
+        static_block: (n, len(STATIC_FEATURES)) per-location attributes
+        temporal_block: (len(TEMPORAL_FEATURES),) features shared by the whole tick
+        dynamic_block: (n, len(DYNAMIC_FEATURES)) per-record readings
+        out: Optional preallocated float32 array with at least n rows
+    
+    Returns:
+        np.ndarray: Feature matrix in MODEL_FEATURES order
+    """
+    n_rows = len(dynamic_block)
+    if out is None:
+        out = np.empty((n_rows, len(MODEL_FEATURES)), dtype=np.float32)
+    matrix = out[:n_rows]
+    
+    matrix[:, STATIC_COLUMNS] = static_block
+    matrix[:, TEMPORAL_COLUMNS] = temporal_block  # Broadcast to every row
+    matrix[:, DYNAMIC_COLUMNS] = dynamic_block
+    return matrix
+
+def build_feature_matrix(records, out=None):
+    """
+    Encode a batch of records into a float32 (n, 38) array in MODEL_FEATURES order
+    
+    Args:
+        records: List of record dictionaries. Each record either has a 'timestamp'
+            or already carries its timestamp_* dummy columns
+        out: Optional preallocated float32 array with at least len(records) rows
+    
+    Returns:
+        np.ndarray: Feature matrix with one row per record
+    """
+    n_rows = len(records)
+    if out is None:
+        out = np.empty((n_rows, len(MODEL_FEATURES)), dtype=np.float32)
+    matrix = out[:n_rows]
+    
+    # Basic features are filled a column at a time
+    for column, feature in enumerate(BASIC_FEATURES):
+        default = FEATURE_DEFAULTS[feature]
+        matrix[:, column] = [record.get(feature, default) for record in records]
+    
+    # Timestamp one-hot is set by column index; records in the same month share a lookup
+    matrix[:, TIMESTAMP_DUMMY_OFFSET:] = 0.0
+    month_columns = {}
+    for row, record in enumerate(records):
+        timestamp = record.get('timestamp')
+        if timestamp is None:
+            # Use existing timestamp dummies from the record
+            for column, dummy in enumerate(TIMESTAMP_DUMMIES, TIMESTAMP_DUMMY_OFFSET):
+                if dummy in record:
+                    matrix[row, column] = record[dummy]
+            continue
+        
+        try:
+            key = timestamp if isinstance(timestamp, str) else (timestamp.year, timestamp.month)
+            column = month_columns.get(key)
+            if column is None:
+                column = month_columns[key] = timestamp_dummy_index(timestamp)
+            if column >= 0:
+                matrix[row, column] = 1.0
+        except Exception as e:
+            print(f"Error processing timestamp {timestamp}: {e}")
+            # Keep all dummies as 0 if there's an error
+    
+    return matrix
+
 def preprocess_record(record):
     """Preprocess a data record for model input"""
     try:
@@ -0,0 +1,202 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Index used by the aggregation job to scan a raw_data time window
+RAW_DATA_WINDOW_INDEX = [('timestamp', 1), ('area_id', 1)]
+
+# Declared indexes for every collection, matched to the queries that use them
+INDEX_SPECS = {
+    'raw_data': [
+        {'keys': RAW_DATA_WINDOW_INDEX,
+         'purpose': 'aggregate_data window $group, get_status records today'},
+        {'keys': [('area_id', 1), ('timestamp', -1), ('_id', -1)],
+         'purpose': 'PowerGridSimulator.get_location_stats, model_outputs view by area'},
+        {'keys': [('classification', 1), ('timestamp', -1), ('_id', -1)],
+         'purpose': 'model_outputs view by classification'},
+        {'keys': [('timestamp', -1), ('_id', -1)],
+         'purpose': 'model_outputs view keyset pagination'}
+    ],
+    'aggregated_data': [
+        {'keys': [('created_at', -1)],
+         'purpose': 'get_status latest aggregation'}
+    ],
+    'model_outputs': [
+        {'keys': [('area_id', 1), ('timestamp', -1), ('_id', -1)],
+         'purpose': 'get_model_outputs filtered by area'},
+        {'keys': [('classification', 1), ('timestamp', -1), ('_id', -1)],
+         'purpose': 'get_model_outputs / illegal-locations filtered by classification'},
+        {'keys': [('timestamp', -1), ('_id', -1)],
+         'purpose': 'location summary and classification stats windows, get_model_outputs keyset pagination'},
+        {'keys': [('classification', 1)],
+         'purpose': 'classification filters without a time window'},
+        {'keys': [('location.coordinates', '2d')],
+         'purpose': 'geospatial queries'}
+    ],
+    'locations': [
+        {'keys': [('area_id', 1)], 'options': {'unique': True},
+         'purpose': 'location lookups by area'}
+    ],
+    'rollup_hourly': [
+        {'keys': [('area_id', 1), ('bucket_start', 1)], 'options': {'unique': True},
+         'purpose': 'rollup $merge key'}
+    ],
+    'rollup_daily': [
+        {'keys': [('area_id', 1), ('bucket_start', 1)], 'options': {'unique': True},
+         'purpose': 'rollup $merge key'}
+    ]
+}
+
+def index_name(keys: List[tuple]) -> str:
+    """Default MongoDB name for an index key pattern"""
+    return '_'.join(f"{field}_{direction}" for field, direction in keys)
+
+def _plan_stages(plan: Dict) -> List[str]:
+    """Flatten the stage names of a query plan tree"""
+    stages = [plan.get('stage')]
+    if 'inputStage' in plan:
+        stages.extend(_plan_stages(plan['inputStage']))
+    for child in plan.get('inputStages', []):
+        stages.extend(_plan_stages(child))
+    return [stage for stage in stages if stage]
+
+class IndexManager:
+    """Creates the declared indexes and reports how they are used"""
+
+    def __init__(self, database, views: Optional[List[str]] = None,
+                 field_aliases: Optional[Dict[str, Callable[[str], str]]] = None):
+        self.db = database
+        self.views = views or []  # Collections stored as views, which cannot be indexed
+        self.field_aliases = field_aliases or {}  # collection name -> flat field to stored path
+        self.created = {}  # collection name -> list of index names
+        self.failed = {}   # collection name -> {index name: error}
+
+    def get_keys(self, collection_name: str, keys: List[tuple]) -> List[tuple]:
+        """Index keys with field names mapped to how the collection stores them"""
+        alias = self.field_aliases.get(collection_name)
+        if alias is None:
+            return keys
+        return [(alias(field), direction) for field, direction in keys]
+
+    def ensure_indexes(self, collections: Optional[List[str]] = None) -> Dict:
+        """Create the declared indexes (idempotent)"""
+        for collection_name, specs in INDEX_SPECS.items():
+            if collections and collection_name not in collections:
+                continue
+            if collection_name in self.views:
+                continue
+
+            collection = self.db[collection_name]
+            for spec in specs:
+                name = index_name(spec['keys'])
+                try:
+                    keys = self.get_keys(collection_name, spec['keys'])
+                    collection.create_index(keys, name=name, **spec.get('options', {}))
+                    self.created.setdefault(collection_name, [])
+                    if name not in self.created[collection_name]:
+                        self.created[collection_name].append(name)
+                except Exception as e:
+                    logger.warning(f"Could not create index {name} on {collection_name}: {e}")
+                    self.failed.setdefault(collection_name, {})[name] = str(e)
+
+        logger.info(f"Ensured indexes on {len(self.created)} collections")
+        return {'created': self.created, 'failed': self.failed}
+
+    def is_created(self, collection_name: str, keys: List[tuple]) -> bool:
+        """Whether a declared index was created successfully"""
+        return index_name(keys) in self.created.get(collection_name, [])
+
+    def get_declared_indexes(self) -> Dict:
+        """Declared indexes in a JSON-friendly form"""
+        return {
+            collection_name: [
+                {
+                    'name': index_name(spec['keys']),
+                    'keys': [[field, direction] for field, direction in spec['keys']],
+                    'options': spec.get('options', {}),
+                    'purpose': spec['purpose']
+                }
+                for spec in specs
+            ]
+            for collection_name, specs in INDEX_SPECS.items()
+        }
+
+    def get_index_usage(self) -> Dict:
+        """Per-index access counters from $indexStats"""
+        usage = {}
+        for collection_name in INDEX_SPECS:
+            if collection_name in self.views:
+                continue
+            try:
+                stats = self.db[collection_name].aggregate([{'$indexStats': {}}])
+                usage[collection_name] = [
+                    {
+                        'name': stat['name'],
+                        'ops': int(stat.get('accesses', {}).get('ops', 0)),
+                        'since': stat.get('accesses', {}).get('since').isoformat()
+                        if stat.get('accesses', {}).get('since') else None
+                    }
+                    for stat in stats
+                ]
+            except Exception as e:
+                logger.warning(f"Could not get index stats for {collection_name}: {e}")
+                usage[collection_name] = {'error': str(e)}
+        return usage
+
+    def get_query_shapes(self) -> List[Dict]:
+        """Representative filters for every query the backend runs"""
+        now = datetime.now()
+        day_ago = now - timedelta(hours=24)
+        return [
+            {'collection': 'raw_data', 'query': 'aggregate_data window',
+             'filter': {'timestamp': {'$gte': day_ago, '$lt': now}}},
+            {'collection': 'raw_data', 'query': 'get_status records today',
+             'filter': {'timestamp': {'$gte': now.replace(hour=0, minute=0, second=0, microsecond=0)}}},
+            {'collection': 'raw_data', 'query': 'get_location_stats',
+             'filter': {'area_id': 'KL_0163', 'timestamp': {'$gte': day_ago}}},
+            {'collection': 'aggregated_data', 'query': 'get_status latest aggregation',
+             'filter': {}, 'sort': [('created_at', -1)]},
+            {'collection': 'model_outputs', 'query': 'get_model_outputs',
+             'filter': {'timestamp': {'$gte': day_ago}}, 'sort': [('timestamp', -1), ('_id', -1)]},
+            {'collection': 'model_outputs', 'query': 'get_model_outputs by classification',
+             'filter': {'classification': 'illegal', 'timestamp': {'$gte': day_ago}},
+             'sort': [('timestamp', -1), ('_id', -1)]},
+            {'collection': 'model_outputs', 'query': 'get_model_outputs by area',
+             'filter': {'area_id': 'KL_0163', 'timestamp': {'$gte': day_ago}},
+             'sort': [('timestamp', -1), ('_id', -1)]}
+        ]
+
+    def check_query_plans(self) -> List[Dict]:
+        """Explain every query shape and flag the ones that fall back to a COLLSCAN"""
+        plans = []
+        for shape in self.get_query_shapes():
+            result = {'collection': shape['collection'], 'query': shape['query']}
+            try:
+                query_filter = shape['filter']
+                alias = self.field_aliases.get(shape['collection'])
+                if alias is not None:
+                    query_filter = {alias(key): value for key, value in query_filter.items()}
+                cursor = self.db[shape['collection']].find(query_filter)
+                if shape.get('sort'):
+                    cursor = cursor.sort(shape['sort'])
+                explain = cursor.limit(1).explain()
+                stages = _plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+                result['stages'] = stages
+                result['collscan'] = 'COLLSCAN' in stages
+            except Exception as e:
+                result['error'] = str(e)
+            plans.append(result)
+        return plans
+
+    def report(self) -> Dict:
+        """Declared indexes, creation results, usage counters and query plans"""
+        return {
+            'views': self.views,
+            'declared': self.get_declared_indexes(),
+            'created': self.created,
+            'failed': self.failed,
+            'usage': self.get_index_usage(),
+            'query_plans': self.check_query_plans()
+        }
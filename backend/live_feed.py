@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+
+from mongo_utils import MODEL_OUTPUT_FIELDS
+
+logger = logging.getLogger(__name__)
+
+class FeedFilter:
+    """Server-side subscriber filter on area_id, district and classification"""
+
+    def __init__(self, area_ids: Optional[List[str]] = None, districts: Optional[List[str]] = None,
+                 classification: Optional[str] = None):
+        self.area_ids = set(area_ids) if area_ids else None
+        self.districts = set(districts) if districts else None
+        self.classification = classification
+
+    def matches(self, record: Dict) -> bool:
+        if self.area_ids is not None and record['area_id'] not in self.area_ids:
+            return False
+        if self.districts is not None and record['district'] not in self.districts:
+            return False
+        if self.classification and record['classification'] != self.classification:
+            return False
+        return True
+
+class TickEvent:
+    """One published tick: each record is serialized once and shared by all subscribers"""
+
+    def __init__(self, sequence: int, records: List[Dict]):
+        self.sequence = sequence
+        self.records = records
+        self.serialized = [json.dumps(record) for record in records]
+
+    def to_sse(self, feed_filter: FeedFilter) -> Optional[str]:
+        """SSE message for a subscriber, or None if no record passes its filter"""
+        selected = [text for record, text in zip(self.records, self.serialized) if feed_filter.matches(record)]
+        if not selected:
+            return None
+        data = f'{{"sequence": {self.sequence}, "count": {len(selected)}, "records": [{", ".join(selected)}]}}'
+        return f"id: {self.sequence}\nevent: tick\ndata: {data}\n\n"
+
+class Subscriber:
+    def __init__(self, feed_filter: FeedFilter, max_queue: int):
+        self.filter = feed_filter
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def offer(self, event: TickEvent):
+        """Queue a tick, dropping the oldest one if this subscriber has fallen behind"""
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+class LiveFeed:
+    """
+    Fan-out of classified records to Server-Sent Events subscribers
+
+    The simulator publishes each committed tick once. Every subscriber gets
+    the records that pass its filter. Recent ticks are kept in a ring buffer
+    so a client that reconnects with Last-Event-ID resumes where it left off.
+    """
+
+    def __init__(self, buffer_ticks: int = None, max_queue: int = None, heartbeat_seconds: float = None):
+        self.buffer = deque(maxlen=buffer_ticks or int(os.getenv('LIVE_FEED_BUFFER_TICKS', 120)))
+        self.max_queue = max_queue or int(os.getenv('LIVE_FEED_SUBSCRIBER_QUEUE', 32))
+        self.heartbeat_seconds = heartbeat_seconds or float(os.getenv('LIVE_FEED_HEARTBEAT_SECONDS', 15))
+
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.sequence = 0
+
+    def publish(self, records: List[Dict]):
+        """Broadcast a committed tick to every subscriber"""
+        try:
+            outputs = []
+            for record in records:
+                output = {field: record.get(field) for field in MODEL_OUTPUT_FIELDS}
+                output['timestamp'] = output['timestamp'].isoformat()
+                outputs.append(output)
+
+            with self._lock:
+                self.sequence += 1
+                event = TickEvent(self.sequence, outputs)
+                self.buffer.append(event)
+                subscribers = list(self._subscribers)
+
+            for subscriber in subscribers:
+                subscriber.offer(event)
+
+        except Exception as e:
+            logger.error(f"Error publishing live feed tick: {e}")
+
+    def subscribe(self, feed_filter: FeedFilter, last_sequence: Optional[int] = None) -> Iterator[str]:
+        """Yield SSE messages for a subscriber until the client disconnects"""
+        subscriber = Subscriber(feed_filter, self.max_queue)
+
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if last_sequence is not None and last_sequence > self.sequence:
+                # An id from before a server restart: start over from the current tick
+                replay, missed = [], True
+                last_sequence = self.sequence
+            elif last_sequence is not None:
+                replay = [event for event in self.buffer if event.sequence > last_sequence]
+                oldest = self.buffer[0].sequence if self.buffer else self.sequence + 1
+                missed = last_sequence + 1 < oldest
+            else:
+                replay, missed = [], False
+
+        try:
+            yield f"retry: 3000\nevent: hello\ndata: {{\"sequence\": {self.sequence}}}\n\n"
+            if missed:
+                # The client was away longer than the buffer covers
+                yield f"event: reset\ndata: {{\"sequence\": {self.sequence}}}\n\n"
+
+            last_sent = last_sequence or 0
+            for event in replay:
+                message = event.to_sse(feed_filter)
+                last_sent = event.sequence
+                if message:
+                    yield message
+
+            while True:
+                try:
+                    event = subscriber.queue.get(timeout=self.heartbeat_seconds)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+
+                if event.sequence <= last_sent:
+                    continue  # Already replayed
+                last_sent = event.sequence
+                message = event.to_sse(feed_filter)
+                if message:
+                    yield message
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'sequence': self.sequence,
+                'subscribers': len(self._subscribers),
+                'buffered_ticks': len(self.buffer),
+                'dropped_ticks': sum(subscriber.dropped for subscriber in self._subscribers)
+            }
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from feature_config import STATIC_FEATURES
+
+logger = logging.getLogger(__name__)
+
+# Area type codes stored in the registry (anything unknown is treated as rural)
+AREA_TYPE_CODES = {'urban': 0, 'semi-urban': 1, 'rural': 2}
+
+# Static per-area fields kept by the registry
+LOCATION_FIELDS = [
+    'area_id', 'district', 'city', 'area_name', 'latitude', 'longitude',
+    'area_type', 'households', 'distance_to_substation_km'
+]
+
+class LocationSnapshot:
+    """Read-only view of all monitored locations at one registry version"""
+
+    def __init__(self, locations: List[Dict], version: int):
+        self.version = version
+        self.locations = locations
+        self.area_ids = [loc['area_id'] for loc in locations]
+        self.index_by_area = {area_id: i for i, area_id in enumerate(self.area_ids)}
+
+        # Compact arrays of the static attributes, in the same order as locations
+        self.latitude = np.array([loc['latitude'] for loc in locations], dtype=np.float64)
+        self.longitude = np.array([loc['longitude'] for loc in locations], dtype=np.float64)
+        self.households = np.array([loc['households'] for loc in locations], dtype=np.int32)
+        self.distance_to_substation_km = np.array(
+            [loc['distance_to_substation_km'] for loc in locations], dtype=np.float64
+        )
+        self.area_type_codes = np.array(
+            [AREA_TYPE_CODES.get(loc['area_type'], AREA_TYPE_CODES['rural']) for loc in locations],
+            dtype=np.int8
+        )
+
+        # Static model features, encoded once per registry load
+        self.static_features = np.empty((len(locations), len(STATIC_FEATURES)), dtype=np.float32)
+        for column, feature in enumerate(STATIC_FEATURES):
+            self.static_features[:, column] = getattr(self, feature)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def get_location(self, area_id: str) -> Optional[Dict]:
+        """Get the static attributes of one location"""
+        index = self.index_by_area.get(area_id)
+        return self.locations[index] if index is not None else None
+
+    def partition(self, n_shards: int) -> List['LocationShard']:
+        """Split the locations into up to n_shards contiguous, non-empty shards"""
+        bounds = np.linspace(0, len(self), max(min(n_shards, len(self)), 1) + 1).astype(int)
+        return [LocationShard(self, index, int(start), int(stop))
+                for index, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])) if stop > start]
+
+class LocationShard:
+    """
+    Contiguous slice of a snapshot's static arrays
+
+    Carries only what tick generation needs, so it pickles cheaply to a
+    worker process. Rows are snapshot.locations[start:stop].
+    """
+
+    def __init__(self, snapshot: LocationSnapshot, index: int, start: int, stop: int):
+        self.index = index
+        self.start = start
+        self.stop = stop
+        self.version = snapshot.version
+        self.area_type_codes = snapshot.area_type_codes[start:stop]
+        self.households = snapshot.households[start:stop]
+        self.distance_to_substation_km = snapshot.distance_to_substation_km[start:stop]
+        self.static_features = snapshot.static_features[start:stop]
+
+    def __len__(self):
+        return self.stop - self.start
+
+class LocationRegistry:
+    """
+    In-process cache of the locations collection
+
+    Loads the collection once and keeps it fresh through a change stream. When
+    change streams are not available (standalone servers), it falls back to a
+    periodic fingerprint check: a hash of the cached fields of every location,
+    so in-place edits are noticed as well as inserts and deletes.
+    """
+
+    def __init__(self, locations_collection, check_interval: float = None):
+        self.locations_collection = locations_collection
+        self.check_interval = check_interval if check_interval is not None else \
+            float(os.getenv('LOCATION_REGISTRY_CHECK_SECONDS', 30))
+
+        self._lock = threading.Lock()
+        self._snapshot = LocationSnapshot([], version=0)
+        self._fingerprint = None
+        self._stale = True
+        self._last_check = 0.0
+
+        self.change_stream_active = False
+        self._watch_thread = None
+        self._stream_opened = threading.Event()
+
+        # Open the stream before the first load, so no change falls in between
+        self.start_change_stream()
+        self._stream_opened.wait(timeout=float(os.getenv('LOCATION_REGISTRY_STREAM_WAIT_SECONDS', 5)))
+        self.refresh()
+
+    def _load(self) -> List[Dict]:
+        projection = {field: 1 for field in LOCATION_FIELDS}
+        projection['_id'] = 0
+        return list(self.locations_collection.find({}, projection).sort('area_id', 1))
+
+    def get_fingerprint(self, locations: List[Dict] = None) -> str:
+        """Hash of the cached fields of every location (loaded unless given)"""
+        if locations is None:
+            locations = self._load()
+        digest = hashlib.sha1()
+        for location in locations:
+            digest.update(json.dumps(location, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def refresh(self) -> LocationSnapshot:
+        """Reload all locations from MongoDB and publish a new snapshot"""
+        # Cleared before loading, so a change reported during the load triggers another one
+        self._stale = False
+        try:
+            locations = self._load()
+            self._publish(locations, self.get_fingerprint(locations))
+        except Exception as e:
+            self._stale = True
+            logger.error(f"Error refreshing location registry: {e}")
+
+        return self._snapshot
+
+    def _publish(self, locations: List[Dict], fingerprint: str) -> LocationSnapshot:
+        """Publish a snapshot of already loaded locations"""
+        with self._lock:
+            self._snapshot = LocationSnapshot(locations, version=self._snapshot.version + 1)
+            self._fingerprint = fingerprint
+            self._last_check = time.monotonic()
+
+        logger.info(f"Location registry loaded {len(locations)} locations "
+                   f"(version {self._snapshot.version})")
+        return self._snapshot
+
+    def start_change_stream(self):
+        """Watch the locations collection for changes in a background thread"""
+        self._watch_thread = threading.Thread(target=self._watch_changes, daemon=True)
+        self._watch_thread.start()
+
+    def _watch_changes(self):
+        try:
+            with self.locations_collection.watch() as stream:
+                self.change_stream_active = True
+                self._stream_opened.set()
+                logger.info("Location registry watching change stream")
+                for _ in stream:
+                    self._stale = True
+        except Exception as e:
+            logger.info(f"Change streams unavailable for locations, using version checks: {e}")
+        finally:
+            self.change_stream_active = False
+            self._stream_opened.set()
+
+    def get_snapshot(self) -> LocationSnapshot:
+        """Get the current snapshot, reloading first if the collection changed"""
+        if self._stale:
+            return self.refresh()
+
+        if not self.change_stream_active and time.monotonic() - self._last_check >= self.check_interval:
+            try:
+                self._last_check = time.monotonic()
+                locations = self._load()
+                fingerprint = self.get_fingerprint(locations)
+                if fingerprint != self._fingerprint:
+                    return self._publish(locations, fingerprint)
+            except Exception as e:
+                logger.warning(f"Could not check location registry version: {e}")
+
+        return self._snapshot
+
+    def get_locations(self) -> List[Dict]:
+        """Get all location documents"""
+        return self.get_snapshot().locations
+
+    def invalidate(self):
+        """Force a reload on the next access"""
+        self._stale = True
@@ -1,10 +1,15 @@
+import argparse
+import json
 import joblib
 import os
 import logging
+import threading
 import numpy as np
-import pandas as pd
 from datetime import datetime
 
+from feature_config import MODEL_FEATURES, build_feature_matrix
+from prediction_cache import PredictionCache
+
 logger = logging.getLogger(__name__)
 
 def safe_json_convert(obj):
@@ -22,10 +27,265 @@ def safe_json_convert(obj):
     else:
         return obj
 
+class CompiledTreeModel:
+    """
+    Tree ensemble as flat NumPy arrays, scored without xgboost
+    
+    Every tree is padded to a complete binary tree of the ensemble's depth
+    and stored in heap order: split features, thresholds and missing-value
+    directions as (trees, 2**depth - 1) arrays and leaf values as
+    (trees, 2**depth). A padded leaf repeats its value in every leaf below
+    it. Scoring compares all split nodes at once, expands the comparisons
+    level by level into a one-hot leaf indicator per tree and sums the leaf
+    values with a single matrix product.
+    """
+    
+    ARRAYS = ('feature', 'threshold', 'default_left', 'leaf_value')
+    MAX_DEPTH = 10
+    
+    def __init__(self, feature, threshold, default_left, leaf_value, base_margin, objective, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.default_left = default_left
+        self.leaf_value = leaf_value
+        self.depth = int(np.log2(leaf_value.shape[1]))
+        self.base_margin = float(base_margin)
+        self.objective = objective
+        self.n_features_in_ = int(n_features)
+        self.chunk_rows = int(os.getenv('COMPILED_MODEL_CHUNK_ROWS', 2048))
+        
+        # Node-major flattening to match the (node, tree, row) work arrays
+        self._split_features = feature.T.ravel()
+        self._split_thresholds = threshold.T.ravel()[:, None]
+        self._split_defaults = default_left.T.ravel()[:, None]
+        self._leaf_values = leaf_value.T.ravel().astype(np.float32)
+    
+    @classmethod
+    def from_xgboost(cls, model):
+        """Compile an XGBoost binary classifier (or its Booster)"""
+        booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        learner = json.loads(booster.save_raw(raw_format='json'))['learner']
+        
+        objective = learner['objective']['name']
+        if objective not in ('binary:logistic', 'binary:logitraw'):
+            raise ValueError(f"Unsupported objective {objective}")
+        if learner['gradient_booster']['name'] != 'gbtree':
+            raise ValueError(f"Unsupported booster {learner['gradient_booster']['name']}")
+        
+        trees = learner['gradient_booster']['model']['trees']
+        try:
+            trees = trees[:model.best_iteration + 1]
+        except AttributeError:
+            pass
+        
+        def node_depth(tree, node):
+            left = tree['left_children'][node]
+            if left == -1:
+                return 0
+            return 1 + max(node_depth(tree, left), node_depth(tree, tree['right_children'][node]))
+        
+        depth = max(node_depth(tree, 0) for tree in trees)
+        if depth > cls.MAX_DEPTH:
+            raise ValueError(f"Tree depth {depth} exceeds {cls.MAX_DEPTH}")
+        
+        n_split_nodes = 2 ** depth - 1
+        feature = np.zeros((len(trees), n_split_nodes), dtype=np.int32)
+        # Padding nodes keep a -inf threshold; both of their children are the same leaf
+        threshold = np.full((len(trees), n_split_nodes), -np.inf, dtype=np.float32)
+        default_left = np.ones((len(trees), n_split_nodes), dtype=bool)
+        leaf_value = np.zeros((len(trees), 2 ** depth), dtype=np.float32)
+        
+        for index, tree in enumerate(trees):
+            if any(tree['split_type']):
+                raise ValueError("Categorical splits are not supported")
+            
+            # (xgboost node, heap position) pairs, filled top down
+            stack = [(0, 0)]
+            while stack:
+                node, position = stack.pop()
+                left = tree['left_children'][node]
+                if position >= n_split_nodes:
+                    leaf_value[index, position - n_split_nodes] = tree['split_conditions'][node]
+                elif left == -1:
+                    # Leaf above the bottom level: both children repeat it
+                    stack.extend([(node, 2 * position + 1), (node, 2 * position + 2)])
+                else:
+                    feature[index, position] = tree['split_indices'][node]
+                    threshold[index, position] = tree['split_conditions'][node]
+                    default_left[index, position] = bool(tree['default_left'][node])
+                    stack.extend([(left, 2 * position + 1), (tree['right_children'][node], 2 * position + 2)])
+        
+        base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+        base_margin = np.log(base_score / (1 - base_score)) if objective == 'binary:logistic' else base_score
+        
+        return cls(feature, threshold, default_left, leaf_value, base_margin, objective,
+                   learner['learner_model_param']['num_feature'])
+    
+    def save(self, path):
+        np.savez_compressed(
+            path, base_margin=self.base_margin, objective=self.objective, n_features=self.n_features_in_,
+            **{name: getattr(self, name) for name in self.ARRAYS}
+        )
+    
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(
+                base_margin=arrays['base_margin'], objective=str(arrays['objective']),
+                n_features=arrays['n_features'], **{name: arrays[name] for name in cls.ARRAYS}
+            )
+    
+    def split_points(self):
+        """Sorted distinct split thresholds of each feature (empty for unused features)"""
+        real = np.isfinite(self.threshold)
+        return [np.unique(self.threshold[real & (self.feature == index)]) for index in range(self.n_features_in_)]
+    
+    def predict_margin(self, feature_matrix):
+        feature_matrix = np.asarray(feature_matrix, dtype=np.float32)
+        n_trees = len(self.leaf_value)
+        margins = np.empty(len(feature_matrix), dtype=np.float64)
+        
+        for start in range(0, len(feature_matrix), self.chunk_rows):
+            columns = np.ascontiguousarray(feature_matrix[start:start + self.chunk_rows].T)
+            n_rows = columns.shape[1]
+            
+            values = columns[self._split_features]
+            goes_left = values < self._split_thresholds
+            missing = np.isnan(values)
+            if missing.any():
+                # Missing values follow the default direction, like XGBoost
+                goes_left = np.where(missing, self._split_defaults, goes_left)
+            goes_left = goes_left.reshape(-1, n_trees, n_rows)
+            
+            # One-hot leaf indicator, one level of the heap at a time
+            reached = np.ones((1, n_trees, n_rows), dtype=bool)
+            for level in range(self.depth):
+                split = goes_left[2 ** level - 1:2 ** (level + 1) - 1]
+                children = np.empty((2 * len(reached), n_trees, n_rows), dtype=bool)
+                np.logical_and(reached, split, out=children[0::2])
+                np.logical_and(reached, ~split, out=children[1::2])
+                reached = children
+            
+            margins[start:start + n_rows] = self._leaf_values @ reached.reshape(-1, n_rows).astype(np.float32)
+        return margins + self.base_margin
+    
+    def predict_illegal(self, feature_matrix):
+        """Probability of class 1 (illegal) for each row"""
+        margins = self.predict_margin(feature_matrix)
+        if self.objective == 'binary:logitraw':
+            return margins
+        return 1.0 / (1.0 + np.exp(-margins))
+    
+    def predict_proba(self, feature_matrix):
+        probabilities = self.predict_illegal(feature_matrix)
+        return np.column_stack([1 - probabilities, probabilities])
+
+def load_model_file(path):
+    """Load a joblib model, or a compiled .npz model without importing xgboost"""
+    if path.endswith('.npz'):
+        return CompiledTreeModel.load(path)
+    return joblib.load(path)
+
+# Inference engines:
+#   booster  - score NumPy arrays with the native XGBoost Booster.inplace_predict
+#   compiled - compile the trees to flat arrays and score them with NumPy
+#   sklearn  - the model's predict_proba (any scikit-learn style classifier)
+# Compiled .npz model files are always scored with the compiled engine.
+INFERENCE_ENGINES = ('booster', 'compiled', 'sklearn')
+
+def _predict_proba_scorer(model):
+    def score(feature_matrix):
+        probabilities = model.predict_proba(feature_matrix)
+        # Probability of class 1 (illegal), or the single probability column
+        column = 1 if probabilities.shape[1] > 1 else 0
+        return probabilities[:, column].astype(np.float64)
+    return score
+
+def build_scorer(model, engine='booster', nthread=None):
+    """
+    Build the function that maps a feature matrix to illegal probabilities
+    
+    The booster engine skips the sklearn wrapper (input validation and
+    DMatrix construction) and calls Booster.inplace_predict on the array.
+    Models without an XGBoost booster, or whose booster output does not
+    match predict_proba on a probe batch, fall back to predict_proba.
+    
+    Args:
+        model: Loaded model
+        engine: 'booster' or 'sklearn'
+        nthread: Threads per prediction for the booster (None keeps the model setting)
+    
+    Returns:
+        tuple: (score function, name of the engine in use)
+    """
+    if isinstance(model, CompiledTreeModel):
+        return model.predict_illegal, 'compiled'
+    
+    fallback = _predict_proba_scorer(model)
+    if engine == 'compiled' and hasattr(model, 'get_booster'):
+        try:
+            compiled = CompiledTreeModel.from_xgboost(model)
+            probe = np.random.default_rng(0).random((8, model.n_features_in_), dtype=np.float32)
+            # Leaf sums are accumulated in a different order than XGBoost
+            if not np.allclose(compiled.predict_illegal(probe), fallback(probe), atol=1e-5):
+                raise ValueError("compiled output does not match predict_proba")
+            return compiled.predict_illegal, 'compiled'
+        except Exception as e:
+            logger.warning(f"Compiled inference unavailable, using predict_proba: {e}")
+            return fallback, 'sklearn'
+    
+    if engine != 'booster' or not hasattr(model, 'get_booster'):
+        return fallback, 'sklearn'
+    
+    try:
+        booster = model.get_booster()
+        if nthread:
+            booster.set_param('nthread', nthread)
+        
+        # Respect early stopping the same way predict_proba does
+        try:
+            iteration_range = (0, model.best_iteration + 1)
+        except AttributeError:
+            iteration_range = (0, 0)
+        missing = getattr(model, 'missing', np.nan)
+        
+        def score(feature_matrix):
+            probabilities = booster.inplace_predict(
+                feature_matrix, iteration_range=iteration_range, predict_type='value',
+                missing=missing, validate_features=False
+            )
+            if probabilities.ndim > 1:
+                probabilities = probabilities[:, 1]
+            return probabilities.astype(np.float64)
+        
+        probe = np.random.default_rng(0).random((8, model.n_features_in_), dtype=np.float32)
+        if not np.allclose(score(probe), fallback(probe), atol=1e-6):
+            raise ValueError("booster output does not match predict_proba")
+        return score, 'booster'
+        
+    except Exception as e:
+        logger.warning(f"Booster inference unavailable, using predict_proba: {e}")
+        return fallback, 'sklearn'
+
 class ModelLoader:
-    def __init__(self, model_path='model/model.joblib'):
+    def __init__(self, model_path='model/model.joblib', inference_engine=None, nthread=None,
+                 prediction_cache_size=None):
         self.model_path = model_path
         self.model = None
+        self.version = None
+        self.inference_engine = (inference_engine or os.getenv('INFERENCE_ENGINE', 'booster')).lower()
+        if self.inference_engine not in INFERENCE_ENGINES:
+            logger.warning(f"Unknown INFERENCE_ENGINE '{self.inference_engine}', using 'booster'")
+            self.inference_engine = 'booster'
+        self.nthread = nthread or int(os.getenv('INFERENCE_NTHREAD', 0)) or None
+        # Entries in the quantized-feature prediction cache; 0 disables it
+        self.prediction_cache_size = prediction_cache_size if prediction_cache_size is not None else \
+            int(os.getenv('PREDICTION_CACHE_SIZE', 0))
+        self.prediction_cache = None
+        
+        # (model, score function, engine in use), replaced as one reference on swaps
+        self._scorer = None
+        self._swap_lock = threading.Lock()
         self.load_model()
     
     def load_model(self):
@@ -35,15 +295,64 @@ class ModelLoader:
                 logger.error(f"Model file not found at {self.model_path}")
                 raise FileNotFoundError(f"Model file not found at {self.model_path}")
             
-            # Load model using joblib
-            self.model = joblib.load(self.model_path)
+            # Load model using joblib (or a compiled .npz model)
+            model = load_model_file(self.model_path)
+            score, engine = build_scorer(model, self.inference_engine, self.nthread)
+            score, self.prediction_cache = self._with_cache(model, score)
+            self._scorer = (model, score, engine)
+            self.model = model
             
-            logger.info(f"Successfully loaded model from {self.model_path} using joblib")
+            logger.info(f"Successfully loaded model from {self.model_path} using joblib ({engine} inference)")
             
         except Exception as e:
             logger.error(f"Error loading model: {e}")
             raise
     
+    def activate(self, model, model_path, version=None):
+        """
+        Swap in an already loaded and validated model
+        
+        Args:
+            model: Model object with predict_proba
+            model_path: File the model was loaded from
+            version: Version identifier of the model
+        
+        Returns:
+            tuple: (model, model_path, version) that was active before
+        """
+        score, engine = build_scorer(model, self.inference_engine, self.nthread)
+        score, prediction_cache = self._with_cache(model, score)
+        with self._swap_lock:
+            previous = (self.model, self.model_path, self.version)
+            self.model_path = model_path
+            self.version = version
+            self._scorer = (model, score, engine)
+            self.prediction_cache = prediction_cache
+            self.model = model
+            return previous
+    
+    def _with_cache(self, model, score):
+        """
+        Wrap a score function in a PredictionCache when caching is enabled
+        
+        Returns:
+            tuple: (score function, PredictionCache or None)
+        """
+        if self.prediction_cache_size <= 0:
+            return score, None
+        
+        try:
+            # The cache key grid is the model's own split thresholds
+            compiled = model if isinstance(model, CompiledTreeModel) else CompiledTreeModel.from_xgboost(model)
+            cache = PredictionCache(score, compiled.split_points(), self.prediction_cache_size)
+            logger.info(f"Prediction cache enabled ({self.prediction_cache_size} entries, "
+                        f"{len(cache.features)} key features)")
+            return cache.score, cache
+            
+        except Exception as e:
+            logger.warning(f"Prediction cache unavailable for {type(model).__name__}: {e}")
+            return score, None
+    
     def create_timestamp_dummies(self, timestamp_str):
         """Create timestamp dummy variables for the model"""
         # Initialize all timestamp dummies to 0
@@ -103,28 +412,59 @@ class ModelLoader:
         Returns:
             float: Probability of illegal activity (0-1)
         """
+        return float(self.predict_probabilities([features])[0])
+    
+    def predict_probabilities(self, features_batch, strict=False):
+        """
+        Predict the probability of illegal activity for a batch of records
+        using a single model call
+        
+        Args:
+            features_batch: List of feature dictionaries, or a 2D array of
+                feature rows already in get_required_features() order
+            strict: Re-raise errors instead of returning zeros (legal)
+        
+        Returns:
+            np.ndarray: Probability of illegal activity (0-1) for each row
+        """
+        n_rows = len(features_batch)
+        # One reference for the whole call, so a concurrent swap cannot mix models
+        scorer = self._scorer
         try:
-            if self.model is None:
+            if scorer is None:
                 raise ValueError("Model not loaded")
             
-            # Create feature vector in the exact order expected by the model
-            feature_vector = self.prepare_feature_vector(features)
-            
-            # Convert to DataFrame for prediction
-            feature_df = pd.DataFrame([feature_vector])
+            if n_rows == 0:
+                return np.zeros(0, dtype=np.float64)
             
-            # Get prediction probability
-            probabilities = self.model.predict_proba(feature_df)
-            
-            # Return probability of positive class (illegal)
-            if probabilities.shape[1] > 1:
-                return float(probabilities[0][1])  # Probability of class 1 (illegal)
+            if isinstance(features_batch, np.ndarray):
+                # Rows are already in model order
+                feature_matrix = features_batch
             else:
-                return float(probabilities[0][0])  # Single probability
+                feature_matrix = self.prepare_feature_matrix(features_batch)
+            
+            # Get prediction probabilities for the whole batch
+            _, score, _ = scorer
+            return score(feature_matrix)
                 
         except Exception as e:
-            logger.error(f"Error in prediction: {e}")
-            return 0.0  # Default to legal in case of error
+            logger.error(f"Error in batch prediction: {e}")
+            if strict:
+                raise
+            return np.zeros(n_rows, dtype=np.float64)  # Default to legal in case of error
+    
+    def prepare_feature_matrix(self, records, out=None):
+        """
+        Encode a batch of records into a float32 (n, 38) array in model order
+        
+        Args:
+            records: List of feature dictionaries
+            out: Optional preallocated float32 array to fill
+        
+        Returns:
+            np.ndarray: Feature matrix with one row per record
+        """
+        return build_feature_matrix(records, out=out)
     
     def prepare_feature_vector(self, features):
         """Prepare feature vector in the exact order used by the model"""
@@ -187,50 +527,37 @@ class ModelLoader:
             logger.error(f"Error in classification: {e}")
             return 'legal', 0.0
     
+    def classify_batch(self, records, threshold=0.08, strict=False):
+        """
+        Classify a batch of records with one vectorized model call
+        
+        Args:
+            records: List of feature dictionaries, or a 2D array of feature rows
+                in get_required_features() order
+            threshold: Probability threshold for classification (default: 0.08)
+            strict: Re-raise errors instead of classifying every record as legal
+        
+        Returns:
+            tuple: (classifications, probabilities)
+                - classifications: list of 'legal' or 'illegal', one per record
+                - probabilities: np.ndarray of illegal probabilities
+        """
+        try:
+            probabilities = self.predict_probabilities(records, strict=strict)
+            classifications = np.where(probabilities >= threshold, 'illegal', 'legal').tolist()
+            return classifications, probabilities
+            
+        except Exception as e:
+            logger.error(f"Error in batch classification: {e}")
+            if strict:
+                raise
+            return ['legal'] * len(records), np.zeros(len(records), dtype=np.float64)
+    
     def get_required_features(self):
         """
         Return the list of required features for the model in exact order
         """
-        return [
-            'latitude',
-            'longitude', 
-            'households',
-            'distance_to_substation_km',
-            'local_incident_reports',
-            'year',
-            'month',
-            'expected_consumption_kwh',
-            'voltage_reading_v',
-            'current_reading_a',
-            'power_factor',
-            'load_factor',
-            'is_summer',
-            'is_monsoon',
-            'is_winter',
-            'timestamp_2023-02-01',
-            'timestamp_2023-03-01',
-            'timestamp_2023-04-01',
-            'timestamp_2023-05-01',
-            'timestamp_2023-06-01',
-            'timestamp_2023-07-01',
-            'timestamp_2023-08-01',
-            'timestamp_2023-09-01',
-            'timestamp_2023-10-01',
-            'timestamp_2023-11-01',
-            'timestamp_2023-12-01',
-            'timestamp_2024-01-01',
-            'timestamp_2024-02-01',
-            'timestamp_2024-03-01',
-            'timestamp_2024-04-01',
-            'timestamp_2024-05-01',
-            'timestamp_2024-06-01',
-            'timestamp_2024-07-01',
-            'timestamp_2024-08-01',
-            'timestamp_2024-09-01',
-            'timestamp_2024-10-01',
-            'timestamp_2024-11-01',
-            'timestamp_2024-12-01'
-        ]
+        return list(MODEL_FEATURES)
     
     def get_feature_importance(self):
         """Get feature importance from the model (if available)"""
@@ -270,6 +597,9 @@ class ModelLoader:
                 'model_type': type(self.model).__name__,
                 'model_loaded': True,
                 'model_path': self.model_path,
+                'model_version': self.version,
+                'inference_engine': self._scorer[2] if self._scorer else None,
+                'prediction_cache': self.prediction_cache.stats() if self.prediction_cache else None,
                 'required_features': self.get_required_features(),
                 'feature_count': len(self.get_required_features())
             }
@@ -295,4 +625,27 @@ class ModelLoader:
             
         except Exception as e:
             logger.error(f"Error getting model info: {e}")
-            return {'error': str(e), 'model_loaded': False}
\ No newline at end of file
+            return {'error': str(e), 'model_loaded': False}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the model to flat NumPy arrays for lightweight workers")
+    parser.add_argument('source', nargs='?', default='model/model.joblib')
+    # Outside the watched model directory: a compiled model is deployed on purpose (MODEL_PATH),
+    # never picked up by the hot-swap watcher, since it is slower than the booster on large batches
+    parser.add_argument('target', nargs='?', default='model/compiled/model.npz')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    model = joblib.load(args.source)
+    compiled = CompiledTreeModel.from_xgboost(model)
+    os.makedirs(os.path.dirname(args.target) or '.', exist_ok=True)
+    compiled.save(args.target)
+    
+    # The compiled model must reproduce the original probabilities
+    probe = np.random.default_rng(0).random((4096, compiled.n_features_in_), dtype=np.float32) * 100
+    difference = np.abs(compiled.predict_proba(probe)[:, 1] - model.predict_proba(probe)[:, 1]).max()
+    logger.info(f"Compiled {len(compiled.leaf_value)} trees of depth {compiled.depth} to {args.target}, "
+                f"max probability difference {difference:.2e}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from feature_config import SAMPLE_DATA_ROW, build_feature_matrix
+from model_loader import load_model_file
+
+logger = logging.getLogger(__name__)
+
+def file_version(path: str) -> str:
+    """Content hash identifying a model file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as model_file:
+        for block in iter(lambda: model_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+class ModelRegistry:
+    """
+    Zero-downtime model reloads for a ModelLoader
+
+    A new model file is loaded, validated against get_required_features()
+    and warmed with a prediction in a background thread, then swapped into
+    the ModelLoader in one step. Requests keep scoring with the old model
+    until the swap. Previously active models stay in memory for instant
+    rollback. The model directory is polled for new files so every gunicorn
+    worker picks up a deployed model on its own.
+    """
+
+    def __init__(self, model_loader, model_dir: str = None, keep_versions: int = None,
+                 watch_seconds: float = None):
+        self.model_loader = model_loader
+        self.model_dir = model_dir or os.getenv('MODEL_DIR', os.path.dirname(model_loader.model_path) or '.')
+        self.watch_seconds = watch_seconds if watch_seconds is not None else \
+            float(os.getenv('MODEL_WATCH_SECONDS', 30))
+        self.warmup_rows = int(os.getenv('MODEL_WARMUP_ROWS', 64))
+
+        self._lock = threading.Lock()
+        self._reload_thread = None
+        self._watch_thread = None
+        self._watch_candidate = None
+        self._handled_candidate = self._file_state(model_loader.model_path)
+
+        # Previously active models, newest last
+        self.history = deque(maxlen=keep_versions or int(os.getenv('MODEL_KEEP_VERSIONS', 3)))
+        try:
+            model_loader.version = file_version(model_loader.model_path)
+        except OSError:
+            pass
+        self.active = self._describe(model_loader.model_path, model_loader.version)
+        self.last_reload = None
+
+    @staticmethod
+    def _file_state(path: str) -> Optional[tuple]:
+        try:
+            stat = os.stat(path)
+            return os.path.abspath(path), stat.st_mtime, stat.st_size
+        except OSError:
+            return None
+
+    def _describe(self, path: str, version: Optional[str], **timings) -> Dict:
+        try:
+            modified = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+        except OSError:
+            modified = None
+        return {'version': version, 'path': path, 'file_modified_at': modified,
+                'activated_at': datetime.now().isoformat(), **timings}
+
+    def validate(self, model) -> float:
+        """
+        Check a loaded model against the feature layout and warm it up
+
+        Returns:
+            float: Warm-up prediction time in milliseconds
+        """
+        if not hasattr(model, 'predict_proba'):
+            raise ValueError(f"{type(model).__name__} has no predict_proba")
+
+        required = self.model_loader.get_required_features()
+        n_features = getattr(model, 'n_features_in_', None)
+        if n_features is not None and n_features != len(required):
+            raise ValueError(f"Model expects {n_features} features, {len(required)} are required")
+        feature_names = getattr(model, 'feature_names_in_', None)
+        if feature_names is not None and list(feature_names) != required:
+            raise ValueError("Model feature names do not match get_required_features()")
+
+        # The first predictions pay for lazy initialization; do them before the swap
+        warmup = build_feature_matrix([SAMPLE_DATA_ROW] * self.warmup_rows)
+        started = time.perf_counter()
+        probabilities = np.asarray(model.predict_proba(warmup))
+        warm_ms = (time.perf_counter() - started) * 1000
+
+        if probabilities.ndim != 2 or probabilities.shape[0] != len(warmup):
+            raise ValueError(f"Unexpected predict_proba output shape {probabilities.shape}")
+        if not np.all(np.isfinite(probabilities)) or probabilities.min() < 0 or probabilities.max() > 1:
+            raise ValueError("Model returned probabilities outside [0, 1]")
+        return warm_ms
+
+    def _load(self, path: str, force: bool):
+        started = time.perf_counter()
+        result = {'state': 'running', 'path': path, 'started_at': datetime.now().isoformat()}
+        self.last_reload = result
+        try:
+            version = file_version(path)
+            if version == self.active['version'] and not force:
+                result.update(state='unchanged', version=version)
+                return
+
+            load_started = time.perf_counter()
+            model = load_model_file(path)
+            load_ms = (time.perf_counter() - load_started) * 1000
+
+            warm_ms = self.validate(model)
+
+            with self._lock:
+                previous_model, previous_path, previous_version = self.model_loader.activate(model, path, version)
+                self.history.append({**self.active, 'model': previous_model})
+                self.active = self._describe(path, version, load_ms=round(load_ms, 2), warm_ms=round(warm_ms, 2))
+
+            total_ms = (time.perf_counter() - started) * 1000
+            result.update(state='completed', version=version, previous_version=previous_version,
+                          load_ms=round(load_ms, 2), warm_ms=round(warm_ms, 2), total_ms=round(total_ms, 2))
+            logger.info(f"Activated model {version} from {path} in {total_ms:.1f} ms "
+                        f"(load {load_ms:.1f} ms, warm-up {warm_ms:.1f} ms)")
+
+        except Exception as e:
+            result.update(state='failed', error=str(e))
+            logger.error(f"Model reload from {path} failed, keeping {self.active['version']}: {e}")
+
+        finally:
+            result['finished_at'] = datetime.now().isoformat()
+
+    def reload(self, path: str = None, force: bool = False, wait: bool = False) -> Dict:
+        """
+        Load, validate and activate a model file in the background
+
+        Args:
+            path: Model file (default: the newest model in the model directory)
+            force: Reload even if the file matches the active version
+            wait: Block until the reload has finished
+
+        Returns:
+            Dict: Status of the reload
+        """
+        path = path or self.find_latest() or self.model_loader.model_path
+        if self._reload_thread is not None and self._reload_thread.is_alive():
+            raise RuntimeError("A model reload is already in progress")
+
+        self._reload_thread = threading.Thread(target=self._load, args=(path, force), daemon=True)
+        self.last_reload = {'state': 'queued', 'path': path}
+        self._reload_thread.start()
+        if wait:
+            self._reload_thread.join()
+        return dict(self.last_reload)
+
+    def rollback(self, version: Optional[str] = None) -> Dict:
+        """Swap back to a previously active model that is still in memory"""
+        with self._lock:
+            if not self.history:
+                raise ValueError("No previous model version to roll back to")
+
+            if version is None:
+                target = self.history.pop()
+            else:
+                target = next((entry for entry in self.history if entry['version'] == version), None)
+                if target is None:
+                    raise ValueError(f"Model version {version} is not available for rollback")
+                self.history.remove(target)
+
+            started = time.perf_counter()
+            previous_model, _, _ = self.model_loader.activate(target['model'], target['path'], target['version'])
+            self.history.append({**self.active, 'model': previous_model})
+            self.active = self._describe(target['path'], target['version'])
+            swap_ms = (time.perf_counter() - started) * 1000
+
+        logger.info(f"Rolled back to model {target['version']} in {swap_ms:.3f} ms")
+        return {'version': target['version'], 'swap_ms': round(swap_ms, 3)}
+
+    def find_latest(self) -> Optional[str]:
+        """Most recently modified model file in the model directory"""
+        try:
+            paths = [os.path.join(self.model_dir, name) for name in os.listdir(self.model_dir)
+                     if name.endswith(('.joblib', '.pkl', '.npz'))]
+        except OSError:
+            return None
+        return max(paths, key=os.path.getmtime) if paths else None
+
+    def start_watcher(self):
+        """Poll the model directory and reload when a new model file appears"""
+        if self.watch_seconds <= 0 or (self._watch_thread is not None and self._watch_thread.is_alive()):
+            return
+        self._watch_thread = threading.Thread(target=self._watch, daemon=True)
+        self._watch_thread.start()
+        logger.info(f"Watching {self.model_dir} for new models every {self.watch_seconds}s")
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_seconds)
+            try:
+                path = self.find_latest()
+                candidate = self._file_state(path) if path else None
+                if candidate is None or candidate == self._handled_candidate:
+                    continue
+
+                # Only load a file that did not change since the last poll (fully written)
+                if candidate != self._watch_candidate:
+                    self._watch_candidate = candidate
+                    continue
+                if self._reload_thread is None or not self._reload_thread.is_alive():
+                    # Try each file state once; a rejected file is not retried until it changes
+                    self._handled_candidate = candidate
+                    self.reload(path, wait=True)
+
+            except Exception as e:
+                logger.error(f"Error watching model directory: {e}")
+
+    def get_versions(self) -> List[Dict]:
+        """Active model first, then the versions kept for rollback (newest first)"""
+        with self._lock:
+            versions = [{**self.active, 'active': True}]
+            versions.extend({key: value for key, value in entry.items() if key != 'model'} | {'active': False}
+                            for entry in reversed(self.history))
+            return versions
+
+    def status(self) -> Dict:
+        return {
+            'active': dict(self.active),
+            'versions': self.get_versions(),
+            'last_reload': dict(self.last_reload) if self.last_reload else None,
+            'model_dir': self.model_dir,
+            'watch_seconds': self.watch_seconds
+        }
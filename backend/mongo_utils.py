@@ -1,17 +1,70 @@
+import base64
+import json
 import logging
-from datetime import datetime
-from pymongo import MongoClient
-from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
 import os
 
+from bson import ObjectId
+
+from index_manager import IndexManager
+from db_connection import get_client
+from raw_data_storage import RawDataStorage
+from retention import RetentionManager
+
 logger = logging.getLogger(__name__)
 
+# How model outputs are stored:
+#   collection - a separate model_outputs collection written on every tick (legacy)
+#   view       - model_outputs is a read-only MongoDB view over raw_data
+#   projection - model_outputs are projected from raw_data at read time
+MODEL_OUTPUTS_STORAGE_MODES = ('collection', 'view', 'projection')
+
+# Fields of a raw_data record that make up a model output
+MODEL_OUTPUT_FIELDS = [
+    'area_id', 'district', 'city', 'area_name', 'latitude', 'longitude',
+    'classification', 'illegal_probability', 'timestamp', 'year', 'month'
+]
+
+# Fields a model output response can be projected to
+MODEL_OUTPUT_RESPONSE_FIELDS = MODEL_OUTPUT_FIELDS + ['location', 'created_at']
+
+def encode_cursor(timestamp: datetime, document_id) -> str:
+    """Opaque pagination token for the (timestamp, _id) position of a document"""
+    position = json.dumps({'t': timestamp.isoformat(), 'i': str(document_id)})
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def decode_cursor(token: str) -> tuple:
+    """(timestamp, _id) position of a pagination token, raises ValueError if invalid"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(position['t']), ObjectId(position['i'])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def build_model_outputs_view_pipeline(raw_data_storage) -> List[Dict]:
+    """View definition deriving model_outputs documents from raw_data"""
+    field = raw_data_storage.field
+    return [
+        {
+            '$project': {
+                **{name: f"${field(name)}" for name in MODEL_OUTPUT_FIELDS},
+                'location': {
+                    'type': {'$literal': 'Point'},
+                    'coordinates': [f"${field('longitude')}", f"${field('latitude')}"]  # [lng, lat] for GeoJSON
+                },
+                'created_at': '$timestamp'
+            }
+        }
+    ]
+
 class MongoDBManager:
-    def __init__(self, mongodb_uri=None):
+    def __init__(self, mongodb_uri=None, client=None):
         """Initialize MongoDB connection and collections"""
         try:
             self.mongodb_uri = mongodb_uri or os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
-            self.client = MongoClient(self.mongodb_uri)
+            # Use the process-wide client unless one is injected
+            self.client = client or get_client(self.mongodb_uri)
             self.db = self.client.power_grid_db
             
             # Collections
@@ -24,6 +77,25 @@ class MongoDBManager:
             self.client.admin.command('ping')
             logger.info("MongoDB connection established successfully")
             
+            # Set up raw_data storage (plain or time-series collection)
+            self.raw_data_storage = RawDataStorage(self.db)
+            self.raw_data_storage.setup()
+            
+            # Set up model outputs storage (separate collection, view or read-time projection)
+            self.model_outputs_storage = os.getenv('MODEL_OUTPUTS_STORAGE', 'view').lower()
+            if self.model_outputs_storage not in MODEL_OUTPUTS_STORAGE_MODES:
+                logger.warning(f"Unknown MODEL_OUTPUTS_STORAGE '{self.model_outputs_storage}', using 'view'")
+                self.model_outputs_storage = 'view'
+            if self.model_outputs_storage == 'view':
+                self.setup_model_outputs_view()
+            
+            # Documents fetched per round trip when reading model outputs
+            self.model_outputs_batch_size = int(os.getenv('MODEL_OUTPUTS_BATCH_SIZE', 1000))
+            
+            # TTL retention and hourly/daily rollup tiers
+            self.retention = RetentionManager(self.db, self.raw_data_storage,
+                                              stores_model_outputs=self.stores_model_outputs())
+            
             # Create indexes for better performance
             self.create_indexes()
             
@@ -31,16 +103,69 @@ class MongoDBManager:
             logger.error(f"Failed to connect to MongoDB: {e}")
             raise
     
-    def create_indexes(self):
-        """Create indexes for better query performance"""
+    def get_model_outputs_type(self) -> Optional[str]:
+        """Type of the existing model_outputs namespace ('collection', 'view' or None)"""
+        existing = list(self.db.list_collections(filter={'name': 'model_outputs'}))
+        return existing[0].get('type', 'collection') if existing else None
+    
+    def setup_model_outputs_view(self):
+        """Create model_outputs as a view over raw_data, falling back to read-time projection"""
         try:
-            # Index on area_id and timestamp for model_outputs
-            self.model_outputs_collection.create_index([("area_id", 1), ("timestamp", -1)])
-            self.model_outputs_collection.create_index([("classification", 1)])
-            self.model_outputs_collection.create_index([("timestamp", -1)])
+            existing_type = self.get_model_outputs_type()
+            pipeline = build_model_outputs_view_pipeline(self.raw_data_storage)
+            
+            if existing_type == 'view':
+                # Keep the view definition in step with the raw_data layout
+                self.db.command('collMod', 'model_outputs', viewOn='raw_data', pipeline=pipeline)
+                logger.info("Using existing model_outputs view over raw_data")
+                return
             
-            # Index on coordinates for geospatial queries
-            self.model_outputs_collection.create_index([("location.coordinates", "2d")])
+            if existing_type is not None:
+                # Keep the old copied documents, raw_data already holds the same records
+                legacy_name = f"model_outputs_legacy_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                self.model_outputs_collection.rename(legacy_name)
+                logger.info(f"Renamed model_outputs collection to {legacy_name}")
+            
+            self.db.create_collection('model_outputs', viewOn='raw_data', pipeline=pipeline)
+            logger.info("Created model_outputs view over raw_data")
+            
+        except Exception as e:
+            # Another worker may have created the view first
+            try:
+                if self.get_model_outputs_type() == 'view':
+                    return
+            except Exception:
+                pass
+            
+            logger.warning(f"Could not create model_outputs view, projecting from raw_data: {e}")
+            self.model_outputs_storage = 'projection'
+    
+    def stores_model_outputs(self) -> bool:
+        """Whether model outputs need their own insert on every tick"""
+        return self.model_outputs_storage == 'collection'
+    
+    def get_model_outputs_source(self):
+        """Collection the model output queries run against"""
+        if self.model_outputs_storage == 'projection':
+            return self.raw_data_collection
+        return self.model_outputs_collection
+    
+    def get_model_outputs_pipeline(self, pipeline: List[Dict]) -> List[Dict]:
+        """Adapt a model_outputs pipeline to the collection it runs against"""
+        if self.model_outputs_storage != 'projection':
+            return pipeline
+        # Lift time-series meta fields back to top level right after the window $match
+        return pipeline[:1] + self.raw_data_storage.flatten_stages() + pipeline[1:]
+    
+    def create_indexes(self):
+        """Create the declared indexes for every collection"""
+        # Views cannot be indexed; their queries use the raw_data indexes
+        views = [] if self.stores_model_outputs() else ['model_outputs']
+        field_aliases = {'raw_data': self.raw_data_storage.field}
+        self.index_manager = IndexManager(self.db, views=views, field_aliases=field_aliases)
+        try:
+            self.index_manager.ensure_indexes()
+            self.retention.ensure_ttl_indexes()
             
             logger.info("MongoDB indexes created successfully")
         except Exception as e:
@@ -84,6 +209,33 @@ class MongoDBManager:
             logger.error(f"Error inserting model output: {e}")
             return None
     
+    def build_model_output_documents(self, records: List[Dict]) -> List[Dict]:
+        """model_outputs documents for classified raw data records"""
+        output_records = []
+        
+        for record in records:
+            output_record = {
+                'area_id': record.get('area_id'),
+                'district': record.get('district'),
+                'city': record.get('city'),
+                'area_name': record.get('area_name'),
+                'latitude': record.get('latitude'),
+                'longitude': record.get('longitude'),
+                'location': {
+                    'type': 'Point',
+                    'coordinates': [record.get('longitude'), record.get('latitude')]
+                },
+                'classification': record.get('classification'),
+                'illegal_probability': record.get('illegal_probability', 0.0),
+                'timestamp': record.get('timestamp', datetime.now()),
+                'year': record.get('year'),
+                'month': record.get('month'),
+                'created_at': datetime.now()
+            }
+            output_records.append(output_record)
+        
+        return output_records
+    
     def insert_model_outputs_batch(self, records: List[Dict]) -> List[str]:
         """
         Insert multiple model output records in batch
@@ -95,28 +247,7 @@ class MongoDBManager:
             List[str]: List of inserted document IDs
         """
         try:
-            output_records = []
-            
-            for record in records:
-                output_record = {
-                    'area_id': record.get('area_id'),
-                    'district': record.get('district'),
-                    'city': record.get('city'),
-                    'area_name': record.get('area_name'),
-                    'latitude': record.get('latitude'),
-                    'longitude': record.get('longitude'),
-                    'location': {
-                        'type': 'Point',
-                        'coordinates': [record.get('longitude'), record.get('latitude')]
-                    },
-                    'classification': record.get('classification'),
-                    'illegal_probability': record.get('illegal_probability', 0.0),
-                    'timestamp': record.get('timestamp', datetime.now()),
-                    'year': record.get('year'),
-                    'month': record.get('month'),
-                    'created_at': datetime.now()
-                }
-                output_records.append(output_record)
+            output_records = self.build_model_output_documents(records)
             
             if output_records:
                 result = self.model_outputs_collection.insert_many(output_records)
@@ -133,7 +264,9 @@ class MongoDBManager:
                          classification: Optional[str] = None,
                          area_id: Optional[str] = None,
                          start_date: Optional[datetime] = None,
-                         end_date: Optional[datetime] = None) -> List[Dict]:
+                         end_date: Optional[datetime] = None,
+                         after: Optional[tuple] = None,
+                         fields: Optional[List[str]] = None) -> List[Dict]:
         """
         Retrieve model outputs with optional filtering
         
@@ -143,42 +276,128 @@ class MongoDBManager:
             area_id: Filter by specific area ID
             start_date: Filter records after this date
             end_date: Filter records before this date
+            after: (timestamp, _id) position to continue after, from decode_cursor
+            fields: Fields to return (default: all model output fields)
             
         Returns:
             List[Dict]: List of model output records
         """
         try:
-            query = {}
+            return list(self.iter_model_outputs(limit, classification, area_id,
+                                                start_date, end_date, after, fields))
             
-            if classification:
-                query['classification'] = classification
+        except Exception as e:
+            logger.error(f"Error retrieving model outputs: {e}")
+            # Raised rather than returned empty, so the response cache does not keep the failure
+            raise
+    
+    def get_model_outputs_page(self, limit: int = 100, cursor: Optional[str] = None, **filters) -> Dict:
+        """
+        Retrieve one page of model outputs, newest first
+        
+        Args:
+            limit: Page size
+            cursor: Token returned as next_cursor by the previous page
+            **filters: classification, area_id, start_date, end_date and fields
             
-            if area_id:
-                query['area_id'] = area_id
-                
-            if start_date or end_date:
-                query['timestamp'] = {}
-                if start_date:
-                    query['timestamp']['$gte'] = start_date
-                if end_date:
-                    query['timestamp']['$lte'] = end_date
-            
-            cursor = self.model_outputs_collection.find(query).sort('timestamp', -1).limit(limit)
-            
-            results = []
-            for doc in cursor:
-                doc['_id'] = str(doc['_id'])  # Convert ObjectId to string
-                if 'timestamp' in doc:
-                    doc['timestamp'] = doc['timestamp'].isoformat()
-                if 'created_at' in doc:
-                    doc['created_at'] = doc['created_at'].isoformat()
-                results.append(doc)
+        Returns:
+            Dict: outputs and next_cursor (None on the last page)
+        """
+        after = decode_cursor(cursor) if cursor else None
+        
+        # Fetch one extra document to know whether another page exists
+        outputs = list(self.iter_model_outputs(limit=limit + 1, after=after, with_cursor=True, **filters))
+        next_cursor = None
+        if len(outputs) > limit:
+            outputs = outputs[:limit]
+            next_cursor = outputs[-1]['_cursor']
+        for output in outputs:
+            del output['_cursor']
+        
+        return {'outputs': outputs, 'next_cursor': next_cursor}
+    
+    def iter_model_outputs(self,
+                           limit: Optional[int] = None,
+                           classification: Optional[str] = None,
+                           area_id: Optional[str] = None,
+                           start_date: Optional[datetime] = None,
+                           end_date: Optional[datetime] = None,
+                           after: Optional[tuple] = None,
+                           fields: Optional[List[str]] = None,
+                           with_cursor: bool = False) -> Iterator[Dict]:
+        """
+        Yield model outputs newest first as the MongoDB cursor returns them
+        
+        Documents are sorted on (timestamp, _id) so a page can continue from
+        the last document of the previous one without skipping. With
+        with_cursor, each document carries its position token in '_cursor'.
+        """
+        query = {}
+        
+        if classification:
+            query['classification'] = classification
+        
+        if area_id:
+            query['area_id'] = area_id
             
-            return results
+        if start_date or end_date:
+            query['timestamp'] = {}
+            if start_date:
+                query['timestamp']['$gte'] = start_date
+            if end_date:
+                query['timestamp']['$lte'] = end_date
+        
+        if after:
+            after_timestamp, after_id = after
+            query['$or'] = [
+                {'timestamp': {'$lt': after_timestamp}},
+                {'timestamp': after_timestamp, '_id': {'$lt': after_id}}
+            ]
+        
+        fields = [field for field in (fields or MODEL_OUTPUT_RESPONSE_FIELDS) if field in MODEL_OUTPUT_RESPONSE_FIELDS]
+        
+        projection_mode = self.model_outputs_storage == 'projection'
+        if projection_mode:
+            # Read straight from raw_data in its storage layout
+            query = self.raw_data_storage.translate_query(query)
+            stored_fields = set(fields) - {'location', 'created_at'}
+            if 'location' in fields:
+                stored_fields.update(('latitude', 'longitude'))
+            projection = {self.raw_data_storage.field(field): 1 for field in stored_fields}
+        else:
+            projection = {field: 1 for field in fields}
+        projection['timestamp'] = 1  # Needed for the cursor position
+        
+        cursor = self.get_model_outputs_source().find(query, projection) \
+            .sort([('timestamp', -1), ('_id', -1)]) \
+            .batch_size(self.model_outputs_batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
+        
+        for doc in cursor:
+            if projection_mode:
+                doc = self.raw_data_storage.flatten(doc)
+                if 'location' in fields:
+                    doc['location'] = {
+                        'type': 'Point',
+                        'coordinates': [doc.get('longitude'), doc.get('latitude')]
+                    }
+                if 'created_at' in fields:
+                    doc['created_at'] = doc.get('timestamp')
+                for field in ('latitude', 'longitude'):
+                    if field not in fields:
+                        doc.pop(field, None)
             
-        except Exception as e:
-            logger.error(f"Error retrieving model outputs: {e}")
-            return []
+            if with_cursor:
+                doc['_cursor'] = encode_cursor(doc['timestamp'], doc['_id'])
+            if 'timestamp' not in fields:
+                del doc['timestamp']
+            doc['_id'] = str(doc['_id'])  # Convert ObjectId to string
+            if 'timestamp' in doc:
+                doc['timestamp'] = doc['timestamp'].isoformat()
+            if 'created_at' in doc:
+                doc['created_at'] = doc['created_at'].isoformat()
+            yield doc
     
     def get_location_summary(self, hours: int = 24) -> List[Dict]:
         """
@@ -191,6 +410,10 @@ class MongoDBManager:
             List[Dict]: Summary by location
         """
         try:
+            # Long windows are served from the rollup tiers
+            if self.retention.choose_tier(hours) != 'raw':
+                return self.retention.get_location_summary(hours)
+            
             cutoff_time = datetime.now().replace(microsecond=0) - \
                          timedelta(hours=hours)
             
@@ -259,7 +482,7 @@ class MongoDBManager:
                 }
             ]
             
-            results = list(self.model_outputs_collection.aggregate(pipeline))
+            results = list(self.get_model_outputs_source().aggregate(self.get_model_outputs_pipeline(pipeline)))
             
             # Convert timestamps to ISO format
             for result in results:
@@ -270,7 +493,8 @@ class MongoDBManager:
             
         except Exception as e:
             logger.error(f"Error getting location summary: {e}")
-            return []
+            # Raised rather than returned empty, so the response cache does not keep the failure
+            raise
     
     def get_classification_stats(self, hours: int = 24) -> Dict:
         """
@@ -283,6 +507,13 @@ class MongoDBManager:
             Dict: Overall statistics
         """
         try:
+            if self.retention.choose_tier(hours) != 'raw':
+                # Long windows are served from the rollup tiers
+                stats = self.retention.get_classification_stats(hours)
+                results = [stats] if stats else []
+            else:
+                results = None
+            
             cutoff_time = datetime.now().replace(microsecond=0) - \
                          timedelta(hours=hours)
             
@@ -328,7 +559,8 @@ class MongoDBManager:
                 }
             ]
             
-            results = list(self.model_outputs_collection.aggregate(pipeline))
+            if results is None:
+                results = list(self.get_model_outputs_source().aggregate(self.get_model_outputs_pipeline(pipeline)))
             
             if results:
                 stats = results[0]
@@ -349,19 +581,11 @@ class MongoDBManager:
                 
         except Exception as e:
             logger.error(f"Error getting classification stats: {e}")
-            return {}
+            # Raised rather than returned empty, so the response cache does not keep the failure
+            raise
     
     def close_connection(self):
-        """Close MongoDB connection"""
-        try:
-            self.client.close()
-            logger.info("MongoDB connection closed")
-        except Exception as e:
-            logger.error(f"Error closing MongoDB connection: {e}")
-    
-    def __del__(self):
-        """Cleanup when object is destroyed"""
-        try:
-            self.close_connection()
-        except:
-            pass
\ No newline at end of file
+        """Release this manager's reference to the shared MongoDB client"""
+        # The client and its pool are shared with the rest of the process,
+        # so they are closed by db_connection.close_clients() when the process exits
+        self.client = None
\ No newline at end of file
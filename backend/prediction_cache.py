@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class PredictionCache:
+    """
+    LRU cache of model probabilities keyed on quantized feature vectors
+
+    Each feature is replaced by the index of the interval it falls in
+    between the model's own split thresholds. Two rows with the same
+    intervals take the same path through every tree, so they get the same
+    probability, and a cached value is reused exactly. Features the model
+    never splits on are left out of the key. The cache wraps one model's
+    score function and is rebuilt whenever a model is swapped in.
+    """
+
+    def __init__(self, score: Callable, split_points: List[np.ndarray], max_entries: int = None):
+        self._score = score
+        self.max_entries = max_entries or int(os.getenv('PREDICTION_CACHE_SIZE', 100000))
+
+        self.features = np.array([index for index, points in enumerate(split_points) if len(points)], dtype=np.intp)
+        self.split_points = [np.asarray(split_points[index], dtype=np.float32) for index in self.features]
+        if any(len(points) >= np.iinfo(np.uint16).max for points in self.split_points):
+            raise ValueError("Too many split thresholds on one feature for a uint16 key")
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # quantized row bytes -> probability
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_keys(self, feature_matrix: np.ndarray) -> List[bytes]:
+        """One key per row: the threshold interval of every split feature"""
+        buckets = np.empty((len(feature_matrix), len(self.features)), dtype=np.uint16)
+        for column, (index, points) in enumerate(zip(self.features, self.split_points)):
+            values = feature_matrix[:, index]
+            # Splits send x < threshold left, so ties belong to the upper interval
+            buckets[:, column] = np.searchsorted(points, values, side='right')
+            # Missing values follow each split's default direction: their own interval
+            buckets[np.isnan(values), column] = len(points) + 1
+        return [row.tobytes() for row in buckets]
+
+    def score(self, feature_matrix: np.ndarray) -> np.ndarray:
+        """Probabilities for a feature matrix, scoring only rows not seen before"""
+        keys = self.make_keys(feature_matrix)
+        probabilities = np.empty(len(keys), dtype=np.float64)
+        pending = {}  # key -> rows waiting for it
+
+        with self._lock:
+            for row, key in enumerate(keys):
+                probability = self._entries.get(key)
+                if probability is None:
+                    pending.setdefault(key, []).append(row)
+                else:
+                    self._entries.move_to_end(key)
+                    probabilities[row] = probability
+            # Rows sharing a key with another row of the batch are scored once
+            self.misses += len(pending)
+            self.hits += len(keys) - len(pending)
+
+        if pending:
+            first_rows = [rows[0] for rows in pending.values()]
+            scored = np.asarray(self._score(feature_matrix[first_rows]), dtype=np.float64)
+
+            with self._lock:
+                for (key, rows), probability in zip(pending.items(), scored):
+                    probabilities[rows] = probability
+                    self._entries[key] = float(probability)
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+        return probabilities
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            # Key bytes plus the dict slot, float and key object overheads, roughly
+            entry_bytes = 2 * len(self.features) + 33 + 24 + 100
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'key_features': len(self.features),
+                'approx_bytes': len(self._entries) * entry_bytes
+            }
@@ -0,0 +1,237 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# How raw_data readings are stored:
+#   standard   - plain collection, every document carries the location attributes
+#   timeseries - MongoDB time-series collection, location attributes live in the metaField
+RAW_DATA_STORAGE_MODES = ('standard', 'timeseries')
+
+# Static per-area attributes kept in the time-series metaField
+META_FIELD = 'meta'
+META_FIELDS = [
+    'area_id', 'district', 'city', 'area_name', 'latitude', 'longitude',
+    'area_type', 'households', 'distance_to_substation_km'
+]
+
+class RawDataStorage:
+    """
+    Storage backend for raw_data readings
+
+    In time-series mode, raw_data is created with timestamp as the timeField
+    and the static location attributes as the metaField. Callers keep working
+    with flat records. field() maps a flat field name to its stored path,
+    to_document() nests a record for insertion, and flatten() undoes it.
+
+    Migrating an existing plain collection copies it in _id order and records
+    the last copied _id in raw_data_migrations after every batch. A worker
+    holds the migration under a lease that it renews with each batch. After a
+    restart, or when that worker dies, setup() picks the migration up again
+    from the checkpoint.
+    """
+
+    def __init__(self, database, mode: str = None):
+        self.db = database
+        self.collection = database.raw_data
+        self.mode = (mode or os.getenv('RAW_DATA_STORAGE', 'standard')).lower()
+        if self.mode not in RAW_DATA_STORAGE_MODES:
+            logger.warning(f"Unknown RAW_DATA_STORAGE '{self.mode}', using 'standard'")
+            self.mode = 'standard'
+
+        self.migration_batch_size = int(os.getenv('RAW_DATA_MIGRATION_BATCH_SIZE', 10000))
+        self.migration_lease_seconds = float(os.getenv('RAW_DATA_MIGRATION_LEASE_SECONDS', 120))
+        self.migrations_collection = database.raw_data_migrations
+        self.migration = {'state': 'idle', 'migrated': 0}
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    @property
+    def is_timeseries(self) -> bool:
+        return self.mode == 'timeseries'
+
+    def setup(self):
+        """Create the time-series collection, migrating an existing plain collection"""
+        if not self.is_timeseries:
+            return
+
+        try:
+            existing = list(self.db.list_collections(filter={'name': 'raw_data'}))
+            if existing and existing[0].get('type') == 'timeseries':
+                logger.info("Using existing raw_data time-series collection")
+                self.resume_migrations()
+                return
+
+            legacy_name = None
+            if existing:
+                legacy_name = f"raw_data_legacy_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                self.collection.rename(legacy_name)
+                self.migrations_collection.insert_one({
+                    '_id': legacy_name, 'state': 'running', 'last_id': None, 'migrated': 0,
+                    'started_at': datetime.now(), 'owner': None, 'heartbeat': None
+                })
+                logger.info(f"Renamed raw_data collection to {legacy_name} for migration")
+
+            self.db.create_collection('raw_data', timeseries={
+                'timeField': 'timestamp',
+                'metaField': META_FIELD,
+                'granularity': os.getenv('RAW_DATA_TIMESERIES_GRANULARITY', 'seconds')
+            })
+            logger.info("Created raw_data time-series collection")
+
+            if legacy_name:
+                threading.Thread(target=self._run_migration, args=(legacy_name,), daemon=True).start()
+
+        except Exception as e:
+            # Another worker may have created it first
+            try:
+                existing = list(self.db.list_collections(filter={'name': 'raw_data'}))
+                if existing and existing[0].get('type') == 'timeseries':
+                    return
+            except Exception:
+                pass
+
+            logger.warning(f"Could not set up raw_data time-series collection, using standard storage: {e}")
+            self.mode = 'standard'
+
+    def resume_migrations(self):
+        """Continue migrations that an earlier run left unfinished"""
+        try:
+            for progress in self.migrations_collection.find({'state': 'running'}, {'_id': 1}):
+                logger.info(f"Resuming raw_data migration from {progress['_id']}")
+                threading.Thread(target=self._run_migration, args=(progress['_id'],), daemon=True).start()
+        except Exception as e:
+            logger.error(f"Error checking for unfinished raw_data migrations: {e}")
+
+    def _claim_migration(self, source_name: str) -> bool:
+        """Take (or renew) the migration lease unless another live worker holds it"""
+        now = datetime.now()
+        claimed = self.migrations_collection.find_one_and_update(
+            {'_id': source_name, 'state': 'running', '$or': [
+                {'owner': {'$in': [None, self._owner]}},
+                {'heartbeat': {'$lt': now - timedelta(seconds=self.migration_lease_seconds)}}
+            ]},
+            {'$set': {'owner': self._owner, 'heartbeat': now}},
+            return_document=ReturnDocument.AFTER
+        )
+        return claimed is not None
+
+    def _run_migration(self, source_name: str):
+        """Migrate once this process holds the lease, retrying after failures until it completes"""
+        while True:
+            try:
+                if self._claim_migration(source_name):
+                    if self.migrate_from(source_name):
+                        return
+                elif not self.migrations_collection.count_documents({'_id': source_name, 'state': 'running'}):
+                    return
+            except Exception as e:
+                logger.error(f"Error claiming raw_data migration from {source_name}: {e}")
+            time.sleep(self.migration_lease_seconds / 2)
+
+    def migrate_from(self, source_name: str) -> bool:
+        """Copy documents from a plain collection into the time-series collection, resuming at the checkpoint"""
+        source = self.db[source_name]
+        progress = self.migrations_collection.find_one({'_id': source_name}) or {}
+        last_id = progress.get('last_id')
+        self.migration = {'state': 'running', 'source': source_name, 'migrated': progress.get('migrated', 0),
+                          'started_at': datetime.now().isoformat(), 'resumed': last_id is not None}
+        try:
+            query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+            batch = []
+            first_batch = True
+            for record in source.find(query).sort('_id', 1).batch_size(self.migration_batch_size):
+                batch.append(self.to_document(record))
+                if len(batch) >= self.migration_batch_size:
+                    self._migrate_batch(source_name, batch, first_batch)
+                    first_batch = False
+                    batch = []
+            if batch:
+                self._migrate_batch(source_name, batch, first_batch)
+
+            self.migrations_collection.update_one(
+                {'_id': source_name}, {'$set': {'state': 'completed', 'finished_at': datetime.now()}}
+            )
+            self.migration['state'] = 'completed'
+            logger.info(f"Migrated {self.migration['migrated']} raw_data records from {source_name}")
+            return True
+
+        except Exception as e:
+            self.migration['state'] = 'failed'
+            self.migration['error'] = str(e)
+            logger.error(f"Error migrating raw_data from {source_name}: {e}")
+            return False
+
+    def _migrate_batch(self, source_name: str, batch: List[Dict], first_batch: bool):
+        """Insert one batch and move the checkpoint past it"""
+        last_id = batch[-1]['_id']
+        copied = len(batch)
+        if first_batch:
+            # An interrupted run may have inserted the batch after the checkpoint already.
+            # The timestamp range lets the time-series collection skip buckets outside the batch.
+            timestamps = [document['timestamp'] for document in batch]
+            stored = {document['_id'] for document in self.collection.find(
+                {'timestamp': {'$gte': min(timestamps), '$lte': max(timestamps)},
+                 '_id': {'$in': [document['_id'] for document in batch]}},
+                {'_id': 1}
+            )}
+            batch = [document for document in batch if document['_id'] not in stored]
+        if batch:
+            self.collection.insert_many(batch, ordered=False)
+        self.migration['migrated'] += copied
+        result = self.migrations_collection.update_one(
+            {'_id': source_name, 'owner': self._owner},
+            {'$set': {'last_id': last_id, 'migrated': self.migration['migrated'], 'heartbeat': datetime.now()}}
+        )
+        if not result.matched_count:
+            raise RuntimeError("migration lease was taken over by another worker")
+
+    def field(self, name: str) -> str:
+        """Stored path of a flat record field"""
+        if self.is_timeseries and name in META_FIELDS:
+            return f"{META_FIELD}.{name}"
+        return name
+
+    def translate_query(self, query: Dict) -> Dict:
+        """Rewrite a filter on flat field names to stored paths"""
+        return {self.field(key): value for key, value in query.items()}
+
+    def flatten_stages(self) -> List[Dict]:
+        """Pipeline stages that lift the meta attributes back to top-level fields"""
+        if not self.is_timeseries:
+            return []
+        return [{'$addFields': {name: f"${META_FIELD}.{name}" for name in META_FIELDS}}]
+
+    def to_document(self, record: Dict) -> Dict:
+        """Stored form of a flat record"""
+        if not self.is_timeseries:
+            return record
+        document = {key: value for key, value in record.items() if key not in META_FIELDS}
+        document[META_FIELD] = {name: record.get(name) for name in META_FIELDS}
+        return document
+
+    def flatten(self, document: Dict) -> Dict:
+        """Flat form of a stored document"""
+        meta = document.pop(META_FIELD, None)
+        if meta:
+            document.update(meta)
+        return document
+
+    def to_documents(self, records: List[Dict]) -> List[Dict]:
+        """Documents to insert for flat records (the records themselves in the plain layout)"""
+        if not self.is_timeseries:
+            return records
+        return [self.to_document(record) for record in records]
+
+    def insert_many(self, records: List[Dict]):
+        """Insert flat records in the storage layout"""
+        return self.collection.insert_many(self.to_documents(records))
+
+    def status(self) -> Dict:
+        return {'mode': self.mode, 'migration': self.migration}
@@ -0,0 +1,452 @@
+"""
+Offline re-scoring of historical raw_data
+
+When the model or the classification threshold changes, a rescore job runs
+the stored readings through the ModelLoader batch path again and writes
+back the classification and illegal_probability of the records that changed.
+
+The _id range of the matching records is split into partitions that run on
+a process pool. Each worker reads its partition in _id order in chunks,
+scores each chunk with one model call and writes the changes with an
+unordered bulk_write. After every chunk the worker checkpoints its last _id
+in rescore_checkpoints, so an interrupted job resumes where it stopped.
+
+A time-series raw_data collection has no _id index, so its partitions are
+timestamp ranges read in timestamp slices, and the job checkpoints the end
+of the last slice. Updating its readings needs MongoDB 7.0 or newer.
+
+Usage as a CLI:
+    python rescore.py --threshold 0.1 --start 2024-06-01T00:00 --workers 8
+    python rescore.py --resume <job_id>
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from db_connection import get_database
+from feature_config import BASIC_FEATURES
+from model_loader import ModelLoader
+from raw_data_storage import RawDataStorage
+from retention import RetentionManager
+
+logger = logging.getLogger(__name__)
+
+# Stored fields a worker reads to rebuild the model features
+RESCORE_FIELDS = ['timestamp', 'area_id', 'classification', 'illegal_probability'] + BASIC_FEATURES
+
+# First timestamp slice of a time-series partition; later slices adapt to RESCORE_CHUNK_SIZE
+TIME_SLICE_SECONDS = float(os.getenv('RESCORE_TIME_SLICE_SECONDS', 60))
+
+# Updating measurement fields of a time-series collection needs MongoDB 7.0
+TIMESERIES_UPDATE_MIN_VERSION = (7, 0)
+
+# Model loaded once per worker process
+_worker_model = None
+
+def _get_worker_model(model_path: str) -> ModelLoader:
+    global _worker_model
+    if _worker_model is None or _worker_model.model_path != model_path:
+        # One scoring thread per process; the pool provides the parallelism
+        _worker_model = ModelLoader(model_path, nthread=1)
+    return _worker_model
+
+def _id_chunks(collection, raw_data_storage, query: Dict, projection: Dict, partition: Dict,
+               checkpoint: Dict, chunk_size: int):
+    """Chunks of a partition in _id order, with the checkpoint fields after each one"""
+    last_id = checkpoint.get('last_id')
+    while True:
+        id_range = {}
+        if last_id is not None:
+            id_range['$gt'] = last_id
+        elif partition.get('lower') is not None:
+            id_range['$gte'] = partition['lower']
+        if partition.get('upper') is not None:
+            id_range['$lt'] = partition['upper']
+
+        chunk_query = dict(query)
+        if id_range:
+            chunk_query['_id'] = id_range
+
+        records = [raw_data_storage.flatten(document) for document in
+                   collection.find(chunk_query, projection).sort('_id', 1).limit(chunk_size)]
+        if not records:
+            return
+        last_id = records[-1]['_id']
+        yield records, {'last_id': last_id}
+        if len(records) < chunk_size:
+            return
+
+def _time_chunks(collection, raw_data_storage, query: Dict, projection: Dict, partition: Dict,
+                 checkpoint: Dict, chunk_size: int):
+    """
+    Chunks of a partition as timestamp slices, with the checkpoint fields after each one
+
+    Time-series collections have no _id index, so an _id range scans every
+    bucket. A timestamp range lets the server skip the buckets outside it.
+    The slice length adapts to hold about chunk_size records.
+    """
+    cursor = checkpoint.get('last_timestamp') or partition.get('lower')
+    upper = partition.get('upper')
+    slice_seconds = checkpoint.get('slice_seconds') or TIME_SLICE_SECONDS
+    if cursor is None or upper is None:
+        return
+    while cursor < upper:
+        end = min(cursor + timedelta(seconds=slice_seconds), upper)
+        chunk_query = {'$and': [query, {'timestamp': {'$gte': cursor, '$lt': end}}]}
+        records = [raw_data_storage.flatten(document) for document in collection.find(chunk_query, projection)]
+        yield records, {'last_timestamp': end, 'slice_seconds': slice_seconds}
+        cursor = end
+        slice_seconds *= min(max(chunk_size / max(len(records), 1), 0.5), 2.0)
+
+def rescore_partition(config: Dict, partition: Dict) -> Dict:
+    """
+    Re-score one partition, resuming after its checkpoint
+
+    Runs in a worker process with its own MongoDB client.
+
+    Returns:
+        Dict: The final checkpoint of the partition
+    """
+    db = get_database(config['mongodb_uri'])
+    raw_data_storage = RawDataStorage(db, mode=config['raw_data_mode'])
+    collection = raw_data_storage.collection
+    checkpoints = db.rescore_checkpoints
+    model_loader = _get_worker_model(config['model_path'])
+    threshold = config['threshold']
+    chunk_size = config['chunk_size']
+
+    projection = {raw_data_storage.field(field): 1 for field in RESCORE_FIELDS}
+    checkpoint = checkpoints.find_one({'_id': partition['_id']}) or partition
+    query = raw_data_storage.translate_query(config['query'])
+    chunks = _time_chunks if raw_data_storage.is_timeseries else _id_chunks
+
+    for records, position in chunks(collection, raw_data_storage, query, projection, partition,
+                                    checkpoint, chunk_size):
+        raw_updates = []
+        output_updates = []
+        min_changed = None
+        if records:
+            # Strict: a failed model call must stop the job, not rewrite the chunk as legal
+            classifications, probabilities = model_loader.classify_batch(records, threshold, strict=True)
+
+            for record, classification, probability in zip(records, classifications, probabilities):
+                probability = round(float(probability), 4)
+                if classification == record.get('classification') and probability == record.get('illegal_probability'):
+                    continue
+
+                changes = {'classification': classification, 'illegal_probability': probability}
+                selector = {'_id': record['_id']}
+                if raw_data_storage.is_timeseries:
+                    # No _id index: the time and meta fields let the server find the bucket
+                    selector['timestamp'] = record['timestamp']
+                    selector[raw_data_storage.field('area_id')] = record['area_id']
+                raw_updates.append(UpdateOne(selector, {'$set': changes}))
+                if config['stores_model_outputs']:
+                    output_updates.append(UpdateOne(
+                        {'area_id': record['area_id'], 'timestamp': record['timestamp']}, {'$set': changes}
+                    ))
+                if min_changed is None or record['timestamp'] < min_changed:
+                    min_changed = record['timestamp']
+
+        if raw_updates:
+            collection.bulk_write(raw_updates, ordered=False)
+        if output_updates:
+            db.model_outputs.bulk_write(output_updates, ordered=False)
+
+        update = {
+            '$set': {**position, 'updated_at': datetime.now()},
+            '$inc': {'processed': len(records), 'changed': len(raw_updates)}
+        }
+        if min_changed is not None:
+            update['$min'] = {'min_changed_timestamp': min_changed}
+        checkpoints.update_one({'_id': partition['_id']}, update)
+
+    checkpoints.update_one({'_id': partition['_id']}, {'$set': {'state': 'completed', 'updated_at': datetime.now()}})
+    return checkpoints.find_one({'_id': partition['_id']})
+
+class BatchRescorer:
+    """Plans, runs and resumes rescore jobs over raw_data"""
+
+    def __init__(self, database, raw_data_storage, model_path: str, stores_model_outputs: bool = False,
+                 mongodb_uri: str = None, workers: int = None, chunk_size: int = None):
+        self.db = database
+        self.raw_data_storage = raw_data_storage
+        self.model_path = os.path.abspath(model_path)
+        self.stores_model_outputs = stores_model_outputs
+        self.mongodb_uri = mongodb_uri or os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+        # workers=0 runs partitions in the calling process
+        self.workers = workers if workers is not None else int(os.getenv('RESCORE_WORKERS', os.cpu_count() or 1))
+        self.chunk_size = chunk_size or int(os.getenv('RESCORE_CHUNK_SIZE', 20000))
+        self.partitions_per_worker = int(os.getenv('RESCORE_PARTITIONS_PER_WORKER', 4))
+
+        self.jobs_collection = database.rescore_jobs
+        self.checkpoints_collection = database.rescore_checkpoints
+
+        self._lock = threading.Lock()
+        self.running_job = None
+
+    def create_job(self, threshold: float, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   area_ids: Optional[List[str]] = None, model_path: Optional[str] = None) -> Dict:
+        """Record a new job and split the matching _id range into partitions"""
+        query = {}
+        if start or end:
+            query['timestamp'] = {}
+            if start:
+                query['timestamp']['$gte'] = start
+            if end:
+                query['timestamp']['$lt'] = end
+        if area_ids:
+            query['area_id'] = {'$in': area_ids}
+
+        self.check_server_version()
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            '_id': job_id,
+            'state': 'pending',
+            'threshold': threshold,
+            'model_path': os.path.abspath(model_path) if model_path else self.model_path,
+            'query': query,
+            'chunk_size': self.chunk_size,
+            'created_at': datetime.now()
+        }
+        self.jobs_collection.insert_one(job)
+
+        partitions = max(self.workers, 1) * self.partitions_per_worker
+        if self.raw_data_storage.is_timeseries:
+            bounds = self._time_bounds(query, partitions)
+        else:
+            bounds = [None] + self._partition_boundaries(query, partitions) + [None]
+        self.checkpoints_collection.insert_many([
+            {'_id': f"{job_id}:{index}", 'job_id': job_id, 'index': index,
+             'lower': bounds[index], 'upper': bounds[index + 1],
+             'last_id': None, 'last_timestamp': None, 'processed': 0, 'changed': 0, 'state': 'pending'}
+            for index in range(len(bounds) - 1)
+        ])
+        return job
+
+    def check_server_version(self):
+        """Refuse to rescore a time-series collection on a server that cannot update its readings"""
+        if not self.raw_data_storage.is_timeseries:
+            return
+        version = tuple(self.db.client.server_info().get('versionArray', [0, 0])[:2])
+        if version < TIMESERIES_UPDATE_MIN_VERSION:
+            raise RuntimeError(
+                f"Rescoring time-series raw_data needs MongoDB "
+                f"{'.'.join(map(str, TIMESERIES_UPDATE_MIN_VERSION))} or newer, server is {'.'.join(map(str, version))}"
+            )
+
+    def _time_bounds(self, query: Dict, partitions: int) -> List:
+        """Timestamp bounds of time-series partitions, from the first to just past the last matching record"""
+        collection = self.raw_data_storage.collection
+        match = self.raw_data_storage.translate_query(query)
+        first = list(collection.find(match, {'timestamp': 1}).sort('timestamp', 1).limit(1))
+        last = list(collection.find(match, {'timestamp': 1}).sort('timestamp', -1).limit(1))
+        if not first:
+            return [None, None]
+        lower, upper = first[0]['timestamp'], last[0]['timestamp'] + timedelta(milliseconds=1)
+        boundaries = [boundary for boundary in self._partition_boundaries(query, partitions, field='timestamp')
+                      if lower < boundary < upper]
+        return [lower] + boundaries + [upper]
+
+    def _partition_boundaries(self, query: Dict, partitions: int, field: str = '_id') -> List:
+        """Values of field splitting the matching records into roughly equal partitions"""
+        if partitions <= 1:
+            return []
+        samples_per_partition = 20
+        try:
+            pipeline = [
+                {'$match': self.raw_data_storage.translate_query(query)},
+                {'$sample': {'size': partitions * samples_per_partition}},
+                {'$project': {field: 1}}
+            ]
+            sample = sorted(document[field] for document in self.raw_data_storage.collection.aggregate(pipeline))
+        except Exception as e:
+            logger.warning(f"Could not sample raw_data for rescore partitions: {e}")
+            return []
+        boundaries = sample[samples_per_partition::samples_per_partition]
+        return sorted(set(boundaries))
+
+    def run(self, job_id: str) -> Dict:
+        """Run (or resume) every unfinished partition of a job"""
+        job = self.jobs_collection.find_one({'_id': job_id})
+        if job is None:
+            raise ValueError(f"Rescore job {job_id} not found")
+
+        with self._lock:
+            if self.running_job is not None:
+                raise RuntimeError(f"Rescore job {self.running_job} is already running")
+            self.running_job = job_id
+
+        try:
+            self.check_server_version()
+        except Exception:
+            with self._lock:
+                self.running_job = None
+            raise
+
+        started = time.perf_counter()
+        self.jobs_collection.update_one({'_id': job_id}, {'$set': {'state': 'running', 'started_at': datetime.now()},
+                                                         '$unset': {'error': ''}})
+        config = {
+            'mongodb_uri': self.mongodb_uri,
+            'raw_data_mode': self.raw_data_storage.mode,
+            'stores_model_outputs': self.stores_model_outputs,
+            'model_path': job['model_path'],
+            'threshold': job['threshold'],
+            'chunk_size': job['chunk_size'],
+            'query': job['query']
+        }
+        partitions = list(self.checkpoints_collection.find({'job_id': job_id, 'state': {'$ne': 'completed'}}))
+
+        try:
+            if self.workers == 0:
+                for partition in partitions:
+                    rescore_partition(config, partition)
+            else:
+                # Spawned workers: forking a process with live MongoDB clients and model threads is unsafe.
+                # They re-import the main module as __mp_main__, so app.py builds no backend there.
+                context = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as executor:
+                    futures = [executor.submit(rescore_partition, config, partition) for partition in partitions]
+                    for future in as_completed(futures):
+                        future.result()
+
+            status = self.get_status(job_id)
+            elapsed = time.perf_counter() - started
+            self.jobs_collection.update_one({'_id': job_id}, {'$set': {
+                'state': 'completed',
+                'finished_at': datetime.now(),
+                'last_run_seconds': round(elapsed, 3)
+            }})
+            logger.info(f"Rescore job {job_id} processed {status['processed']} records "
+                        f"({status['changed']} changed) in {elapsed:.1f}s")
+            return self.get_status(job_id)
+
+        except Exception as e:
+            self.jobs_collection.update_one({'_id': job_id}, {'$set': {'state': 'failed', 'error': str(e)}})
+            logger.error(f"Rescore job {job_id} failed: {e}")
+            raise
+
+        finally:
+            with self._lock:
+                self.running_job = None
+
+    def get_status(self, job_id: str) -> Optional[Dict]:
+        """Job settings plus progress summed over its partitions"""
+        job = self.jobs_collection.find_one({'_id': job_id})
+        if job is None:
+            return None
+
+        partitions = list(self.checkpoints_collection.find({'job_id': job_id}))
+        min_changed = self.get_changed_since(job_id)
+        status = {
+            'job_id': job_id,
+            'state': job['state'],
+            'threshold': job['threshold'],
+            'model_path': job['model_path'],
+            'partitions': len(partitions),
+            'completed_partitions': sum(1 for partition in partitions if partition['state'] == 'completed'),
+            'processed': sum(partition['processed'] for partition in partitions),
+            'changed': sum(partition['changed'] for partition in partitions),
+            'min_changed_timestamp': min_changed.isoformat() if min_changed else None,
+            'error': job.get('error')
+        }
+        for key in ('created_at', 'started_at', 'finished_at'):
+            status[key] = job[key].isoformat() if job.get(key) else None
+        if job.get('last_run_seconds'):
+            status['records_per_minute'] = int(status['processed'] / job['last_run_seconds'] * 60)
+        return status
+
+    def get_changed_since(self, job_id: str) -> Optional[datetime]:
+        """Timestamp of the oldest record a job changed"""
+        timestamps = [partition['min_changed_timestamp'] for partition in
+                      self.checkpoints_collection.find({'job_id': job_id}, {'min_changed_timestamp': 1})
+                      if partition.get('min_changed_timestamp')]
+        return min(timestamps) if timestamps else None
+
+    def list_jobs(self) -> List[Dict]:
+        return [self.get_status(job['_id']) for job in self.jobs_collection.find({}, {'_id': 1}).sort('created_at', -1)]
+
+class RescoreManager:
+    """Runs rescore jobs in a background thread and refreshes derived data afterwards"""
+
+    def __init__(self, rescorer: BatchRescorer, retention=None, response_cache=None, stream_aggregator=None):
+        self.rescorer = rescorer
+        self.retention = retention
+        self.response_cache = response_cache
+        self.stream_aggregator = stream_aggregator
+        self.thread = None
+
+    def start(self, job_id: Optional[str] = None, **job_options) -> Dict:
+        """Start a new job, or resume job_id"""
+        if self.thread is not None and self.thread.is_alive():
+            raise RuntimeError(f"Rescore job {self.rescorer.running_job} is already running")
+        if job_id is None:
+            job_id = self.rescorer.create_job(**job_options)['_id']
+        elif self.rescorer.get_status(job_id) is None:
+            raise ValueError(f"Rescore job {job_id} not found")
+
+        self.thread = threading.Thread(target=self._run, args=(job_id,), daemon=True)
+        self.thread.start()
+        return self.rescorer.get_status(job_id)
+
+    def _run(self, job_id: str):
+        try:
+            self.rescorer.run(job_id)
+        except Exception:
+            return
+
+        # Rollups, streaming counters and cached responses were built from the old classifications
+        changed_since = self.rescorer.get_changed_since(job_id)
+        if changed_since is not None and self.retention is not None:
+            self.retention.rewind(changed_since)
+        if changed_since is not None and self.stream_aggregator is not None:
+            self.stream_aggregator.invalidate(changed_since)
+        if self.response_cache is not None:
+            self.response_cache.bump_version()
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score historical raw_data with the current model")
+    parser.add_argument('--threshold', type=float, default=float(os.getenv('CLASSIFICATION_THRESHOLD', 0.08)))
+    parser.add_argument('--start', type=datetime.fromisoformat, help="ISO start time (inclusive)")
+    parser.add_argument('--end', type=datetime.fromisoformat, help="ISO end time (exclusive)")
+    parser.add_argument('--area-id', help="Comma separated area IDs")
+    parser.add_argument('--model', default='model/model.joblib', help="Model file to score with")
+    parser.add_argument('--workers', type=int, help="Worker processes (0 runs in this process)")
+    parser.add_argument('--resume', metavar='JOB_ID', help="Resume an interrupted job")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    database = get_database()
+    rescorer = BatchRescorer(
+        database, RawDataStorage(database), args.model,
+        stores_model_outputs=os.getenv('MODEL_OUTPUTS_STORAGE', 'view').lower() == 'collection',
+        workers=args.workers
+    )
+
+    job_id = args.resume
+    if job_id is None:
+        area_ids = [area_id.strip() for area_id in args.area_id.split(',')] if args.area_id else None
+        job_id = rescorer.create_job(args.threshold, args.start, args.end, area_ids)['_id']
+        logger.info(f"Created rescore job {job_id}")
+
+    status = rescorer.run(job_id)
+    logger.info(f"Rescore job {job_id}: {status}")
+
+    # Let the next rollup rebuild the buckets that changed
+    changed_since = rescorer.get_changed_since(job_id)
+    if changed_since is not None:
+        RetentionManager(database, rescorer.raw_data_storage).rewind(changed_since)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    LRU cache for API responses, invalidated when the simulator commits a tick
+
+    Entries are keyed by endpoint and request parameters and tagged with the
+    data version they were computed at. bump_version() invalidates every
+    entry at once. Concurrent misses for the same key wait on one computation,
+    so N dashboards polling between ticks cost one query.
+    """
+
+    def __init__(self, max_entries: int = None, max_age_seconds: float = None):
+        self.max_entries = max_entries or int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 256))
+        # Upper bound on staleness for changes that do not come from a tick (rollups, TTL)
+        self.max_age_seconds = max_age_seconds if max_age_seconds is not None else \
+            float(os.getenv('RESPONSE_CACHE_MAX_AGE_SECONDS', 60))
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (version, created_at, value)
+        self._inflight = {}            # key -> threading.Event
+        self.version = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def bump_version(self):
+        """Invalidate all entries (called after each committed tick)"""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    @staticmethod
+    def make_key(endpoint: str, params: Dict) -> tuple:
+        return (endpoint,) + tuple(sorted(params.items()))
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        version, created_at, value = entry
+        if version != self.version or time.monotonic() - created_at > self.max_age_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_or_compute(self, endpoint: str, params: Dict, compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached response for endpoint and params, computing it once on a miss
+
+        If compute raises, nothing is stored and the exception reaches the caller.
+        """
+        key = self.make_key(endpoint, params)
+
+        while True:
+            with self._lock:
+                entry = self._lookup(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry[2]
+
+                event = self._inflight.get(key)
+                if event is None:
+                    # This caller computes the value; others wait for it
+                    event = self._inflight[key] = threading.Event()
+                    version = self.version
+                    self.misses += 1
+                    break
+            event.wait()
+
+        try:
+            value = compute()
+            with self._lock:
+                # Don't store a value computed against data that changed meanwhile
+                if version == self.version:
+                    self._entries[key] = (version, time.monotonic(), value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self.version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,387 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Static location fields copied into rollup documents
+ROLLUP_LOCATION_FIELDS = ['area_name', 'district', 'city', 'latitude', 'longitude']
+
+def _env_hours(name: str, default: float) -> float:
+    """Retention setting in hours; 0 means keep forever"""
+    value = float(os.getenv(name, default))
+    return value if value > 0 else float('inf')
+
+class RetentionManager:
+    """
+    Data retention and rollup tiers
+
+    raw_data expires through a TTL. Closed hours are downsampled into
+    rollup_hourly and closed days into rollup_daily, each keeping per-area
+    counts and probability sums. Window queries can then read the coarsest
+    tier that still covers the requested number of hours, plus the finer tiers
+    for the part that has not been rolled up yet.
+    """
+
+    def __init__(self, database, raw_data_storage, stores_model_outputs: bool = False):
+        self.db = database
+        self.raw_data_storage = raw_data_storage
+        self.stores_model_outputs = stores_model_outputs
+
+        self.rollup_state_collection = database.rollup_state
+
+        self.raw_retention_hours = _env_hours('RAW_DATA_RETENTION_HOURS', 72)
+        self.tiers = [
+            {'name': 'raw', 'granularity_hours': 0,
+             'retention_hours': self.raw_retention_hours},
+            {'name': 'hourly', 'granularity_hours': 1,
+             'retention_hours': _env_hours('HOURLY_ROLLUP_RETENTION_HOURS', 90 * 24),
+             'collection': database.rollup_hourly},
+            {'name': 'daily', 'granularity_hours': 24,
+             'retention_hours': _env_hours('DAILY_ROLLUP_RETENTION_HOURS', 0),
+             'collection': database.rollup_daily}
+        ]
+        # A tier is only used when the window spans at least this many of its buckets
+        self.min_buckets = int(os.getenv('ROLLUP_MIN_BUCKETS', 24))
+
+    def get_tier(self, name: str) -> Dict:
+        return next(tier for tier in self.tiers if tier['name'] == name)
+
+    def ensure_ttl_indexes(self):
+        """Create TTL indexes (or the time-series expiry) for every tier"""
+        raw_seconds = self._ttl_seconds(self.raw_retention_hours)
+        try:
+            if self.raw_data_storage.is_timeseries:
+                self.db.command('collMod', 'raw_data', expireAfterSeconds=raw_seconds or 'off')
+            elif raw_seconds:
+                self._ensure_ttl_index(self.db.raw_data, 'timestamp', raw_seconds)
+
+            if self.stores_model_outputs and raw_seconds:
+                self._ensure_ttl_index(self.db.model_outputs, 'created_at', raw_seconds)
+
+            for tier in self.tiers[1:]:
+                seconds = self._ttl_seconds(tier['retention_hours'])
+                if seconds:
+                    self._ensure_ttl_index(tier['collection'], 'bucket_start', seconds)
+                else:
+                    tier['collection'].create_index([('bucket_start', 1)])
+
+            logger.info("Retention TTL indexes ensured")
+        except Exception as e:
+            logger.warning(f"Could not create retention TTL indexes: {e}")
+
+    def _ttl_seconds(self, hours: float) -> Optional[int]:
+        return None if hours == float('inf') else int(hours * 3600)
+
+    def _ensure_ttl_index(self, collection, field: str, seconds: int):
+        """Create a single-field TTL index, updating the expiry if it already exists"""
+        try:
+            collection.create_index([(field, 1)], expireAfterSeconds=seconds)
+        except Exception:
+            self.db.command('collMod', collection.name,
+                            index={'keyPattern': {field: 1}, 'expireAfterSeconds': seconds})
+
+    # Rollups
+
+    def get_watermark(self, tier_name: str) -> Optional[datetime]:
+        """End of the last bucket rolled up for a tier"""
+        state = self.rollup_state_collection.find_one({'_id': tier_name})
+        return state['rolled_until'] if state else None
+
+    def _set_watermark(self, tier_name: str, rolled_until: datetime):
+        self.rollup_state_collection.update_one(
+            {'_id': tier_name},
+            {'$set': {'rolled_until': rolled_until, 'updated_at': datetime.now()}},
+            upsert=True
+        )
+
+    def rewind(self, since: datetime):
+        """Move the watermarks back so buckets from since onwards are rolled up again"""
+        floors = {
+            'hourly': since.replace(minute=0, second=0, microsecond=0),
+            'daily': since.replace(hour=0, minute=0, second=0, microsecond=0)
+        }
+        for tier_name, floor in floors.items():
+            watermark = self.get_watermark(tier_name)
+            if watermark is not None and watermark > floor:
+                self._set_watermark(tier_name, floor)
+                logger.info(f"Rewound {tier_name} rollup watermark to {floor}")
+
+    def rollup(self) -> Dict:
+        """Roll closed hours of raw_data into rollup_hourly and closed days into rollup_daily"""
+        results = {}
+        try:
+            now = datetime.now()
+            results['hourly'] = self._rollup_hourly(now.replace(minute=0, second=0, microsecond=0))
+            results['daily'] = self._rollup_daily(now.replace(hour=0, minute=0, second=0, microsecond=0))
+            logger.info(f"Rollup completed: {results}")
+        except Exception as e:
+            logger.error(f"Error rolling up data: {e}")
+            results['error'] = str(e)
+        return results
+
+    def _rollup_hourly(self, until: datetime) -> int:
+        start = self.get_watermark('hourly')
+        if start is None:
+            first = list(self.db.raw_data.find({}, {'timestamp': 1}).sort('timestamp', 1).limit(1))
+            if not first:
+                return 0
+            start = first[0]['timestamp'].replace(minute=0, second=0, microsecond=0)
+
+        field = self.raw_data_storage.field
+        hours = 0
+        # One day of raw data per pipeline keeps each $group bounded
+        while start < until:
+            end = min(start + timedelta(days=1), until)
+            pipeline = [
+                {'$match': {'timestamp': {'$gte': start, '$lt': end}}},
+                {
+                    '$group': {
+                        '_id': {
+                            'area_id': f"${field('area_id')}",
+                            'bucket_start': {
+                                '$dateFromParts': {
+                                    'year': {'$year': '$timestamp'},
+                                    'month': {'$month': '$timestamp'},
+                                    'day': {'$dayOfMonth': '$timestamp'},
+                                    'hour': {'$hour': '$timestamp'}
+                                }
+                            }
+                        },
+                        'total_count': {'$sum': 1},
+                        'illegal_count': {
+                            '$sum': {'$cond': [{'$eq': ['$classification', 'illegal']}, 1, 0]}
+                        },
+                        'probability_sum': {'$sum': '$illegal_probability'},
+                        'last_updated': {'$max': '$timestamp'},
+                        **{name: {'$first': f"${field(name)}"} for name in ROLLUP_LOCATION_FIELDS}
+                    }
+                },
+                *self._merge_stages('rollup_hourly')
+            ]
+            list(self.db.raw_data.aggregate(pipeline, allowDiskUse=True))
+            hours += int((end - start).total_seconds() // 3600)
+            self._set_watermark('hourly', end)
+            start = end
+        return hours
+
+    def _rollup_daily(self, until: datetime) -> int:
+        hourly_until = self.get_watermark('hourly')
+        if hourly_until is None:
+            return 0
+        until = min(until, hourly_until.replace(hour=0))
+
+        start = self.get_watermark('daily')
+        if start is None:
+            first = list(self.db.rollup_hourly.find({}, {'bucket_start': 1}).sort('bucket_start', 1).limit(1))
+            if not first:
+                return 0
+            start = first[0]['bucket_start'].replace(hour=0)
+        if start >= until:
+            return 0
+
+        pipeline = [
+            {'$match': {'bucket_start': {'$gte': start, '$lt': until}}},
+            {
+                '$group': {
+                    '_id': {
+                        'area_id': '$area_id',
+                        'bucket_start': {
+                            '$dateFromParts': {
+                                'year': {'$year': '$bucket_start'},
+                                'month': {'$month': '$bucket_start'},
+                                'day': {'$dayOfMonth': '$bucket_start'}
+                            }
+                        }
+                    },
+                    'total_count': {'$sum': '$total_count'},
+                    'illegal_count': {'$sum': '$illegal_count'},
+                    'probability_sum': {'$sum': '$probability_sum'},
+                    'last_updated': {'$max': '$last_updated'},
+                    **{name: {'$first': f"${name}"} for name in ROLLUP_LOCATION_FIELDS}
+                }
+            },
+            *self._merge_stages('rollup_daily')
+        ]
+        list(self.db.rollup_hourly.aggregate(pipeline, allowDiskUse=True))
+        self._set_watermark('daily', until)
+        return (until - start).days
+
+    def _merge_stages(self, target: str) -> List[Dict]:
+        """Flatten a grouped rollup and upsert it into the target tier"""
+        return [
+            {
+                '$project': {
+                    '_id': 0,
+                    'area_id': '$_id.area_id',
+                    'bucket_start': '$_id.bucket_start',
+                    'total_count': 1,
+                    'illegal_count': 1,
+                    'probability_sum': 1,
+                    'last_updated': 1,
+                    **{name: 1 for name in ROLLUP_LOCATION_FIELDS}
+                }
+            },
+            {
+                '$merge': {
+                    'into': target,
+                    'on': ['area_id', 'bucket_start'],
+                    'whenMatched': 'replace',
+                    'whenNotMatched': 'insert'
+                }
+            }
+        ]
+
+    # Tiered reads
+
+    def choose_tier(self, hours: float) -> str:
+        """Coarsest tier that has enough buckets for the window and still retains it"""
+        chosen = 'raw'
+        for tier in self.tiers[1:]:
+            if tier['granularity_hours'] * self.min_buckets > hours:
+                break
+            if tier['retention_hours'] < hours or self.get_watermark(tier['name']) is None:
+                continue
+            chosen = tier['name']
+        return chosen
+
+    def _collect_counts(self, tier_name: str, start: datetime, per_area: Dict, end: Optional[datetime] = None):
+        """Add per-area counts from start (up to end), reading each tier only where it has whole buckets"""
+        tier_index = [tier['name'] for tier in self.tiers].index(tier_name)
+
+        if tier_name == 'raw':
+            field = self.raw_data_storage.field
+            timestamp_range = {'$gte': start} if end is None else {'$gte': start, '$lt': end}
+            pipeline = [
+                {'$match': {'timestamp': timestamp_range}},
+                {
+                    '$group': {
+                        '_id': f"${field('area_id')}",
+                        'total_count': {'$sum': 1},
+                        'illegal_count': {
+                            '$sum': {'$cond': [{'$eq': ['$classification', 'illegal']}, 1, 0]}
+                        },
+                        'probability_sum': {'$sum': '$illegal_probability'},
+                        'last_updated': {'$max': '$timestamp'},
+                        **{name: {'$first': f"${field(name)}"} for name in ROLLUP_LOCATION_FIELDS}
+                    }
+                }
+            ]
+            self._add_counts(self.db.raw_data.aggregate(pipeline, allowDiskUse=True), per_area)
+            return
+
+        tier = self.tiers[tier_index]
+        finer = self.tiers[tier_index - 1]['name']
+        watermark = self.get_watermark(tier_name)
+        tier_end = watermark if end is None else min(watermark, end)
+        granularity = timedelta(hours=tier['granularity_hours'])
+        # First bucket that starts inside the window; the partial bucket before it would overcount
+        bucket_start = datetime.min + ((start - datetime.min) // granularity) * granularity
+        if bucket_start < start:
+            bucket_start += granularity
+
+        if bucket_start >= tier_end:
+            # No whole bucket of this tier in the window
+            self._collect_counts(finer, start, per_area, end)
+            return
+
+        pipeline = [
+            {'$match': {'bucket_start': {'$gte': bucket_start, '$lt': tier_end}}},
+            {
+                '$group': {
+                    '_id': '$area_id',
+                    'total_count': {'$sum': '$total_count'},
+                    'illegal_count': {'$sum': '$illegal_count'},
+                    'probability_sum': {'$sum': '$probability_sum'},
+                    'last_updated': {'$max': '$last_updated'},
+                    **{name: {'$first': f"${name}"} for name in ROLLUP_LOCATION_FIELDS}
+                }
+            }
+        ]
+        self._add_counts(tier['collection'].aggregate(pipeline, allowDiskUse=True), per_area)
+
+        # The partial leading bucket and the part after this tier's watermark come from the next finer tier
+        if start < bucket_start:
+            self._collect_counts(finer, start, per_area, bucket_start)
+        if end is None or tier_end < end:
+            self._collect_counts(finer, tier_end, per_area, end)
+
+    def _add_counts(self, rows, per_area: Dict):
+        for row in rows:
+            area = per_area.get(row['_id'])
+            if area is None:
+                per_area[row['_id']] = dict(row)
+            else:
+                area['total_count'] += row['total_count']
+                area['illegal_count'] += row['illegal_count']
+                area['probability_sum'] += row['probability_sum']
+                area['last_updated'] = max(area['last_updated'], row['last_updated'])
+
+    def get_area_counts(self, hours: float) -> Dict[str, Dict]:
+        """Per-area counts for the last N hours from the chosen tier"""
+        start = datetime.now().replace(microsecond=0) - timedelta(hours=hours)
+        per_area = {}
+        self._collect_counts(self.choose_tier(hours), start, per_area)
+        return per_area
+
+    def get_location_summary(self, hours: int = 24) -> List[Dict]:
+        """Location summary in the same shape as MongoDBManager.get_location_summary"""
+        summary = []
+        for area_id, counts in self.get_area_counts(hours).items():
+            total_count = counts['total_count']
+            illegal_count = counts['illegal_count']
+            summary.append({
+                'area_id': area_id,
+                'area_name': counts.get('area_name'),
+                'district': counts.get('district'),
+                'city': counts.get('city'),
+                'latitude': counts.get('latitude'),
+                'longitude': counts.get('longitude'),
+                'total_count': total_count,
+                'illegal_count': illegal_count,
+                'legal_count': total_count - illegal_count,
+                'illegal_percentage': (illegal_count / total_count) * 100,
+                'avg_illegal_probability': round(counts['probability_sum'] / total_count, 4),
+                'location_status': 'illegal' if illegal_count / total_count > 0.5 else 'legal',
+                'last_updated': counts['last_updated'].isoformat()
+            })
+        summary.sort(key=lambda item: item['illegal_percentage'], reverse=True)
+        return summary
+
+    def get_classification_stats(self, hours: int = 24) -> Optional[Dict]:
+        """Overall statistics in the same shape as MongoDBManager.get_classification_stats"""
+        per_area = self.get_area_counts(hours)
+        if not per_area:
+            return None
+
+        total_records = sum(counts['total_count'] for counts in per_area.values())
+        illegal_records = sum(counts['illegal_count'] for counts in per_area.values())
+        probability_sum = sum(counts['probability_sum'] for counts in per_area.values())
+        return {
+            'total_records': total_records,
+            'illegal_records': illegal_records,
+            'legal_records': total_records - illegal_records,
+            'illegal_percentage': (illegal_records / total_records) * 100,
+            'avg_illegal_probability': round(probability_sum / total_records, 4),
+            'unique_locations_count': len(per_area)
+        }
+
+    def count_records(self, hours: float) -> int:
+        """Total records in the last N hours from the chosen tier"""
+        return sum(counts['total_count'] for counts in self.get_area_counts(hours).values())
+
+    def status(self) -> Dict:
+        return {
+            'tiers': [
+                {
+                    'name': tier['name'],
+                    'granularity_hours': tier['granularity_hours'],
+                    'retention_hours': None if tier['retention_hours'] == float('inf') else tier['retention_hours'],
+                    'rolled_until': self.get_watermark(tier['name']).isoformat()
+                    if tier['name'] != 'raw' and self.get_watermark(tier['name']) else None
+                }
+                for tier in self.tiers
+            ],
+            'min_buckets': self.min_buckets
+        }
@@ -0,0 +1,250 @@
+"""
+Multi-process sharded simulation ticks
+
+The simulation thread runs generation and inference under the GIL, on one
+core. With SIMULATION_WORKERS > 0, every tick splits the location registry
+snapshot into shards. A pool of worker processes generates and scores one
+shard each, and the simulator merges the shard columns back in registry
+order for its usual bulk insert.
+
+A worker that crashes or hangs breaks the pool. The pool is replaced and
+the unfinished shards are retried. A shard that keeps failing is computed
+in the simulator process, so a tick is never lost.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Dict, Tuple
+
+import numpy as np
+
+from location_registry import LocationShard, LocationSnapshot
+from model_loader import ModelLoader
+from simulator import TickGenerator
+
+logger = logging.getLogger(__name__)
+
+# Generator and model loaded once per worker process
+_worker_generator = None
+_worker_model = None
+
+def _get_worker_model(model_path: str, version: str) -> ModelLoader:
+    global _worker_model
+    if _worker_model is None or (_worker_model.model_path, _worker_model.version) != (model_path, version):
+        # One scoring thread per process; the pool provides the parallelism
+        _worker_model = ModelLoader(model_path, nthread=1)
+        _worker_model.version = version
+    return _worker_model
+
+def run_shard(generator: TickGenerator, model_loader: ModelLoader, shard: LocationShard,
+              current_time: datetime) -> Dict:
+    """Generate and score the readings of one shard"""
+    started = time.perf_counter()
+    columns = generator.generate_synthetic_columns(shard, current_time)
+    generated = time.perf_counter()
+    probabilities = model_loader.predict_probabilities(generator.build_tick_features(shard, columns, current_time))
+    scored = time.perf_counter()
+
+    return {
+        'index': shard.index,
+        'columns': columns,
+        'probabilities': probabilities,
+        'pid': os.getpid(),
+        'generate_ms': (generated - started) * 1000,
+        'score_ms': (scored - generated) * 1000
+    }
+
+def simulate_shard(shard: LocationShard, current_time: datetime, model_path: str, version: str) -> Dict:
+    """Worker entry point: run_shard with the process-wide generator and model"""
+    global _worker_generator
+    if _worker_generator is None:
+        # Spawned workers seed their own generator from OS entropy
+        _worker_generator = TickGenerator()
+    return run_shard(_worker_generator, _get_worker_model(model_path, version), shard, current_time)
+
+def warm_worker(model_path: str, version: str) -> int:
+    """Load the model in a fresh worker before its first shard"""
+    _get_worker_model(model_path, version)
+    return os.getpid()
+
+class ShardedSimulation:
+    """Runs the generation and scoring of a tick on a process pool, one task per shard"""
+
+    def __init__(self, model_loader: ModelLoader, workers: int = None, shards: int = None,
+                 shard_timeout: float = None, max_retries: int = None):
+        self.model_loader = model_loader
+        # 0 keeps generation in the simulation thread
+        self.workers = workers if workers is not None else int(os.getenv('SIMULATION_WORKERS', 0))
+        self.n_shards = shards or int(os.getenv('SIMULATION_SHARDS', 0)) or self.workers
+        self.shard_timeout = shard_timeout or float(os.getenv('SIMULATION_SHARD_TIMEOUT_SECONDS', 30))
+        self.max_retries = max_retries if max_retries is not None else \
+            int(os.getenv('SIMULATION_SHARD_RETRIES', 1))
+
+        self._lock = threading.Lock()
+        self._executor = None
+
+        self.ticks = 0
+        self.pool_restarts = 0
+        self.inline_shards = 0
+        self.last_tick = None
+        self.shard_stats = {}  # shard index -> timings of its last run
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned workers: forking a process with live MongoDB clients and model threads is unsafe
+            context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            
+            # Process start-up and model loading get their own shard timeout, not the first tick's.
+            # A warm-up that fails or times out leaves the pool to the caller to discard.
+            started = time.perf_counter()
+            warm_ups = [self._executor.submit(warm_worker, self.model_loader.model_path, self.model_loader.version)
+                        for _ in range(self.workers)]
+            pids = {future.result(timeout=self.shard_timeout) for future in warm_ups}
+            logger.info(f"Started {len(pids)} simulation workers in {time.perf_counter() - started:.1f}s")
+        return self._executor
+
+    def _reset_executor(self):
+        """Discard a broken or stuck pool; the next tick starts a fresh one"""
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        # A hung worker never returns, so it has to be terminated
+        processes = getattr(executor, '_processes', None) or {}
+        for process in list(processes.values()):
+            if process.is_alive():
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        self.pool_restarts += 1
+
+    def _record(self, result: Dict, shard: LocationShard, round_trip_ms: float, attempts: int, inline: bool):
+        self.shard_stats[shard.index] = {
+            'shard': shard.index,
+            'rows': len(shard),
+            'pid': result['pid'],
+            'generate_ms': round(result['generate_ms'], 2),
+            'score_ms': round(result['score_ms'], 2),
+            'round_trip_ms': round(round_trip_ms, 2),
+            'attempts': attempts,
+            'inline': inline
+        }
+
+    def run_tick(self, snapshot: LocationSnapshot, current_time: datetime,
+                 generator: TickGenerator) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """
+        Generate and score one tick for every location in the snapshot
+
+        Args:
+            snapshot: Location registry snapshot
+            current_time: Tick timestamp
+            generator: Generator used for shards that have to run in this process
+
+        Returns:
+            tuple: (columns, probabilities) in snapshot.locations order
+        """
+        with self._lock:
+            started = time.perf_counter()
+            shards = snapshot.partition(self.n_shards)
+            model_path, version = self.model_loader.model_path, self.model_loader.version
+            results = {}
+            pending = list(shards)
+            attempts = 0
+
+            while pending and attempts <= self.max_retries:
+                attempts += 1
+                submitted = time.perf_counter()
+                try:
+                    executor = self._get_executor()
+                    futures = {executor.submit(simulate_shard, shard, current_time, model_path, version): shard
+                               for shard in pending}
+                except BrokenProcessPool:
+                    # A worker died between ticks
+                    self._reset_executor()
+                    continue
+                except TimeoutError:
+                    logger.error(f"Simulation workers did not start within {self.shard_timeout}s, running shards inline")
+                    self._reset_executor()
+                    break
+                except Exception as e:
+                    logger.error(f"Simulation workers failed to start, running shards inline: {e}")
+                    self._reset_executor()
+                    break
+
+                failed = []
+                broken = False
+                try:
+                    for future in as_completed(futures, timeout=self.shard_timeout):
+                        shard = futures[future]
+                        try:
+                            result = future.result()
+                            results[shard.index] = result
+                            self._record(result, shard, (time.perf_counter() - submitted) * 1000, attempts, False)
+                        except BrokenProcessPool:
+                            broken = True
+                            failed.append(shard)
+                        except Exception as e:
+                            logger.error(f"Simulation shard {shard.index} failed: {e}")
+                            failed.append(shard)
+                except TimeoutError:
+                    broken = True
+                    failed.extend(shard for future, shard in futures.items() if not future.done())
+                    logger.error(f"Simulation shards timed out after {self.shard_timeout}s")
+
+                if broken:
+                    logger.warning(f"Simulation worker pool broken, restarting it for {len(failed)} shards")
+                    self._reset_executor()
+                pending = failed
+
+            # Shards that keep failing run here so the tick is still complete
+            for shard in pending:
+                inline_started = time.perf_counter()
+                result = run_shard(generator, self.model_loader, shard, current_time)
+                results[shard.index] = result
+                self._record(result, shard, (time.perf_counter() - inline_started) * 1000, attempts + 1, True)
+                self.inline_shards += 1
+
+            merge_started = time.perf_counter()
+            ordered = [results[shard.index] for shard in shards]
+            columns = {name: np.concatenate([result['columns'][name] for result in ordered])
+                       for name in ordered[0]['columns']}
+            probabilities = np.concatenate([result['probabilities'] for result in ordered])
+            finished = time.perf_counter()
+
+            self.ticks += 1
+            self.last_tick = {
+                'timestamp': current_time.isoformat(),
+                'rows': len(snapshot),
+                'shards': len(shards),
+                'attempts': attempts,
+                'merge_ms': round((finished - merge_started) * 1000, 2),
+                'total_ms': round((finished - started) * 1000, 2)
+            }
+            return columns, probabilities
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'workers': self.workers,
+            'shards': self.n_shards,
+            'ticks': self.ticks,
+            'pool_restarts': self.pool_restarts,
+            'inline_shards': self.inline_shards,
+            'last_tick': self.last_tick,
+            'shard_timings': [self.shard_stats[index] for index in sorted(self.shard_stats)]
+        }
@@ -4,27 +4,227 @@ import pandas as pd
 from datetime import datetime, timedelta
 import logging
 import os
+import time
 from typing import Dict, List
 from mongo_utils import MongoDBManager
+from location_registry import LocationRegistry, LocationSnapshot, AREA_TYPE_CODES
+from feature_config import DYNAMIC_FEATURES, assemble_feature_matrix, build_temporal_block
 
 logger = logging.getLogger(__name__)
 
-class PowerGridSimulator:
-    def __init__(self, model_loader, database):
+# Uniform ranges indexed by area type code: urban, semi-urban, rural
+CONSUMPTION_PER_HOUSEHOLD_RANGES = np.array([[150, 250], [100, 180], [60, 120]], dtype=np.float64)
+VOLTAGE_BASE_RANGES = np.array([[220, 240], [210, 235], [200, 230]], dtype=np.float64)
+
+# Fraud types and their multiplier ranges for consumption, voltage, current and power factor
+FRAUD_TYPES = ['bypass', 'meter_tamper', 'illegal_connection', 'fence_theft']
+FRAUD_MULTIPLIER_RANGES = np.array([
+    [[0.3, 0.6], [0.80, 0.92], [0.6, 0.85], [0.55, 0.75]],   # bypass
+    [[0.45, 0.75], [0.88, 0.96], [0.7, 0.9], [0.65, 0.85]],  # meter_tamper
+    [[1.4, 2.2], [0.85, 0.94], [1.3, 1.9], [0.60, 0.80]],    # illegal_connection
+    [[1.2, 1.7], [0.88, 0.95], [1.1, 1.5], [0.62, 0.82]]     # fence_theft
+], dtype=np.float64)
+FENCE_THEFT = FRAUD_TYPES.index('fence_theft')
+
+class TickGenerator:
+    """
+    Vectorized generation of one tick of readings and its model features
+    
+    Holds no database state, so shard worker processes can run it on
+    their own slice of the location registry.
+    """
+    
+    def __init__(self, rng: np.random.Generator = None):
+        self.rng = rng or np.random.default_rng()
+        
+        # ((year, month), temporal feature block) of the current tick
+        self._temporal_block = None
+    
+    def get_season_flags(self, month: int) -> Dict[str, int]:
+        """Get season flags based on month"""
+        # Indian seasons
+        if month in [3, 4, 5]:  # March, April, May
+            return {'is_summer': 1, 'is_monsoon': 0, 'is_winter': 0}
+        elif month in [6, 7, 8, 9]:  # June to September
+            return {'is_summer': 0, 'is_monsoon': 1, 'is_winter': 0}
+        else:  # October to February
+            return {'is_summer': 0, 'is_monsoon': 0, 'is_winter': 1}
+    
+    def get_seasonal_multiplier_range(self, season_flags: Dict[str, int]) -> tuple:
+        """Get the consumption multiplier range for the current season"""
+        if season_flags['is_summer']:
+            return 1.2, 1.5   # Higher AC usage
+        elif season_flags['is_winter']:
+            return 1.1, 1.3   # Moderate increase
+        elif season_flags['is_monsoon']:
+            return 0.9, 1.1   # Lower consumption
+        return 1.0, 1.0
+    
+    def generate_synthetic_columns(self, snapshot: LocationSnapshot, current_time: datetime = None) -> Dict[str, np.ndarray]:
+        """
+        Generate one tick of readings for all locations as numpy arrays
+        
+        Uses the same distributions as generate_synthetic_data, with masks in
+        place of the area type and fraud type branches.
+        
+        Args:
+            snapshot: Location registry snapshot to generate readings for
+            current_time: Tick timestamp (defaults to now)
+            
+        Returns:
+            Dict[str, np.ndarray]: Generated reading columns, one entry per location
+        """
+        rng = self.rng
+        n = len(snapshot)
+        current_time = current_time or datetime.now()
+        season_flags = self.get_season_flags(current_time.month)
+        
+        # Static location attributes
+        area_codes = snapshot.area_type_codes
+        households = snapshot.households.astype(np.float64)
+        distance_to_substation = snapshot.distance_to_substation_km
+        
+        # Area type dependent base consumption and voltage
+        consumption_range = CONSUMPTION_PER_HOUSEHOLD_RANGES[area_codes]
+        voltage_range = VOLTAGE_BASE_RANGES[area_codes]
+        base_consumption_per_household = rng.uniform(consumption_range[:, 0], consumption_range[:, 1])
+        voltage_base = rng.uniform(voltage_range[:, 0], voltage_range[:, 1])
+        
+        # Seasonal adjustments (monthly consumption patterns)
+        seasonal_low, seasonal_high = self.get_seasonal_multiplier_range(season_flags)
+        seasonal_multiplier = rng.uniform(seasonal_low, seasonal_high, n)
+        
+        expected_consumption_kwh = np.clip(base_consumption_per_household * households * seasonal_multiplier, 100, 100000)
+        
+        voltage_reading = np.clip(voltage_base + rng.uniform(-10, 10, n), 180, 250)
+        
+        # Monthly kWh to average power, then I = P / V
+        average_power_kw = expected_consumption_kwh / (30 * 24)
+        base_current = (average_power_kw * 1000) / voltage_reading
+        current_reading = np.clip(base_current * rng.uniform(0.8, 1.2, n), 1, 500)
+        
+        power_factor = rng.uniform(0.75, 0.95, n)
+        load_factor = rng.uniform(0.3, 0.8, n)
+        
+        # Local incident reports (10% chance of a coin flip)
+        local_incident_reports = ((rng.random(n) < 0.1) & (rng.integers(0, 2, n) == 1)).astype(np.int64)
+        
+        # Risk factor adjustments based on Kerala power theft patterns
+        area_illegal_probability = (0.25
+                                    + 0.20 * (area_codes == AREA_TYPE_CODES['rural'])
+                                    + 0.15 * (distance_to_substation > 10.0)
+                                    + 0.12 * (households > 100))
+        
+        actual_consumption_kwh = expected_consumption_kwh.copy()
+        fraud = rng.random(n) < area_illegal_probability
+        fraud_type = rng.integers(0, len(FRAUD_TYPES), n)
+        
+        # Fraud multipliers; rows without fraud keep a multiplier of 1
+        multiplier_range = FRAUD_MULTIPLIER_RANGES[fraud_type]
+        multipliers = np.where(fraud[:, None],
+                               rng.uniform(multiplier_range[:, :, 0], multiplier_range[:, :, 1]),
+                               1.0)
+        actual_consumption_kwh *= multipliers[:, 0]
+        voltage_reading *= multipliers[:, 1]
+        current_reading *= multipliers[:, 2]
+        power_factor *= multipliers[:, 3]
+        
+        # Increase incident reports for fraud cases
+        local_incident_reports = np.where(fraud & (rng.random(n) < 0.6), 1, local_incident_reports)
+        illegal_fence_suspected = fraud & ((fraud_type == FENCE_THEFT) | (rng.integers(0, 2, n) == 1))
+        
+        # Extreme anomaly cases (15% of fraud cases)
+        extreme = fraud & (rng.random(n) < 0.15)
+        voltage_reading = np.where(extreme, np.maximum(180, voltage_reading - rng.uniform(20, 35, n)), voltage_reading)
+        power_factor = np.where(extreme, np.minimum(power_factor, rng.uniform(0.45, 0.65, n)), power_factor)
+        current_reading = np.where(extreme, current_reading * rng.uniform(1.5, 2.5, n), current_reading)
+        
+        # Final range validation and clamping
+        actual_consumption_kwh = np.clip(actual_consumption_kwh, 100, 100000)
+        
+        return {
+            'local_incident_reports': local_incident_reports,
+            'expected_consumption_kwh': np.round(expected_consumption_kwh, 2),
+            'actual_consumption_kwh': np.round(actual_consumption_kwh, 2),
+            'voltage_reading_v': np.clip(np.round(voltage_reading, 1), 180, 250),
+            'current_reading_a': np.clip(np.round(current_reading, 2), 1, 500),
+            'consumption_deviation_pct': np.round((actual_consumption_kwh - expected_consumption_kwh) / expected_consumption_kwh * 100, 1),
+            'illegal_fence_suspected': illegal_fence_suspected,
+            'power_factor': np.clip(np.round(power_factor, 3), 0.5, 1.0),
+            'load_factor': np.clip(np.round(load_factor, 4), 0.1, 1.0),
+            'consumption_per_household': np.round(actual_consumption_kwh / households, 2)
+        }
+    
+    def get_temporal_block(self, current_time: datetime) -> np.ndarray:
+        """Year, month, season and timestamp dummy features, encoded once per tick month"""
+        key = (current_time.year, current_time.month)
+        if self._temporal_block is None or self._temporal_block[0] != key:
+            block = build_temporal_block(current_time, self.get_season_flags(current_time.month))
+            self._temporal_block = (key, block)
+        return self._temporal_block[1]
+    
+    def build_tick_features(self, snapshot: LocationSnapshot, columns: Dict[str, np.ndarray],
+                            current_time: datetime) -> np.ndarray:
+        """
+        Model input for a generated tick, assembled from feature blocks
+        
+        Static location features come from the registry snapshot and the
+        temporal block is shared by all rows, so only the readings are
+        encoded per record.
+        """
+        dynamic_block = np.empty((len(snapshot), len(DYNAMIC_FEATURES)), dtype=np.float32)
+        for column, feature in enumerate(DYNAMIC_FEATURES):
+            dynamic_block[:, column] = columns[feature]
+        return assemble_feature_matrix(snapshot.static_features, self.get_temporal_block(current_time), dynamic_block)
+
+class PowerGridSimulator(TickGenerator):
+    def __init__(self, model_loader, database, location_registry=None, stream_aggregator=None,
+                 mongo_manager=None, response_cache=None, live_feed=None, shard_engine=None, pipeline=None,
+                 write_buffer=None):
         self.model_loader = model_loader
         self.db = database
         self.raw_data_collection = database.raw_data
         self.locations_collection = database.locations
         
-        # Initialize MongoDB manager for clean model outputs
-        self.mongo_manager = MongoDBManager()
+        # MongoDB manager for clean model outputs (shares the process-wide client)
+        self.mongo_manager = mongo_manager or MongoDBManager(client=database.client)
+        self.raw_data_storage = self.mongo_manager.raw_data_storage
         
         # Initialize locations if not exists
         self.initialize_locations()
         
+        # Cached static location attributes, shared with the backend when provided
+        if location_registry is None:
+            location_registry = LocationRegistry(self.locations_collection)
+        else:
+            location_registry.invalidate()
+        self.location_registry = location_registry
+        
+        # Optional incremental aggregator fed with every inserted batch
+        self.stream_aggregator = stream_aggregator
+        
+        # Optional API response cache, invalidated after every committed tick
+        self.response_cache = response_cache
+        
+        # Optional push feed broadcasting each committed tick to subscribers
+        self.live_feed = live_feed
+        
+        # Optional process pool generating and scoring vectorized ticks shard by shard
+        self.shard_engine = shard_engine
+        
+        # Optional pipeline writing each tick in the background while the next one is computed
+        self.pipeline = pipeline
+        
+        # Optional write-behind buffer batching several ticks into one insert per collection
+        self.write_buffer = write_buffer
+        
         # Configuration - Much lower threshold to catch more illegal cases matching Kerala patterns
         self.classification_threshold = float(os.getenv('CLASSIFICATION_THRESHOLD', 0.08))
         
+        # Generate a whole tick with numpy arrays instead of one record at a time
+        self.vectorized_generation = os.getenv('VECTORIZED_GENERATION', 'true').lower() == 'true'
+        super().__init__()
+        
     def initialize_locations(self):
         """Initialize power grid locations in the database matching your Kerala dataset"""
         try:
@@ -165,16 +365,6 @@ class PowerGridSimulator:
         except Exception as e:
             logger.error(f"Error initializing locations: {e}")
     
-    def get_season_flags(self, month: int) -> Dict[str, int]:
-        """Get season flags based on month"""
-        # Indian seasons
-        if month in [3, 4, 5]:  # March, April, May
-            return {'is_summer': 1, 'is_monsoon': 0, 'is_winter': 0}
-        elif month in [6, 7, 8, 9]:  # June to September
-            return {'is_summer': 0, 'is_monsoon': 1, 'is_winter': 0}
-        else:  # October to February
-            return {'is_summer': 0, 'is_monsoon': 0, 'is_winter': 1}
-    
     def generate_synthetic_data(self, location: Dict) -> Dict:
         """Generate synthetic power grid data for a location matching realistic value ranges"""
         try:
@@ -331,83 +521,215 @@ class PowerGridSimulator:
             logger.error(f"Error generating synthetic data for location {location.get('area_id', 'unknown')}: {e}")
             return None
     
-    def classify_record(self, data_record: Dict) -> tuple:
-        """Classify a data record using the ML model"""
+    def generate_synthetic_batch(self, snapshot: LocationSnapshot, current_time: datetime = None,
+                                 columns: Dict[str, np.ndarray] = None) -> List[Dict]:
+        """Generate synthetic data records for all registry locations in one vectorized pass"""
         try:
-            # Prepare features for the model (only the exact 38 features used in training)
-            features = {
-                'latitude': data_record['latitude'],
-                'longitude': data_record['longitude'],
-                'households': data_record['households'],
-                'distance_to_substation_km': data_record['distance_to_substation_km'],
-                'local_incident_reports': data_record['local_incident_reports'],
-                'year': data_record['year'],
-                'month': data_record['month'],
-                'expected_consumption_kwh': data_record['expected_consumption_kwh'],
-                'voltage_reading_v': data_record['voltage_reading_v'],
-                'current_reading_a': data_record['current_reading_a'],
-                'power_factor': data_record['power_factor'],
-                'load_factor': data_record['load_factor'],
-                'is_summer': data_record['is_summer'],
-                'is_monsoon': data_record['is_monsoon'],
-                'is_winter': data_record['is_winter'],
-                'timestamp': data_record['timestamp']  # Will be converted to dummies in model_loader
-            }
+            current_time = current_time or datetime.now()
+            season_flags = self.get_season_flags(current_time.month)
+            if columns is None:
+                columns = self.generate_synthetic_columns(snapshot, current_time)
+            
+            # Convert columns to Python values once, then zip them into records
+            rows = zip(*(columns[name].tolist() for name in (
+                'local_incident_reports', 'expected_consumption_kwh', 'actual_consumption_kwh',
+                'voltage_reading_v', 'current_reading_a', 'consumption_deviation_pct',
+                'illegal_fence_suspected', 'power_factor', 'load_factor', 'consumption_per_household'
+            )))
+            
+            records = []
+            for location, (local_incident_reports, expected_consumption_kwh, actual_consumption_kwh,
+                           voltage_reading, current_reading, consumption_deviation_pct,
+                           illegal_fence_suspected, power_factor, load_factor,
+                           consumption_per_household) in zip(snapshot.locations, rows):
+                data_record = {
+                    'area_id': location['area_id'],
+                    'district': location['district'],
+                    'city': location['city'],
+                    'area_name': location['area_name'],
+                    'latitude': location['latitude'],
+                    'longitude': location['longitude'],
+                    'area_type': location['area_type'],
+                    'households': location['households'],
+                    'distance_to_substation_km': location['distance_to_substation_km'],
+                    'local_incident_reports': local_incident_reports,
+                    'year': current_time.year,
+                    'month': current_time.month,
+                    'timestamp': current_time,
+                    'expected_consumption_kwh': expected_consumption_kwh,
+                    'actual_consumption_kwh': actual_consumption_kwh,
+                    'voltage_reading_v': voltage_reading,
+                    'current_reading_a': current_reading,
+                    'consumption_deviation_pct': consumption_deviation_pct,
+                    'illegal_fence_suspected': illegal_fence_suspected,
+                    'power_factor': power_factor,
+                    'load_factor': load_factor,
+                    'consumption_per_household': consumption_per_household,
+                    **season_flags
+                }
+                records.append(data_record)
+            
+            return records
             
-            # Get classification and probability
-            classification, probability = self.model_loader.classify(
-                features, 
+        except Exception as e:
+            logger.error(f"Error generating vectorized synthetic data: {e}")
+            return []
+    
+    def extract_model_features(self, data_record: Dict) -> Dict:
+        """Extract the model input fields from a generated data record"""
+        # Only the exact 38 features used in training
+        return {
+            'latitude': data_record['latitude'],
+            'longitude': data_record['longitude'],
+            'households': data_record['households'],
+            'distance_to_substation_km': data_record['distance_to_substation_km'],
+            'local_incident_reports': data_record['local_incident_reports'],
+            'year': data_record['year'],
+            'month': data_record['month'],
+            'expected_consumption_kwh': data_record['expected_consumption_kwh'],
+            'voltage_reading_v': data_record['voltage_reading_v'],
+            'current_reading_a': data_record['current_reading_a'],
+            'power_factor': data_record['power_factor'],
+            'load_factor': data_record['load_factor'],
+            'is_summer': data_record['is_summer'],
+            'is_monsoon': data_record['is_monsoon'],
+            'is_winter': data_record['is_winter'],
+            'timestamp': data_record['timestamp']  # Will be converted to dummies in model_loader
+        }
+    
+    def classify_record(self, data_record: Dict) -> tuple:
+        """Classify a single data record using the ML model"""
+        classifications, probabilities = self.classify_records([data_record])
+        return classifications[0], float(probabilities[0])
+    
+    def classify_records(self, data_records: List[Dict], feature_matrix: np.ndarray = None) -> tuple:
+        """Classify a batch of data records with a single model call"""
+        try:
+            if feature_matrix is not None:
+                # Already encoded in model order (vectorized ticks)
+                features_batch = feature_matrix
+            else:
+                features_batch = [self.extract_model_features(record) for record in data_records]
+            
+            # Get classifications and probabilities for the whole batch
+            return self.model_loader.classify_batch(
+                features_batch,
                 threshold=self.classification_threshold
             )
             
-            return classification, probability
-            
         except Exception as e:
-            logger.error(f"Error classifying record: {e}")
-            return 'legal', 0.0
+            logger.error(f"Error classifying records: {e}")
+            return ['legal'] * len(data_records), np.zeros(len(data_records))
     
     def generate_and_classify_data(self):
         """Generate synthetic data for all locations and classify them"""
         try:
-            # Get all locations
-            locations = list(self.locations_collection.find())
+            tick_started = time.perf_counter()
+            timings = {}
+            
+            # Get all locations from the registry
+            snapshot = self.location_registry.get_snapshot()
             
-            if not locations:
+            if not snapshot.locations:
                 logger.warning("No locations found in database")
                 return
             
-            records_to_insert = []
-            
-            for location in locations:
-                # Generate synthetic data
-                data_record = self.generate_synthetic_data(location)
-                
-                if data_record:
-                    # Classify the record
-                    classification, probability = self.classify_record(data_record)
-                    
-                    # Add classification results to the record
-                    data_record['classification'] = classification
-                    data_record['illegal_probability'] = round(probability, 4)
-                    
-                    records_to_insert.append(data_record)
+            # Generate synthetic data for every location
+            feature_matrix = None
+            probabilities = None
+            if self.vectorized_generation and self.shard_engine is not None:
+                # Worker processes generate and score the shards; records are built from the merged columns
+                current_time = datetime.now()
+                columns, probabilities = self.shard_engine.run_tick(snapshot, current_time, self)
+                records_to_insert = self.generate_synthetic_batch(snapshot, current_time, columns)
+            elif self.vectorized_generation:
+                current_time = datetime.now()
+                columns = self.generate_synthetic_columns(snapshot, current_time)
+                records_to_insert = self.generate_synthetic_batch(snapshot, current_time, columns)
+                if records_to_insert:
+                    feature_matrix = self.build_tick_features(snapshot, columns, current_time)
+            else:
+                records_to_insert = []
+                for location in snapshot.locations:
+                    data_record = self.generate_synthetic_data(location)
+                    if data_record:
+                        records_to_insert.append(data_record)
+            timings['generate'] = (time.perf_counter() - tick_started) * 1000
             
             # Insert all records at once into raw data collection
             if records_to_insert:
-                self.raw_data_collection.insert_many(records_to_insert)
-                
-                # Insert clean model outputs using MongoDB manager
-                self.mongo_manager.insert_model_outputs_batch(records_to_insert)
+                score_started = time.perf_counter()
+                if probabilities is not None:
+                    classifications = np.where(probabilities >= self.classification_threshold,
+                                               'illegal', 'legal').tolist()
+                else:
+                    # Classify the whole tick in one model call
+                    classifications, probabilities = self.classify_records(records_to_insert, feature_matrix)
                 
-                legal_count = sum(1 for r in records_to_insert if r['classification'] == 'legal')
-                illegal_count = len(records_to_insert) - legal_count
+                # Add classification results to the records
+                for data_record, classification, probability in zip(records_to_insert, classifications, probabilities):
+                    data_record['classification'] = classification
+                    data_record['illegal_probability'] = round(float(probability), 4)
+                timings['score'] = (time.perf_counter() - score_started) * 1000
                 
-                logger.info(f"Generated and classified {len(records_to_insert)} records "
-                           f"({legal_count} legal, {illegal_count} illegal)")
+                if self.pipeline is not None:
+                    for stage, ms in timings.items():
+                        self.pipeline.observe(stage, ms)
+                    # Written by the pipeline's writer thread while the next tick is computed
+                    self.pipeline.submit(self.commit_tick, records_to_insert, tick_started)
+                else:
+                    self.commit_tick(records_to_insert)
             
         except Exception as e:
             logger.error(f"Error in generate_and_classify_data: {e}")
     
+    def commit_tick(self, records_to_insert: List[Dict], timings: Dict = None):
+        """
+        Store a classified tick and publish it
+        
+        Args:
+            records_to_insert: Classified records of one tick
+            timings: Optional dict filled with the milliseconds spent in each write stage
+        """
+        timings = timings if timings is not None else {}
+        started = time.perf_counter()
+        if self.write_buffer is not None:
+            # Stored by the buffer's writer thread; it bumps the response cache after each flush
+            self.write_buffer.add('raw_data', self.raw_data_storage.to_documents(records_to_insert))
+        else:
+            self.raw_data_storage.insert_many(records_to_insert)
+        written = time.perf_counter()
+        timings['write_raw_data'] = (written - started) * 1000
+        
+        # Insert clean model outputs when they are kept in their own collection
+        if self.mongo_manager.stores_model_outputs():
+            if self.write_buffer is not None:
+                self.write_buffer.add('model_outputs',
+                                      self.mongo_manager.build_model_output_documents(records_to_insert))
+            else:
+                self.mongo_manager.insert_model_outputs_batch(records_to_insert)
+        outputs_written = time.perf_counter()
+        timings['write_model_outputs'] = (outputs_written - written) * 1000
+        
+        # Update running per-area counters
+        if self.stream_aggregator is not None:
+            self.stream_aggregator.update(records_to_insert)
+        
+        # Cached responses are stale once the tick is committed
+        if self.response_cache is not None and self.write_buffer is None:
+            self.response_cache.bump_version()
+        
+        # Push the committed tick to live subscribers
+        if self.live_feed is not None:
+            self.live_feed.publish(records_to_insert)
+        timings['publish'] = (time.perf_counter() - outputs_written) * 1000
+        
+        legal_count = sum(1 for r in records_to_insert if r['classification'] == 'legal')
+        illegal_count = len(records_to_insert) - legal_count
+        
+        logger.info(f"Generated and classified {len(records_to_insert)} records "
+                   f"({legal_count} legal, {illegal_count} illegal)")
+    
     def get_location_stats(self, area_id: str, hours: int = 24) -> Dict:
         """Get statistics for a specific location over the last N hours"""
         try:
@@ -416,7 +738,7 @@ class PowerGridSimulator:
             pipeline = [
                 {
                     '$match': {
-                        'area_id': area_id,
+                        self.raw_data_storage.field('area_id'): area_id,
                         'timestamp': {'$gte': cutoff_time}
                     }
                 },
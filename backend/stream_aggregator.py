@@ -0,0 +1,344 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class CounterBlock:
+    """Per-area running counters: total records, illegal records and probability sum"""
+
+    def __init__(self, capacity: int = 0):
+        self.total = np.zeros(capacity, dtype=np.int64)
+        self.illegal = np.zeros(capacity, dtype=np.int64)
+        self.probability_sum = np.zeros(capacity, dtype=np.float64)
+
+    def grow(self, capacity: int):
+        """Extend the counters with zeros for newly seen areas"""
+        extra = capacity - len(self.total)
+        if extra > 0:
+            self.total = np.concatenate([self.total, np.zeros(extra, dtype=np.int64)])
+            self.illegal = np.concatenate([self.illegal, np.zeros(extra, dtype=np.int64)])
+            self.probability_sum = np.concatenate([self.probability_sum, np.zeros(extra, dtype=np.float64)])
+
+    def add(self, indices: np.ndarray, illegal: np.ndarray, probabilities: np.ndarray):
+        np.add.at(self.total, indices, 1)
+        np.add.at(self.illegal, indices, illegal)
+        np.add.at(self.probability_sum, indices, probabilities)
+
+    def add_block(self, other: 'CounterBlock', sign: int = 1):
+        n = len(other.total)
+        self.total[:n] += sign * other.total
+        self.illegal[:n] += sign * other.illegal
+        self.probability_sum[:n] += sign * other.probability_sum
+
+class StreamingAggregator:
+    """
+    Incremental per-area aggregation of classified records
+
+    The simulator feeds every inserted batch to update(). Records are counted
+    into fixed-size time buckets. Running totals are also kept for the current
+    tumbling window and for the whole retention period. When a tumbling window
+    closes, its per-area results are written to aggregated_data. The API can
+    read the live partial window without scanning MongoDB.
+
+    Reads over the last N hours are bucket-aligned: they start at the
+    beginning of the bucket that holds the requested start time, so they can
+    include up to STREAM_BUCKET_MINUTES of older records. covers() only
+    accepts a start whose whole bucket is held in memory.
+    """
+
+    def __init__(self, location_registry, aggregated_data_collection,
+                 window_minutes: int = 1440, bucket_minutes: float = None,
+                 retention_hours: float = None):
+        self.location_registry = location_registry
+        self.aggregated_data_collection = aggregated_data_collection
+
+        bucket_minutes = bucket_minutes or float(os.getenv('STREAM_BUCKET_MINUTES', 5))
+        retention_hours = retention_hours or float(os.getenv('STREAM_RETENTION_HOURS', 24))
+        self.bucket_seconds = max(1, int(bucket_minutes * 60))
+        self.retention_seconds = int(retention_hours * 3600)
+        self.window_seconds = int(window_minutes * 60)
+
+        self._lock = threading.Lock()
+        self._area_index = {}
+        self._area_ids = []
+        self._buckets = {}  # bucket number -> CounterBlock
+        self._window_totals = CounterBlock()
+        self._retained_totals = CounterBlock()
+        self._last_updated = np.zeros(0, dtype=np.float64)
+
+        self._window_start = None   # Epoch seconds of the open tumbling window
+        self.started_at = None      # Epoch seconds of the first record seen
+        self.last_update_at = None  # Monotonic time of the last update
+
+    def set_window_minutes(self, minutes: int):
+        """Change the tumbling window length; the open window is written up to now first"""
+        with self._lock:
+            closed = self._close_open_window(time.time())
+            self.window_seconds = int(minutes * 60)
+        if closed:
+            self.flush_window(*closed)
+
+    def is_active(self, max_idle_seconds: float = None) -> bool:
+        """Whether the simulator has fed this aggregator recently"""
+        if self.last_update_at is None:
+            return False
+        if max_idle_seconds is None:
+            max_idle_seconds = self.window_seconds
+        return time.monotonic() - self.last_update_at < max_idle_seconds
+
+    def covers(self, since: datetime) -> bool:
+        """Whether in-memory counters hold every record since the start of the bucket holding since"""
+        if self.started_at is None:
+            return False
+        since_epoch = (since.timestamp() // self.bucket_seconds) * self.bucket_seconds
+        return self.started_at <= since_epoch and \
+            since_epoch >= time.time() - self.retention_seconds
+
+    def invalidate(self, since: datetime):
+        """
+        Stop serving windows that include records reclassified since the given time
+
+        The counters are not rebuilt from MongoDB. covers() turns false for any
+        window starting before this call, so those reads fall back to MongoDB.
+        """
+        with self._lock:
+            if self.started_at is None or since.timestamp() > time.time():
+                return
+            self.started_at = max(self.started_at, time.time())
+        logger.info(f"Streaming aggregator invalidated for records since {since}")
+
+    def _get_indices(self, area_ids: List[str]) -> np.ndarray:
+        """Map area ids to counter positions, growing the counters for new areas"""
+        indices = np.empty(len(area_ids), dtype=np.int64)
+        for i, area_id in enumerate(area_ids):
+            index = self._area_index.get(area_id)
+            if index is None:
+                index = self._area_index[area_id] = len(self._area_ids)
+                self._area_ids.append(area_id)
+            indices[i] = index
+
+        capacity = len(self._area_ids)
+        if capacity > len(self._last_updated):
+            self._window_totals.grow(capacity)
+            self._retained_totals.grow(capacity)
+            for bucket in self._buckets.values():
+                bucket.grow(capacity)
+            self._last_updated = np.concatenate(
+                [self._last_updated, np.zeros(capacity - len(self._last_updated))]
+            )
+        return indices
+
+    def update(self, records: List[Dict]):
+        """Count a batch of classified records"""
+        if not records:
+            return
+
+        try:
+            # A tick shares one timestamp object, so convert each distinct one once
+            epochs = {}
+            record_epochs = np.array(
+                [epochs.setdefault(id(r['timestamp']), r['timestamp'].timestamp()) for r in records],
+                dtype=np.float64
+            )
+            illegal = np.array([r['classification'] == 'illegal' for r in records], dtype=np.int64)
+            probabilities = np.array([r['illegal_probability'] for r in records], dtype=np.float64)
+
+            with self._lock:
+                closed_window = self._roll_window(record_epochs.max())
+
+                indices = self._get_indices([r['area_id'] for r in records])
+                bucket_numbers = (record_epochs // self.bucket_seconds).astype(np.int64)
+
+                for bucket_number in np.unique(bucket_numbers):
+                    mask = bucket_numbers == bucket_number
+                    bucket = self._buckets.get(bucket_number)
+                    if bucket is None:
+                        bucket = self._buckets[bucket_number] = CounterBlock(len(self._area_ids))
+                    bucket.add(indices[mask], illegal[mask], probabilities[mask])
+
+                self._window_totals.add(indices, illegal, probabilities)
+                self._retained_totals.add(indices, illegal, probabilities)
+                np.maximum.at(self._last_updated, indices, record_epochs)
+
+                if self.started_at is None:
+                    self.started_at = float(record_epochs.min())
+                self.last_update_at = time.monotonic()
+
+                self._prune_buckets(record_epochs.max())
+
+            if closed_window:
+                self.flush_window(*closed_window)
+
+        except Exception as e:
+            logger.error(f"Error updating streaming aggregator: {e}")
+
+    def _roll_window(self, now_epoch: float) -> Optional[tuple]:
+        """Start a new tumbling window if now is past the open one; return the closed window"""
+        window_start = (now_epoch // self.window_seconds) * self.window_seconds
+        if self._window_start is None:
+            self._window_start = window_start
+            return None
+        if window_start <= self._window_start:
+            return None
+
+        # A window resumed by flush_open_window still ends on the grid
+        window_end = (self._window_start // self.window_seconds + 1) * self.window_seconds
+        closed = (self._window_start, window_end, self._area_ids[:], self._window_totals)
+        self._window_start = window_start
+        self._window_totals = CounterBlock(len(self._area_ids))
+        return closed
+
+    def _prune_buckets(self, now_epoch: float):
+        """Drop buckets older than the retention period"""
+        oldest = (now_epoch - max(self.retention_seconds, self.window_seconds)) // self.bucket_seconds
+        for bucket_number in [b for b in self._buckets if b < oldest]:
+            self._retained_totals.add_block(self._buckets.pop(bucket_number), sign=-1)
+
+    def _sum_since(self, since_epoch: float) -> CounterBlock:
+        """Sum the buckets starting at or after since_epoch (rounded down to a bucket)"""
+        first_bucket = since_epoch // self.bucket_seconds
+        if self._buckets and first_bucket <= min(self._buckets):
+            return self._retained_totals
+
+        totals = CounterBlock(len(self._area_ids))
+        for bucket_number, bucket in self._buckets.items():
+            if bucket_number >= first_bucket:
+                totals.add_block(bucket)
+        return totals
+
+    def build_window_results(self, window_start: datetime, window_end: datetime,
+                             area_ids: List[str], totals: CounterBlock) -> List[Dict]:
+        """Turn per-area counters into aggregated_data documents"""
+        snapshot = self.location_registry.get_snapshot()
+        window_minutes = int((window_end - window_start).total_seconds() // 60)
+        created_at = datetime.now()
+        results = []
+
+        for index in np.flatnonzero(totals.total):
+            area_id = area_ids[index]
+            location = snapshot.get_location(area_id)
+            if location is None:
+                continue
+
+            total_count = int(totals.total[index])
+            illegal_count = int(totals.illegal[index])
+            illegal_percentage = (illegal_count / total_count) * 100
+
+            results.append({
+                'area_id': area_id,
+                'district': location['district'],
+                'city': location['city'],
+                'area_name': location['area_name'],
+                'window_start': window_start,
+                'window_end': window_end,
+                'window_duration_minutes': window_minutes,
+                'total_records': total_count,
+                'illegal_records': illegal_count,
+                'illegal_percentage': round(illegal_percentage, 2),
+                'location_status': 'illegal' if illegal_percentage > 50 else 'legal',
+                'created_at': created_at
+            })
+
+        return results
+
+    def flush_window(self, start_epoch: float, end_epoch: float, area_ids: List[str], totals: CounterBlock):
+        """Write a closed tumbling window to aggregated_data"""
+        try:
+            results = self.build_window_results(
+                datetime.fromtimestamp(start_epoch), datetime.fromtimestamp(end_epoch), area_ids, totals
+            )
+            if results:
+                self.aggregated_data_collection.insert_many(results, ordered=False)
+                logger.info(f"Flushed streaming aggregation window for {len(results)} locations")
+        except Exception as e:
+            logger.error(f"Error flushing streaming aggregation window: {e}")
+
+    def flush_open_window(self):
+        """
+        Write the open tumbling window up to now, e.g. when the simulation stops
+
+        The rest of the window starts empty at this moment, so records from a
+        restart within the same window are not written twice.
+        """
+        with self._lock:
+            closed = self._close_open_window(time.time())
+        if closed:
+            self.flush_window(*closed)
+
+    def _close_open_window(self, now_epoch: float) -> Optional[tuple]:
+        """End the open window at now and continue it empty from there (called with the lock held)"""
+        if self._window_start is None or now_epoch <= self._window_start:
+            return None
+        closed = (self._window_start, now_epoch, self._area_ids[:], self._window_totals)
+        self._window_start = now_epoch
+        self._window_totals = CounterBlock(len(self._area_ids))
+        return closed
+
+    def get_live_window(self) -> List[Dict]:
+        """Per-area results for the open (partial) tumbling window"""
+        with self._lock:
+            if self._window_start is None:
+                return []
+            area_ids = self._area_ids[:]
+            totals = CounterBlock(len(area_ids))
+            totals.add_block(self._window_totals)
+            window_start = datetime.fromtimestamp(self._window_start)
+
+        results = self.build_window_results(window_start, datetime.now(), area_ids, totals)
+        for result in results:
+            result['partial'] = True
+        return results
+
+    def count_since(self, since: datetime) -> int:
+        """Total records counted since the start of the bucket holding the given time"""
+        with self._lock:
+            return int(self._sum_since(since.timestamp()).total.sum())
+
+    def get_location_summary(self, hours: int = 24) -> List[Dict]:
+        """
+        Per-location summary for the last N hours (bucket-aligned), in the
+        same shape as MongoDBManager.get_location_summary
+        """
+        since = datetime.now().timestamp() - hours * 3600
+        with self._lock:
+            area_ids = self._area_ids[:]
+            totals = self._sum_since(since)
+            total = totals.total.copy()
+            illegal = totals.illegal.copy()
+            probability_sum = totals.probability_sum.copy()
+            last_updated = self._last_updated.copy()
+
+        snapshot = self.location_registry.get_snapshot()
+        summary = []
+
+        for index in np.flatnonzero(total):
+            location = snapshot.get_location(area_ids[index])
+            if location is None:
+                continue
+
+            total_count = int(total[index])
+            illegal_count = int(illegal[index])
+            summary.append({
+                'area_id': location['area_id'],
+                'area_name': location['area_name'],
+                'district': location['district'],
+                'city': location['city'],
+                'latitude': location['latitude'],
+                'longitude': location['longitude'],
+                'total_count': total_count,
+                'illegal_count': illegal_count,
+                'legal_count': total_count - illegal_count,
+                'illegal_percentage': (illegal_count / total_count) * 100,
+                'avg_illegal_probability': round(float(probability_sum[index]) / total_count, 4),
+                'location_status': 'illegal' if illegal_count / total_count > 0.5 else 'legal',
+                'last_updated': datetime.fromtimestamp(last_updated[index]).isoformat()
+            })
+
+        summary.sort(key=lambda item: item['illegal_percentage'], reverse=True)
+        return summary
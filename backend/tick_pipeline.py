@@ -0,0 +1,164 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Stages of a tick, in the order they run
+PIPELINE_STAGES = ['generate', 'score', 'enqueue_wait', 'write_raw_data', 'write_model_outputs',
+                   'publish', 'end_to_end']
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram in milliseconds"""
+
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        index = next((i for i, bound in enumerate(self.BOUNDS_MS) if ms <= bound), len(self.BOUNDS_MS))
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given fraction of observations"""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.BOUNDS_MS, self.counts):
+            seen += count
+            if seen >= target:
+                return float(min(bound, self.max_ms))
+        return self.max_ms
+
+    def snapshot(self) -> Dict:
+        buckets = {f"le_{bound}ms": count for bound, count in zip(self.BOUNDS_MS, self.counts)}
+        buckets[f"gt_{self.BOUNDS_MS[-1]}ms"] = self.counts[-1]
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'p50_ms': round(self.percentile(0.50), 3),
+            'p95_ms': round(self.percentile(0.95), 3),
+            'p99_ms': round(self.percentile(0.99), 3),
+            'max_ms': round(self.max_ms, 3),
+            'buckets': buckets
+        }
+
+class TickPipeline:
+    """
+    Overlaps computing a tick with writing the previous one
+
+    The simulation thread generates and scores tick N+1 while a writer
+    thread inserts tick N into MongoDB and publishes it. Classified ticks
+    wait in a bounded queue. When the writer falls behind by queue_depth
+    ticks, submit() blocks, which slows the simulation down to the write
+    rate instead of growing memory. Every stage is timed into a latency
+    histogram.
+    """
+
+    def __init__(self, queue_depth: int = None, enabled: bool = None):
+        self.enabled = enabled if enabled is not None else \
+            os.getenv('TICK_PIPELINE_ENABLED', 'true').lower() == 'true'
+        self.queue_depth = queue_depth or int(os.getenv('TICK_PIPELINE_QUEUE_DEPTH', 2))
+
+        self._queue = queue.Queue(maxsize=self.queue_depth)
+        self._lock = threading.Lock()
+        self._writer_thread = None
+        self.histograms = {stage: LatencyHistogram() for stage in PIPELINE_STAGES}
+
+        self.ticks_submitted = 0
+        self.ticks_written = 0
+        self.ticks_failed = 0
+        self.backpressure_waits = 0
+        self.max_queue_size = 0
+
+    def observe(self, stage: str, ms: float):
+        with self._lock:
+            self.histograms[stage].observe(ms)
+
+    def submit(self, write: Callable[[List[Dict], Dict], None], records: List[Dict], tick_started: float):
+        """
+        Hand a classified tick to the write stage
+
+        Args:
+            write: Called with (records, timings) to store and publish the tick;
+                it fills timings with the duration of each write stage in ms
+            records: Classified records of the tick
+            tick_started: time.perf_counter() at the start of the tick
+        """
+        self.ticks_submitted += 1
+        if not self.enabled:
+            self._write(write, records, tick_started)
+            return
+
+        self._ensure_writer()
+        waited = time.perf_counter()
+        try:
+            self._queue.put_nowait((write, records, tick_started))
+        except queue.Full:
+            # Backpressure: wait for the writer instead of buffering more ticks
+            self.backpressure_waits += 1
+            self._queue.put((write, records, tick_started))
+        self.observe('enqueue_wait', (time.perf_counter() - waited) * 1000)
+        self.max_queue_size = max(self.max_queue_size, self._queue.qsize())
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._writer_thread is None or not self._writer_thread.is_alive():
+                self._writer_thread = threading.Thread(target=self._run_writer, daemon=True)
+                self._writer_thread.start()
+
+    def _run_writer(self):
+        while True:
+            write, records, tick_started = self._queue.get()
+            try:
+                self._write(write, records, tick_started)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, write: Callable, records: List[Dict], tick_started: float):
+        timings = {}
+        try:
+            write(records, timings)
+            self.ticks_written += 1
+        except Exception as e:
+            self.ticks_failed += 1
+            logger.error(f"Error writing tick of {len(records)} records: {e}")
+        finally:
+            with self._lock:
+                for stage, ms in timings.items():
+                    self.histograms[stage].observe(ms)
+                self.histograms['end_to_end'].observe((time.perf_counter() - tick_started) * 1000)
+
+    def drain(self, timeout: float = None) -> bool:
+        """Wait until every submitted tick is written; False if the timeout expired"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'queue_depth': self.queue_depth,
+                'queue_size': self._queue.qsize(),
+                'max_queue_size': self.max_queue_size,
+                'ticks_submitted': self.ticks_submitted,
+                'ticks_written': self.ticks_written,
+                'ticks_failed': self.ticks_failed,
+                'backpressure_waits': self.backpressure_waits,
+                'stages': {stage: histogram.snapshot() for stage, histogram in self.histograms.items()}
+            }
@@ -0,0 +1,195 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict
+
+from tick_pipeline import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# What to do with deadlines that passed while a tick was still running
+OVERRUN_POLICIES = ('skip', 'catch_up', 'coalesce')
+
+class TickScheduler:
+    """
+    Fixed-rate tick loop on monotonic deadlines
+
+    Tick k is due at start + k * interval whatever the previous ticks cost,
+    so the period does not drift as the work grows. When a tick overruns
+    one or more later deadlines, the overrun policy decides what happens:
+
+    - skip: drop the missed deadlines and wait for the next one on the grid
+    - catch_up: run the missed ticks back to back, at most max_catch_up per
+      overrun; a catch-up tick that overruns again draws on the same budget
+    - coalesce: run one tick right away for all missed deadlines
+
+    Lag (how late each tick started), tick duration, missed and coalesced
+    ticks and utilization (busy time / wall time) are tracked.
+    """
+
+    def __init__(self, tick: Callable[[], None], interval_seconds: float = None,
+                 overrun_policy: str = None, max_catch_up: int = None):
+        self.tick = tick
+        self.interval_seconds = interval_seconds or float(os.getenv('DATA_GENERATION_INTERVAL', 5))
+        self.overrun_policy = (overrun_policy or os.getenv('TICK_OVERRUN_POLICY', 'skip')).lower()
+        if self.overrun_policy not in OVERRUN_POLICIES:
+            logger.warning(f"Unknown TICK_OVERRUN_POLICY '{self.overrun_policy}', using 'skip'")
+            self.overrun_policy = 'skip'
+        self.max_catch_up = max_catch_up or int(os.getenv('TICK_MAX_CATCH_UP', 3))
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._next_deadline = None
+        self._catch_up_left = None  # catch-up ticks still allowed while working off an overrun
+        self._recent = deque(maxlen=100)  # (started, duration) of recent ticks
+        self._reset_metrics()
+
+    def _reset_metrics(self):
+        self.ticks = 0
+        self.overruns = 0
+        self.missed_ticks = 0
+        self.coalesced_ticks = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.last_lag_ms = None
+        self.last_duration_ms = None
+        self.lag = LatencyHistogram()
+        self.duration = LatencyHistogram()
+        self._recent.clear()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            if not self._stop.is_set():
+                return
+            # A tick outlived stop(timeout) and its thread exits after it; wait for it
+            self._thread.join()
+        self._stop.clear()
+        with self._lock:
+            self._reset_metrics()
+            self.started_at = time.monotonic()
+            self._next_deadline = self.started_at
+            self._catch_up_left = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info(f"Tick scheduler started: every {self.interval_seconds}s, overrun policy {self.overrun_policy}")
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def set_interval(self, seconds: float):
+        """Change the tick period; the next deadline moves to the new grid"""
+        if seconds <= 0:
+            raise ValueError("Interval must be positive")
+        with self._lock:
+            if self._next_deadline is not None:
+                # Keep the last tick's start as the anchor of the new grid
+                self._next_deadline += seconds - self.interval_seconds
+            self.interval_seconds = seconds
+        self._wake.set()
+
+    def set_overrun_policy(self, policy: str):
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError(f"Overrun policy must be one of {', '.join(OVERRUN_POLICIES)}")
+        with self._lock:
+            self.overrun_policy = policy
+            self._catch_up_left = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                wait = self._next_deadline - time.monotonic()
+            if wait > 0:
+                # Woken early by set_interval or stop: recompute the wait
+                self._wake.wait(wait)
+                self._wake.clear()
+                continue
+
+            started = time.monotonic()
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Error in simulation tick: {e}")
+            finished = time.monotonic()
+
+            with self._lock:
+                self._account(started, finished)
+
+    def _account(self, started: float, finished: float):
+        """Record one tick and advance the deadline according to the overrun policy"""
+        interval = self.interval_seconds
+        lag_ms = (started - self._next_deadline) * 1000
+        duration_ms = (finished - started) * 1000
+        self.ticks += 1
+        self.busy_seconds += finished - started
+        self.last_lag_ms = lag_ms
+        self.last_duration_ms = duration_ms
+        self.lag.observe(lag_ms)
+        self.duration.observe(duration_ms)
+        self._recent.append((started, finished - started))
+
+        self._next_deadline += interval
+        if self._next_deadline > finished:
+            self._catch_up_left = None
+            return
+
+        # Deadlines that already passed, including the next one
+        overdue = int((finished - self._next_deadline) // interval) + 1
+        if self.overrun_policy == 'catch_up' and self._catch_up_left is not None:
+            # This was a catch-up tick: still the same overrun, with what is left of its budget
+            budget = self._catch_up_left
+        else:
+            self.overruns += 1
+            budget = self.max_catch_up
+
+        if self.overrun_policy == 'skip':
+            self._next_deadline += overdue * interval
+            self.missed_ticks += overdue
+        elif self.overrun_policy == 'catch_up':
+            caught_up = min(overdue, budget)
+            dropped = overdue - caught_up
+            self._next_deadline += dropped * interval
+            self.missed_ticks += dropped
+            # The next tick runs right away and uses one catch-up tick
+            self._catch_up_left = caught_up - 1 if caught_up else None
+        else:
+            # One immediate tick stands in for all overdue deadlines
+            self._next_deadline += (overdue - 1) * interval
+            self.coalesced_ticks += overdue - 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self.started_at if self.started_at else 0.0
+            recent_utilization = None
+            if len(self._recent) >= 2:
+                span = now - self._recent[0][0]
+                recent_utilization = round(sum(duration for _, duration in self._recent) / span, 4) if span else None
+            return {
+                'running': self.running,
+                'interval_seconds': self.interval_seconds,
+                'overrun_policy': self.overrun_policy,
+                'max_catch_up': self.max_catch_up,
+                'ticks': self.ticks,
+                'overruns': self.overruns,
+                'missed_ticks': self.missed_ticks,
+                'coalesced_ticks': self.coalesced_ticks,
+                'utilization': round(self.busy_seconds / elapsed, 4) if elapsed else 0.0,
+                'recent_utilization': recent_utilization,
+                'last_lag_ms': round(self.last_lag_ms, 3) if self.last_lag_ms is not None else None,
+                'last_duration_ms': round(self.last_duration_ms, 3) if self.last_duration_ms is not None else None,
+                'next_tick_in_seconds': round(max(self._next_deadline - now, 0.0), 3)
+                if self.running and self._next_deadline is not None else None,
+                'lag': self.lag.snapshot(),
+                'duration': self.duration.snapshot()
+            }
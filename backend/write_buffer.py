@@ -0,0 +1,383 @@
+import atexit
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # No file locks on Windows; fine for a single development server
+    fcntl = None
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+class WriteBehindBuffer:
+    """
+    Write-behind buffer for tick documents
+
+    Ticks add their documents and return at once. A writer thread collects
+    the documents of several ticks and inserts them per collection with one
+    unordered insert_many when flush_records documents are waiting or the
+    oldest has waited flush_seconds. When max_records documents are
+    buffered, add() blocks until the writer catches up.
+
+    If MongoDB is unreachable, flushed batches are appended to a local
+    NDJSON spill file (Extended JSON, so dates and ObjectIds survive) and
+    the writer pings MongoDB every retry_seconds. Once it answers, the
+    spill is replayed before new documents are written. add() gives every
+    document its _id up front, so a batch or replay chunk that is written
+    again after a partial failure raises duplicate key errors, which are
+    ignored, instead of storing a second copy.
+
+    Every gunicorn worker shares the spill file. Appends and the hand-over
+    of the file to a replay hold an exclusive lock on spill_path.lock, and
+    only one process at a time replays (spill_path.replay.lock). The others
+    keep spilling behind it and check again every retry_seconds.
+
+    Replayed documents can be older than the rollup watermark. on_replay is
+    called with the oldest replayed timestamp so those buckets are rolled up
+    again.
+    """
+
+    def __init__(self, collections: Dict, spill_path: str = None, flush_records: int = None,
+                 flush_seconds: float = None, max_records: int = None, retry_seconds: float = None,
+                 on_flush: Optional[Callable[[], None]] = None,
+                 on_replay: Optional[Callable[[datetime], None]] = None):
+        self.collections = collections  # target name -> pymongo collection
+        self.spill_path = spill_path or os.getenv(
+            'WRITE_BUFFER_SPILL_PATH', os.path.join(os.path.dirname(__file__), 'spill', 'write_buffer.ndjson')
+        )
+        self.flush_records = flush_records or int(os.getenv('WRITE_BUFFER_FLUSH_RECORDS', 5000))
+        self.flush_seconds = flush_seconds or float(os.getenv('WRITE_BUFFER_FLUSH_SECONDS', 2))
+        self.max_records = max_records or int(os.getenv('WRITE_BUFFER_MAX_RECORDS', 100000))
+        self.retry_seconds = retry_seconds or float(os.getenv('WRITE_BUFFER_RETRY_SECONDS', 10))
+        self.max_spill_bytes = int(float(os.getenv('WRITE_BUFFER_SPILL_MAX_MB', 1024)) * 1024 * 1024)
+        self.on_flush = on_flush
+        self.on_replay = on_replay
+        self._replayed_since = None  # oldest replayed timestamp not yet passed to on_replay
+
+        self._condition = threading.Condition()
+        self._pending = {name: [] for name in collections}
+        self._buffered = 0
+        self._oldest = None       # monotonic time the oldest buffered document was added
+        self._in_flight = 0       # documents taken by the writer but not yet stored or spilled
+        self._flush_requested = False
+        self._closed = False
+
+        self.online = True
+        self.offline_since = None
+        self._next_retry = 0.0
+        self._spill_pending = os.path.exists(self.spill_path) or os.path.exists(self.spill_path + '.replaying')
+
+        self.flushes = 0
+        self.flushed_records = 0
+        self.last_flush_records = 0
+        self.last_flush_ms = None
+        self.spilled_records = 0
+        self.replayed_records = 0
+        self.duplicate_records = 0
+        self.dropped_records = 0
+        self.write_errors = 0
+        self.blocked_adds = 0
+
+        self._writer_thread = threading.Thread(target=self._run_writer, daemon=True)
+        self._writer_thread.start()
+        atexit.register(self.close, 10)
+
+    def add(self, target: str, documents: List[Dict]):
+        """Queue documents for a collection, waiting while the buffer is full"""
+        if not documents:
+            return
+        for document in documents:
+            if '_id' not in document:
+                document['_id'] = ObjectId()
+        with self._condition:
+            if self._buffered >= self.max_records:
+                self.blocked_adds += 1
+                while self._buffered >= self.max_records and not self._closed:
+                    self._condition.wait()
+
+            self._pending[target].extend(documents)
+            self._buffered += len(documents)
+            if self._oldest is None:
+                # The writer starts the flush_seconds timer for this document
+                self._oldest = time.monotonic()
+                self._condition.notify_all()
+            elif self._buffered >= self.flush_records:
+                self._condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Write everything buffered now; False if it was not stored or spilled within the timeout"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            while self._buffered or self._in_flight:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            self._flush_requested = False
+        return True
+
+    def close(self, timeout: float = None):
+        """Flush and stop accepting documents"""
+        if self._closed:
+            return
+        self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _take_batch(self) -> Dict[str, List[Dict]]:
+        """Wait for a flush trigger and take everything buffered (called with the condition held)"""
+        while True:
+            if self._closed and not self._buffered:
+                return {}
+            if self._buffered and (self._flush_requested or self._buffered >= self.flush_records or
+                                   time.monotonic() - self._oldest >= self.flush_seconds):
+                break
+            if not self.online or self._spill_pending:
+                # Wake up for the next reconnect attempt as well
+                if time.monotonic() >= self._next_retry:
+                    return {}
+                timeout = self._next_retry - time.monotonic()
+            else:
+                timeout = None
+            if self._buffered:
+                age_limit = self.flush_seconds - (time.monotonic() - self._oldest)
+                timeout = age_limit if timeout is None else min(timeout, age_limit)
+            if timeout is not None and timeout <= 0:
+                continue
+            self._condition.wait(timeout)
+
+        batch = {name: documents for name, documents in self._pending.items() if documents}
+        self._pending = {name: [] for name in self.collections}
+        self._in_flight = self._buffered
+        self._buffered = 0
+        self._oldest = None
+        self._flush_requested = False
+        self._condition.notify_all()  # Room for blocked add() calls
+        return batch
+
+    def _run_writer(self):
+        while True:
+            with self._condition:
+                batch = self._take_batch()
+                if self._closed and not batch:
+                    return
+            try:
+                self._reconnect()
+                if batch:
+                    self._write_batch(batch)
+            except Exception as e:
+                self.dropped_records += self._in_flight
+                logger.error(f"Write buffer error, dropped {self._in_flight} documents: {e}")
+            finally:
+                with self._condition:
+                    self._in_flight = 0
+                    self._condition.notify_all()
+
+    def _ping(self) -> bool:
+        collection = next(iter(self.collections.values()))
+        try:
+            collection.database.client.admin.command('ping')
+            return True
+        except Exception:
+            return False
+
+    def _reconnect(self):
+        """While offline or with a spill left over, retry MongoDB and replay the spill"""
+        if (self.online and not self._spill_pending) or time.monotonic() < self._next_retry:
+            return
+        if not self._ping():
+            self._next_retry = time.monotonic() + self.retry_seconds
+            return
+        if self._spill_pending and not self._replay_spill():
+            self._set_offline()
+            return
+        if not self.online:
+            logger.info(f"MongoDB reachable again after {datetime.now() - self.offline_since}")
+        self.online = True
+        self.offline_since = None
+
+    def _set_offline(self):
+        if self.online:
+            logger.error(f"MongoDB unreachable, spilling writes to {self.spill_path}")
+            self.online = False
+            self.offline_since = datetime.now()
+        self._next_retry = time.monotonic() + self.retry_seconds
+
+    def _insert(self, target: str, documents: List[Dict]):
+        """Unordered insert that tolerates documents already written by an earlier attempt"""
+        try:
+            self.collections[target].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            duplicates = sum(1 for error in errors if error.get('code') == DUPLICATE_KEY_ERROR)
+            self.duplicate_records += duplicates
+            if len(errors) > duplicates:
+                # Rejected documents (validation and the like) would fail again; don't spill them
+                self.write_errors += len(errors) - duplicates
+                logger.error(f"{len(errors) - duplicates} {target} documents rejected: {errors[0].get('errmsg')}")
+
+    def _write_batch(self, batch: Dict[str, List[Dict]]):
+        count = sum(len(documents) for documents in batch.values())
+        if not self.online or self._spill_pending:
+            # Keep the spill in order: new documents go behind it until it is replayed
+            self._spill(batch)
+            return
+
+        started = time.perf_counter()
+        written = []
+        try:
+            for target, documents in batch.items():
+                self._insert(target, documents)
+                written.append(target)
+        except PyMongoError as e:
+            logger.error(f"Flush of {count} documents failed: {e}")
+            self._set_offline()
+            self._spill({target: documents for target, documents in batch.items() if target not in written})
+            return
+
+        self.flushes += 1
+        self.flushed_records += count
+        self.last_flush_records = count
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+        if self.on_flush:
+            self.on_flush()
+
+    @contextmanager
+    def _file_lock(self, suffix: str, blocking: bool = True):
+        """Exclusive lock shared with the other processes; yields False if it is taken and not blocking"""
+        os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+        with open(self.spill_path + suffix, 'a') as lock_file:
+            locked = True
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    locked = False
+            yield locked  # Closing the file releases the lock
+
+    def _spill(self, batch: Dict[str, List[Dict]]):
+        count = sum(len(documents) for documents in batch.values())
+        if not count:
+            return
+        try:
+            if self._spill_size() >= self.max_spill_bytes:
+                raise OSError("spill file reached WRITE_BUFFER_SPILL_MAX_MB")
+            with self._file_lock('.lock'), open(self.spill_path, 'a', encoding='utf-8') as spill:
+                for target, documents in batch.items():
+                    for document in documents:
+                        spill.write(json_util.dumps({'target': target, 'document': document}) + '\n')
+            self.spilled_records += count
+            self._spill_pending = True
+        except OSError as e:
+            self.dropped_records += count
+            logger.error(f"Dropped {count} documents, could not spill them: {e}")
+
+    def _spill_size(self) -> int:
+        try:
+            return os.path.getsize(self.spill_path)
+        except OSError:
+            return 0
+
+    def _replay_spill(self) -> bool:
+        """Insert the spilled documents in chunks; False if MongoDB failed again"""
+        with self._file_lock('.replay.lock', blocking=False) as locked:
+            if not locked:
+                # Another worker is replaying; keep spilling behind it and check again later
+                self._next_retry = time.monotonic() + self.retry_seconds
+                return True
+            return self._replay_locked()
+
+    def _replay_locked(self) -> bool:
+        replaying = self.spill_path + '.replaying'
+        if not os.path.exists(replaying):
+            # A file left by an interrupted replay is picked up again first
+            with self._file_lock('.lock'):
+                if not os.path.exists(self.spill_path):
+                    self._spill_pending = False
+                    return True
+                os.replace(self.spill_path, replaying)
+
+        replayed = 0
+        with open(replaying, encoding='utf-8') as spill:
+            while True:
+                lines = [line for line in (spill.readline() for _ in range(self.flush_records)) if line]
+                if not lines:
+                    break
+                chunk = {}
+                oldest = None
+                for line in lines:
+                    entry = json_util.loads(line)
+                    chunk.setdefault(entry['target'], []).append(entry['document'])
+                    timestamp = entry['document'].get('timestamp')
+                    if isinstance(timestamp, datetime) and (oldest is None or timestamp < oldest):
+                        oldest = timestamp
+                try:
+                    for target, documents in chunk.items():
+                        self._insert(target, documents)
+                    if oldest is not None and (self._replayed_since is None or oldest < self._replayed_since):
+                        self._replayed_since = oldest
+                except PyMongoError as e:
+                    logger.error(f"Spill replay interrupted after {replayed} documents: {e}")
+                    # Keep this chunk and the rest as the file the next replay starts with
+                    with open(replaying + '.tmp', 'w', encoding='utf-8') as rest:
+                        rest.writelines(lines)
+                        shutil.copyfileobj(spill, rest)
+                    spill.close()
+                    os.replace(replaying + '.tmp', replaying)
+                    self.replayed_records += replayed
+                    return False
+                replayed += len(lines)
+
+        os.remove(replaying)
+        self.replayed_records += replayed
+        logger.info(f"Replayed {replayed} spilled documents")
+        # Documents other workers spilled meanwhile are replayed on the next pass
+        self._spill_pending = os.path.exists(self.spill_path)
+        if self._replayed_since is not None and self.on_replay:
+            try:
+                self.on_replay(self._replayed_since)
+                self._replayed_since = None
+            except Exception as e:
+                logger.error(f"Error handling replayed documents since {self._replayed_since}: {e}")
+        if replayed and self.on_flush:
+            self.on_flush()
+        return True
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                'online': self.online,
+                'offline_since': self.offline_since.isoformat() if self.offline_since else None,
+                'buffered_records': self._buffered,
+                'in_flight_records': self._in_flight,
+                'max_records': self.max_records,
+                'flush_records': self.flush_records,
+                'flush_seconds': self.flush_seconds,
+                'flushes': self.flushes,
+                'flushed_records': self.flushed_records,
+                'last_flush_records': self.last_flush_records,
+                'last_flush_ms': self.last_flush_ms,
+                'blocked_adds': self.blocked_adds,
+                'spill_path': self.spill_path,
+                'spill_bytes': self._spill_size(),
+                'spill_pending': self._spill_pending,
+                'spilled_records': self.spilled_records,
+                'replayed_records': self.replayed_records,
+                'duplicate_records': self.duplicate_records,
+                'write_errors': self.write_errors,
+                'dropped_records': self.dropped_records
+            }